@@ -10,7 +10,7 @@ from typing import Dict
 
 from llama_index.core.base.llms.types import ChatMessage, MessageRole
 from utils.gen_config import get_llm
-from utils.log_utils import get_logger
+from utils.log_utils import get_logger, log_artifact
 from utils.prompts import ORDER_PROMPT
 from utils.token_counter import TokenCounter, TokenCounterCached
 from utils.gen_config import Config
@@ -669,10 +669,10 @@ class ConsistencyChecker_with_signal:
 
         # Generate response
         messages = [system_prompt, init_prompt] + self.get_order_prompt_messages()
-        logger.info(f"Consistency checker input message: {messages}")
+        log_artifact(logger, "consistency_checker_input", messages)
         resp, token_cnt = self.token_counter.count_chat(messages)
         logger.info(f"Token count: {token_cnt}")
-        logger.info(f"Response: {resp.message.content}")
+        log_artifact(logger, "response", resp.message.content)
         
         #response_content = resp.message.content
         try:
@@ -686,7 +686,7 @@ class ConsistencyChecker_with_signal:
                 output_json_obj: Dict = json.loads(resp.message.content, strict=False)
                 with open(f"{self.exp_dir}/judge_1.txt", "w") as f:
                     f.write(resp.message.content)
-                print(f"output_json_obj: {output_json_obj}")
+                log_artifact(logger, "parsed_response", output_json_obj)
                 
                 if_matches=True if output_json_obj['if_matches']=='yes' else False
                 reason=output_json_obj['reason_for_mismatch']
@@ -788,10 +788,10 @@ class ConsistencyChecker:
 
         # Generate response
         messages = [system_prompt, init_prompt] + self.get_order_prompt_messages()
-        logger.info(f"Consistency checker input message: {messages}")
+        log_artifact(logger, "consistency_checker_input", messages)
         resp, token_cnt = self.token_counter.count_chat(messages)
         logger.info(f"Token count: {token_cnt}")
-        logger.info(f"Response: {resp.message.content}")
+        log_artifact(logger, "response", resp.message.content)
         
         #response_content = resp.message.content
         try:
@@ -805,7 +805,7 @@ class ConsistencyChecker:
                 output_json_obj: Dict = json.loads(resp.message.content, strict=False)
                 with open(f"{self.exp_dir}/judge_1.txt", "w") as f:
                     f.write(resp.message.content)
-                print(f"output_json_obj: {output_json_obj}")
+                log_artifact(logger, "parsed_response", output_json_obj)
                 best_python_code_index=int(output_json_obj['best_python_code'])
                 
                 return best_python_code_index,output_json_obj
@@ -2,8 +2,9 @@ import json
 from typing import Dict
 
 from llama_index.core.base.llms.types import ChatMessage, MessageRole
+from utils.circuit_type import classify_locally, decision_output, load_cached_decision, spec_hash, store_decision
 from utils.gen_config import get_llm
-from utils.log_utils import get_logger
+from utils.log_utils import get_logger, log_artifact
 from utils.prompts import ORDER_PROMPT
 from utils.token_counter import TokenCounter, TokenCounterCached
 
@@ -101,7 +102,7 @@ class CircuitTypeClassifier:
         top_p: float,
     ):
         self.model = model
-        self.llm = get_llm(
+        self.llm_kwargs = dict(
             model=model,
             max_token=max_token,
             provider=provider,
@@ -109,20 +110,53 @@ class CircuitTypeClassifier:
             temperature=temperature,
             top_p=top_p,
         )
+        # created by the first spec the local rules cannot settle
+        self.llm = None
+        self.token_counter = None
+        # self.token_counter.token_cnts['circuit_type_classifier'] = []
+        # self.history = []
+        # self.max_trials = 15
+
+    def init_llm(self) -> None:
+        if self.llm is not None:
+            return
+        self.llm = get_llm(**self.llm_kwargs)
         self.token_counter = (
             TokenCounterCached(self.llm)
             if TokenCounterCached.is_cache_enabled(self.llm)
             else TokenCounter(self.llm)
         )
-        # self.token_counter.token_cnts['circuit_type_classifier'] = []
-        # self.history = []
-        # self.max_trials = 15
 
-    def run(self, input_spec: str) -> Dict:
+    def run(self, input_spec: str, header: str = "") -> Dict:
+        """
+        classification of the spec, by the local rules when they are confident and by the
+        LLM otherwise. The output records the source and the local confidence and evidence.
+        """
+        decision = classify_locally(input_spec, header)
+        logger.info(
+            f"Local classification: {decision.classification}, confidence {decision.confidence:.2f}"
+            f" ({'; '.join(decision.evidence) or 'no evidence'})"
+        )
+        if decision.confident:
+            return decision_output(decision, "local")
+        # the decision of this provider and model, another model may decide otherwise
+        key = spec_hash(input_spec, header, f"{self.llm_kwargs['provider']}/{self.model}")
+        cached = load_cached_decision(key)
+        if cached is not None:
+            logger.info(f"Cached classification of {self.model}: {cached['classification']}")
+            return cached
+        llm_output = self.classify_with_llm(input_spec)
+        if llm_output is None:
+            return None
+        output_json_obj = dict(llm_output, **decision_output(decision, "llm", llm_output["classification"]))
+        store_decision(key, output_json_obj)
+        return output_json_obj
+
+    def classify_with_llm(self, input_spec: str) -> Dict:
+        self.init_llm()
         # self.token_counter.reset()
         if isinstance(self.token_counter, TokenCounterCached):
             self.token_counter.set_enable_cache(True)
-        print(f"Setting token counter tag to {self.__class__.__name__}")
         self.token_counter.set_cur_tag(self.__class__.__name__)
         msg = [
             ChatMessage(content=SYSTEM_PROMPT, role=MessageRole.SYSTEM),
@@ -139,16 +173,11 @@ class CircuitTypeClassifier:
                 role=MessageRole.USER,
             ),
         ]
-        print(f"Generating response ")
         response, token_cnt = self.token_counter.count_chat(msg)
-        print(f"Response: {response.message.content}")
 
         logger.info(f"Token count: {token_cnt}")
-        logger.info(f"{response.message.content}")
+        log_artifact(logger, "response", response.message.content)
         self.token_counter.log_token_stats()
-
-        # response = self.generate(msg)
-        logger.info(f"Get response from {self.model}: {response.message.content}")
         try:
             # output_json_obj: Dict = json.loads(response.message.content, strict=False)
 
@@ -162,9 +191,7 @@ class CircuitTypeClassifier:
             classification = output_json_obj["classification"]
             logger.info(f"Succeed to parse response, Classification: {classification}")
         except json.decoder.JSONDecodeError as e:
-            print(f"Json parse error: {e}")
             logger.info(f"Json parse error: {e}")
-            print(response)
             return None
 
         return output_json_obj
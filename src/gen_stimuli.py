@@ -1,14 +1,16 @@
 import json
-from typing import Dict, List
+from typing import Dict, List, Tuple
 
 from llama_index.core.base.llms.types import ChatMessage, ChatResponse, MessageRole
 from utils.gen_config import get_llm
-from utils.log_utils import get_logger
+from utils.log_utils import get_logger, log_artifact
 from utils.prompts import ORDER_PROMPT
 from utils.token_counter import TokenCounter, TokenCounterCached
+from utils.verilog_ports import conform_stimulus, parse_module_header
 from pydantic import BaseModel
 import utils.python_call as py
 import os
+from testbench_parse import measure_stimulus_coverage
 logger = get_logger(__name__)
 
 
@@ -775,6 +777,18 @@ if __name__ == "__main__":
 """
 
 
+COVERAGE_FEEDBACK_PROMPT = """
+The stimulus generated so far was simulated on a reference implementation of the DUT and reached {covered} of {total} line coverage points. These lines and branches of the reference implementation were never executed:
+
+<uncovered_lines>
+{uncovered}
+</uncovered_lines>
+
+Write the stimulus_gen method for new scenarios that drive the DUT into these lines and branches. The scenarios below were already generated, do not repeat them:
+{scenarios}
+"""
+
+
 class TBOutputFormat(BaseModel):
     reasoning: str
     stimulus_gen_code: str
@@ -805,13 +819,14 @@ class TB_Generator:
             if TokenCounterCached.is_cache_enabled(self.llm)
             else TokenCounter(self.llm)
         )
+        self.token_counter.set_cur_tag(self.__class__.__name__)
 
         self.dir_path = dir_path
 
     def parse_output(self, response: ChatResponse) -> TBOutputFormat:
         try:
             output_json_obj: Dict = json.loads(response.message.content, strict=False)
-            print(output_json_obj)
+            log_artifact(logger, "parsed_response", output_json_obj)
             ret = TBOutputFormat(
                 reasoning=output_json_obj["reasoning"],
                 stimulus_gen_code=output_json_obj["stimulus_gen_code"],
@@ -821,10 +836,10 @@ class TB_Generator:
             return TBOutputFormat(reasoning="", stimulus_gen_code="")
 
     def generate(self, messages: List[ChatMessage]) -> ChatResponse:
-        logger.info(f" input message: {messages}")
+        log_artifact(logger, "input_messages", messages)
         resp, token_cnt = self.token_counter.count_chat(messages)
         logger.info(f"Token count: {token_cnt}")
-        logger.info(f"{resp.message.content}")
+        log_artifact(logger, "response", resp.message.content)
         return resp
 
     def run(
@@ -833,79 +848,136 @@ class TB_Generator:
         header: str,
         circuit_type: str = "SEQ",
         stimuli_sampling_size: int = 1,
+        coverage_target: float | None = None,
     ) -> str:
+        """
+        Draw stimuli_sampling_size stimulus samples and save them to stimulus.json.
+
+        With a coverage_target in [0, 1], the samples are coverage directed: after each
+        sample the stimulus so far is simulated on the reference top.v, and the next sample
+        is asked to reach the uncovered lines. Sampling stops early once the line coverage
+        reaches coverage_target or stops improving.
+        """
         stimulus_result=[]
+        feedback = ""
+        best_covered = -1
         for i in range(stimuli_sampling_size):
-            if circuit_type == "SEQ":
-                msg = [
-                    ChatMessage(content=SEQ_SYSTEM_PROMPT, role=MessageRole.SYSTEM),
-                    ChatMessage(
-                    content=SEQ_GENERATION_PROMPT.format(
-                        description=input_spec,
-                        module_header=header,
-                        example=SEQ_ONE_SHOT_EXAMPLE,
-                        instruction=SEQ_Instructions_for_Python_Code,
-                       
+            stimulus, response = self.generate_sample(input_spec, header, circuit_type, feedback)
+            stimulus_result = stimulus_result + stimulus
+            if coverage_target is None:
+                continue
+
+            coverage = measure_stimulus_coverage(self.dir_path, circuit_type, stimulus_result)
+            if coverage is None:
+                logger.warning("Stimulus coverage unavailable, drawing the remaining samples undirected")
+                coverage_target = None
+                continue
+            logger.info(f"Stimulus coverage after sample {i}: {coverage['covered']}/{coverage['total']}")
+            if coverage["ratio"] >= coverage_target:
+                logger.info(f"Coverage target {coverage_target} reached after {i + 1} sample(s)")
+                break
+            if coverage["covered"] <= best_covered:
+                logger.info(f"Coverage saturated after {i + 1} sample(s)")
+                break
+            best_covered = coverage["covered"]
+            feedback = self.coverage_feedback(coverage, stimulus_result)
+
+        with open(self.dir_path+"/stimulus.json", "w") as f:
+            json.dump(stimulus_result, f, indent=4)
+        return stimulus_result
+
+    def coverage_feedback(self, coverage: Dict, stimulus_result: List[Dict], max_lines: int = 40) -> str:
+        uncovered = "\n".join(
+            f"line {point['line']} ({point['kind']}): {point.get('source', '')}"
+            for point in coverage["uncovered"][:max_lines]
+        )
+        return COVERAGE_FEEDBACK_PROMPT.format(
+            covered=coverage["covered"],
+            total=coverage["total"],
+            uncovered=uncovered,
+            scenarios=", ".join(str(s.get("scenario")) for s in stimulus_result),
+        )
+
+    def generate_sample(
+        self,
+        input_spec: str,
+        header: str,
+        circuit_type: str = "SEQ",
+        feedback: str = "",
+    ) -> Tuple[List[Dict], ChatResponse]:
+        if circuit_type == "SEQ":
+            msg = [
+                ChatMessage(content=SEQ_SYSTEM_PROMPT, role=MessageRole.SYSTEM),
+                ChatMessage(
+                content=SEQ_GENERATION_PROMPT.format(
+                    description=input_spec,
+                    module_header=header,
+                    example=SEQ_ONE_SHOT_EXAMPLE,
+                    instruction=SEQ_Instructions_for_Python_Code,
+                   
+                ),
+                role=MessageRole.USER,
+            ),
+        ]
+        
+            if feedback:
+                msg.append(ChatMessage(content=feedback, role=MessageRole.USER))
+            msg.append(
+                ChatMessage(
+                    content=ORDER_PROMPT.format(
+                        output_format="".join(json.dumps(SEQ_EXAMPLE_OUTPUT, indent=4))
                     ),
                     role=MessageRole.USER,
-                ),
-            ]
-            
-                msg.append(
-                    ChatMessage(
-                        content=ORDER_PROMPT.format(
-                            output_format="".join(json.dumps(SEQ_EXAMPLE_OUTPUT, indent=4))
-                        ),
-                        role=MessageRole.USER,
-                    )
                 )
-
-                response = self.generate(msg)
-            # Ensure necessary imports are added before generating code
-                stimulus_py_code = (
-                SEQ_python_code_header+ "\n" + self.parse_output(response).stimulus_gen_code + SEQ_tail
             )
-            
-            else:
-                msg = [
-                    ChatMessage(content=SYSTEM_PROMPT, role=MessageRole.SYSTEM),
-                    ChatMessage(content=GENERATION_PROMPT.format(
-                        description=input_spec,
-                        module_header=header,   
-                        example=ONE_SHOT_EXAMPLE,
-                        instruction=Instructions_for_Python_Code
-                       
+
+            response = self.generate(msg)
+        # Ensure necessary imports are added before generating code
+            stimulus_py_code = (
+            SEQ_python_code_header+ "\n" + self.parse_output(response).stimulus_gen_code + SEQ_tail
+        )
+        
+        else:
+            msg = [
+                ChatMessage(content=SYSTEM_PROMPT, role=MessageRole.SYSTEM),
+                ChatMessage(content=GENERATION_PROMPT.format(
+                    description=input_spec,
+                    module_header=header,   
+                    example=ONE_SHOT_EXAMPLE,
+                    instruction=Instructions_for_Python_Code
+                   
+                ),
+                role=MessageRole.USER,
+            ),
+        ]   
+            if feedback:
+                msg.append(ChatMessage(content=feedback, role=MessageRole.USER))
+            msg.append(
+                ChatMessage(
+                    content=ORDER_PROMPT.format(
+                        output_format="".join(json.dumps(EXAMPLE_OUTPUT, indent=4))
                     ),
                     role=MessageRole.USER,
-                ),
-            ]   
-                msg.append(
-                    ChatMessage(
-                        content=ORDER_PROMPT.format(
-                            output_format="".join(json.dumps(EXAMPLE_OUTPUT, indent=4))
-                        ),
-                        role=MessageRole.USER,
-                    )
                 )
-                response = self.generate(msg)
-            
-                
-            # Ensure necessary imports are added before generating code
-                stimulus_py_code = (
-                python_code_header+ "\n" + self.parse_output(response).stimulus_gen_code + tail
             )
-            print(f"Response: {response.message.content}")
-            sampling_stimulus_python_path = self.dir_path+f"/stimulus.py"
-            print(f"stimulus_py_code: {stimulus_py_code}")
-            with open(sampling_stimulus_python_path, "w") as f:
-                f.write(stimulus_py_code)
-            py.python_call_and_save(
-                f"{sampling_stimulus_python_path}", silent=True
-            )
-            with open(sampling_stimulus_python_path.replace(".py", ".json"), "r") as f:
-                stimulus_result= stimulus_result+json.load(f)
+            response = self.generate(msg)
+        
             
-        with open(self.dir_path+"/stimulus.json", "w") as f:
-            json.dump(stimulus_result, f, indent=4)
-        logger.info(f"Get response from {self.model}: {response}")
-        return stimulus_result
+        # Ensure necessary imports are added before generating code
+            stimulus_py_code = (
+            python_code_header+ "\n" + self.parse_output(response).stimulus_gen_code + tail
+        )
+        sampling_stimulus_python_path = self.dir_path+f"/stimulus.py"
+        log_artifact(logger, "stimulus_py_code", stimulus_py_code)
+        with open(sampling_stimulus_python_path, "w") as f:
+            f.write(stimulus_py_code)
+        py.python_call_and_save(
+            f"{sampling_stimulus_python_path}", silent=True
+        )
+        with open(sampling_stimulus_python_path.replace(".py", ".json"), "r") as f:
+            stimulus = json.load(f)
+        # Names and widths of the header, whatever the generated code produced
+        stimulus, issues = conform_stimulus(stimulus, parse_module_header(header))
+        for issue in issues:
+            logger.warning(f"Stimulus: {issue}")
+        return stimulus, response
@@ -1,6 +1,9 @@
 import argparse
+import contextvars
 import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import utils.python_call as py
 from classify_circuit_type import CircuitTypeClassifier
@@ -9,11 +12,18 @@ from src.gen_stimuli import TB_Generator
 
 from check_consistency import ConsistencyChecker,ConsistencyChecker_with_signal
 from utils.gen_config import Config
-from utils.log_utils import get_logger, set_log_dir, switch_log_to_file
+from utils.log_utils import get_logger, log_artifact, set_log_dir, switch_log_to_file
+from utils.tracing import set_span_attributes, span, write_chrome_trace, write_trace_summary
+from utils.artifact_store import ArtifactStore, TaskArtifacts
+from utils.run_ledger import ARTIFACTS, RunLedger, TaskRecord, testbench_steps
+from utils.task_scheduler import expected_durations, order_tasks
+from utils.tracing import stage_durations
+from utils.usage_registry import UsageTotal, usage_registry
+from utils.work_queue import POLL_SECONDS, LeaseLost, WorkQueue, default_worker_id
 from pychecker import PyChecker
 from pychecker_seq import PyChecker_SEQ
 from tb_extract import TBExtractor
-from testbench_parse import process_testbench, create_testbench_json, create_testbench_json_cmb,get_prob_spec,simulate_dut_cmb,simulate_dut_seq,compare_scenarios_seq, compare_scenarios_cmb,split_test_cases,filter_inconsistencies
+from testbench_parse import process_testbench, create_testbench_json, create_testbench_json_cmb,get_prob_spec,simulate_dut_cmb,simulate_dut_seq,format_sim_feedback,lockstep_simulate,reference_testbench,compare_scenarios_seq, compare_scenarios_cmb,split_test_cases,filter_inconsistencies
 from refine_python_agent import RefinePythonAgent
 from judge_for_RTL import JudgeForRTL
 import random
@@ -56,139 +66,214 @@ args_dict = {
     "folder_path": "../verilog-eval/HDLBits/HDLBits_data_backup0304.jsonl",
     "run_identifier": "gen_tb",
     "key_cfg_path": "../key.cfg",
+    # expected outputs from simulating the reference RTL (module_code) instead of LLM-generated checkers
     "use_golden_ref": False,
     'sampling_size': 5,
     "circuit_type": "SEQ",
     'stimuli_sampling_size': 3,
+    # None: draw every stimulus sample, a ratio in [0, 1]: coverage-directed sampling of at
+    # most stimuli_sampling_size samples, stopping at this line coverage of top.v
+    "stimuli_coverage_target": None,
     "max_trials": 6,
     "stage": 0,
     "day": "20250408",
     "dut": False,
+    # drive top.v as an in-process shared library next to the GoldenDUT in the dut loop,
+    # instead of generating a testbench harness for every refined checker
+    "dut_lockstep": False,
+    # SQLite ledger of the task outcomes, durations and costs of every run, see utils/run_ledger.py
+    "ledger_path": "run_ledger.db",
+    # skip the tasks whose latest ledger record of this run_identifier passed
+    "skip_passed": False,
+    # tasks run concurrently, the longest expected first, see utils/task_scheduler.py
+    "num_workers": 1,
+    # content-addressed store of the task artifacts shared by the runs, see utils/artifact_store.py
+    "artifact_store": "artifact_store",
+    # also pack the manifest and artifacts of every task into <output_dir>/<task>.tar
+    "pack_artifacts": False,
+    # SQLite work queue on storage shared by the nodes of a sweep, None: run the tasks locally,
+    # see utils/work_queue.py
+    "queue_path": None,
+    # name of this node in the queue, None: <hostname>:<pid>
+    "worker_id": None,
 }
 
 
-
-
-def main():
-    args = argparse.Namespace(**args_dict)
-    #day=args.day
-    if args.circuit_type == "CMB":
-        circuit_type = "CMB" 
-    else:
-        circuit_type = "SEQ"
-    Config(args.key_cfg_path)
-    switch_log_to_file()
-    timestamp = "20250510"
-    output_dir = f"output_tb_{args.run_identifier}_{timestamp}"
-    log_dir = f"log_tb_{args.run_identifier}_{timestamp}"
-    os.makedirs(output_dir, exist_ok=True)
-    os.makedirs(log_dir, exist_ok=True) 
+def sim_outcome(sim_results):
+    if sim_results is None:
+        return "not_simulated"
+    if sim_results.get("unpass") is None:
+        return "no_results"
+    return "passed" if sim_results["passed"] else "failed"
+
+
+def ledger_record(task_number, circuit_type, output_dir_per_task, input_spec, sim_results, duration, trials, artifacts,
+                  reference=False, dut_sim_results=None, dut_ran=False):
+    """
+    TaskRecord of a finished task, with its stage durations and costs of this run. The outcome
+    is the stage 3 verdict reported in success_list, dut_outcome the last verdict of the dut loop.
+    """
+    usage = usage_registry.totals("task").get((str(task_number),), UsageTotal())
+    outcome = "reference" if reference else sim_outcome(sim_results)
+    return TaskRecord(
+        task=str(task_number),
+        passed=outcome == "passed",
+        outcome=outcome,
+        dut_outcome=sim_outcome(dut_sim_results) if dut_ran else "",
+        circuit_type=circuit_type,
+        duration=duration,
+        trials=trials,
+        cost=usage.cost,
+        in_tokens=usage.in_tokens,
+        out_tokens=usage.out_tokens,
+        spec_chars=len(input_spec),
+        testbench_steps=testbench_steps(f"{output_dir_per_task}/testbench_0.json"),
+        stages=stage_durations(task_number),
+        artifacts=artifacts.digests(ARTIFACTS),
+    )
+
+
+
+
+def check_lease(lease_lost, task_number, stage):
+    """raise LeaseLost before stage once the lease of a queued task is lost, another worker may run it"""
+    if lease_lost is not None and lease_lost.is_set():
+        raise LeaseLost(f"lease of task {task_number} lost before {stage}")
+
+
+def run_task(args, task_number, circuit_type, output_dir, log_dir, ledger, run_id, store, lease_lost=None):
+    """
+    Run every stage of one task, returns whether its testbench passed top.v and the
+    checker correctness verdicts of the dut loop. Tasks run concurrently with num_workers > 1.
+    lease_lost is the heartbeat event of a queued task, the task stops between stages once it is set.
+    """
+    task_start = time.time()
+    trials = 0
+    passed = False
     python_correctness_list = []
-    success_list=[]
-    for task_number in args.task_numbers:
-       
-
-        task_id = task_number
-        output_dir_per_task = f"{output_dir}/{task_id}"
-        log_dir_per_task = f"{log_dir}/{task_id}"
-        os.makedirs(output_dir_per_task, exist_ok=True)
-        os.makedirs(log_dir_per_task, exist_ok=True)
-        set_log_dir(log_dir_per_task)
-        input_spec, header, module_code = get_prob_spec(output_dir_per_task,task_number)
-        with open(f"{output_dir_per_task}/spec.txt", "w") as f:
-            f.write(input_spec)
-        with open(f"{output_dir_per_task}/module_header.txt", "w") as f:
-            f.write(header)
-        with open(f"{output_dir_per_task}/top.v", "w") as f:
-            f.write(module_code)
-        if args.stage <=2:
+   
+
+    task_id = task_number
+    output_dir_per_task = f"{output_dir}/{task_id}"
+    sim_results = None
+    dut_sim_results = None
+    log_dir_per_task = f"{log_dir}/{task_id}"
+    os.makedirs(output_dir_per_task, exist_ok=True)
+    os.makedirs(log_dir_per_task, exist_ok=True)
+    set_log_dir(log_dir_per_task)
+    artifacts = TaskArtifacts(store, output_dir_per_task, f"{output_dir}/{task_id}")
+    input_spec, header, module_code = get_prob_spec(output_dir_per_task,task_number)
+    artifacts.save("spec.txt", input_spec)
+    artifacts.save("module_header.txt", header)
+    artifacts.save("top.v", module_code)
+    if args.stage <=2:
 
-            
-            
-            tb_genarator = TB_Generator(
+        
+        
+        tb_genarator = TB_Generator(
+            model=args.model,
+            max_token=8192,
+            provider=args.provider,
+            cfg_path=args.key_cfg_path,
+            dir_path=output_dir_per_task,
+            temperature=args.temperature,
+            top_p=args.top_p,
+        )
+
+
+        tb_extractor = TBExtractor(
                 model=args.model,
                 max_token=8192,
                 provider=args.provider,
                 cfg_path=args.key_cfg_path,
-                dir_path=output_dir_per_task,
                 temperature=args.temperature,
                 top_p=args.top_p,
             )
 
-
-            tb_extractor = TBExtractor(
-                    model=args.model,
-                    max_token=8192,
-                    provider=args.provider,
-                    cfg_path=args.key_cfg_path,
-                    temperature=args.temperature,
-                    top_p=args.top_p,
-                )
-
-            circuit_type_classifier = CircuitTypeClassifier(
-                model=args.model,
-                max_token=8192,
-                provider=args.provider,
-                cfg_path=args.key_cfg_path,
-                temperature=args.temperature,
-                top_p=args.top_p,
-            )
-            refine_python_agent = RefinePythonAgent(
-                model=args.model,
-                max_token=8192,
-                provider=args.provider,
-                cfg_path=args.key_cfg_path,
-                temperature=args.temperature_sample,
-                top_p=args.top_p_sample,
-                exp_dir=output_dir_per_task,
-                task_numbers=args.task_numbers,
-            )
-            
-            if not args.circuit_type:
-                circuit_type_output_json_obj = circuit_type_classifier.run(input_spec)
+        circuit_type_classifier = CircuitTypeClassifier(
+            model=args.model,
+            max_token=8192,
+            provider=args.provider,
+            cfg_path=args.key_cfg_path,
+            temperature=args.temperature,
+            top_p=args.top_p,
+        )
+        refine_python_agent = RefinePythonAgent(
+            model=args.model,
+            max_token=8192,
+            provider=args.provider,
+            cfg_path=args.key_cfg_path,
+            temperature=args.temperature_sample,
+            top_p=args.top_p_sample,
+            exp_dir=output_dir_per_task,
+            task_numbers=args.task_numbers,
+        )
+        
+        if not args.circuit_type:
+            with span("stage.classify", task=task_number):
+                circuit_type_output_json_obj = circuit_type_classifier.run(input_spec, header)
                 circuit_type = circuit_type_output_json_obj["classification"]
-           
-        if args.stage <= 0:
+                set_span_attributes(
+                    source=circuit_type_output_json_obj["source"],
+                    confidence=circuit_type_output_json_obj["local_confidence"],
+                )
+                artifacts.save("circuit_type.json", circuit_type_output_json_obj)
+       
+    check_lease(lease_lost, task_number, "spec_refine")
+    if args.stage <= 0:
+        with span("stage.spec_refine", task=task_number):
             refined_input_spec = tb_extractor.run(input_spec)
-            with open(f"{output_dir_per_task}/spec.txt", "w") as f:
-                f.write(refined_input_spec["revised_spec"])
+            artifacts.save("spec.txt", refined_input_spec["revised_spec"])
             input_spec = refined_input_spec["revised_spec"]
+        
+       
             
-           
-                
-        if args.stage <= 1:
-            
-            
+    check_lease(lease_lost, task_number, "stimuli")
+    if args.stage <= 1:
+        
+        
+        with span("stage.stimuli", task=task_number):
             stimulus_result = tb_genarator.run(
                         input_spec,
                         header,
                         circuit_type,
                         stimuli_sampling_size=args.stimuli_sampling_size,
-                        
+                        coverage_target=args.stimuli_coverage_target,
+                    
                     )
-        
-            #print(f"stimulus_result: {stimulus_result}")
-        if args.stage <= 2:
-            gen_python_code_list=[]
-            if circuit_type == "CMB":
-                py_checker = PyChecker(
+            artifacts.record("stimulus.json")
+    
+        #print(f"stimulus_result: {stimulus_result}")
+    check_lease(lease_lost, task_number, "checker")
+    if args.stage <= 2 and args.use_golden_ref:
+        # The reference RTL is trusted: its simulated outputs are the expected outputs,
+        # no checker is generated or refined
+        with span("stage.reference", task=task_number):
+            if reference_testbench(output_dir_per_task, circuit_type) is None:
+                logger.error(f"Cannot record the outputs of the reference RTL of task {task_number}")
+            artifacts.record("testbench_0.json")
+    elif args.stage <= 2:
+        gen_python_code_list=[]
+        if circuit_type == "CMB":
+            py_checker = PyChecker(
+            model=args.model,
+            max_token=8192,
+            provider=args.provider,
+            cfg_path=args.key_cfg_path,
+            temperature=args.temperature_sample,
+            top_p=args.top_p_sample,
+        )
+        else:
+            py_checker_seq = PyChecker_SEQ(
                 model=args.model,
                 max_token=8192,
                 provider=args.provider,
                 cfg_path=args.key_cfg_path,
                 temperature=args.temperature_sample,
-                top_p=args.top_p_sample,
-            )
-            else:
-                py_checker_seq = PyChecker_SEQ(
-                    model=args.model,
-                    max_token=8192,
-                    provider=args.provider,
-                    cfg_path=args.key_cfg_path,
-                    temperature=args.temperature_sample,
-                top_p=args.top_p_sample,
-            )
-            for sampling_index in range(args.sampling_size):
+            top_p=args.top_p_sample,
+        )
+        for sampling_index in range(args.sampling_size):
+            with span("stage.checker_gen", task=task_number, candidate=sampling_index):
                 python_path = os.path.join(output_dir_per_task, f"pychecker_{sampling_index}.py")
                 print(f"python_path: {python_path}")   
 
@@ -197,41 +282,42 @@ def main():
                 else:
                     gen_python_code=py_checker_seq.run(input_spec, header, python_path, circuit_type)
                 gen_python_code_list.append(gen_python_code)
-            with open(f"{output_dir_per_task}/gen_python_code_list.txt", "w") as f:
-                f.write(str(gen_python_code_list))
+                artifacts.record(f"pychecker_{sampling_index}.py")
+        artifacts.save("gen_python_code_list.json", gen_python_code_list)
 
-            
-            
-            
-            
-                # subproc_call(f"cd {output_dir_per_task}", timeout=120)
-                # subproc_call(f"cd {output_dir_per_task}", timeout=120)
-            
         
         
-            for trial in range(args.max_trials):
+        
+        
+            # subproc_call(f"cd {output_dir_per_task}", timeout=120)
+            # subproc_call(f"cd {output_dir_per_task}", timeout=120)
+        
+    
+    
+        for trial in range(args.max_trials):
+            with span("stage.checker_refine", task=task_number, trial=trial):
+                trials += 1
                 output_results = []
-                
+            
                 for sampling_index in range(args.sampling_size):
-                    output_results.append(
-                        py.python_call_and_save(
-                            f"{output_dir_per_task}/pychecker_{sampling_index}.py", silent=True, timeout=120
+                    with span("checker.run", candidate=sampling_index):
+                        output_results.append(
+                            py.python_call_and_save(
+                                f"{output_dir_per_task}/pychecker_{sampling_index}.py", silent=True, timeout=120
+                            )
                         )
-                    )
 
 
                 try:
                     output_str = "\n".join(str(result) for result in output_results)
-                    output_file_path = os.path.join(output_dir_per_task, f"our_output.txt")
-                    with open(output_file_path, "w") as output_file:
-                            output_file.write(output_str)
+                    artifacts.save("our_output.txt", output_str)
                 except Exception as e:
                         logger.error(f"Error writing output file: {e}")
                         logger.error(f"Output results: {output_results}")
-                    
-
-                
                 
+
+            
+            
                 result_address = os.path.join(output_dir_per_task, f"our_output.txt")
 
 
@@ -248,20 +334,21 @@ def main():
                         f"{output_dir_per_task}/our_output.txt",
                         range(args.sampling_size),
                     )
-                    
-                    
+                
+                
                 else:
                     create_testbench_json(
                         f"{output_dir_per_task}/stimulus.json",
                         f"{output_dir_per_task}/our_output.txt",
                         range(args.sampling_size),
                     )
-                
-                
-                
+                for sampling_index in range(args.sampling_size):
+                    artifacts.record(f"testbench_{sampling_index}.json")
+            
+            
+            
                 consistency_checker = ConsistencyChecker(args.model, args.max_token, args.provider, args.key_cfg_path, args.top_p, args.temperature, output_dir_per_task, task_number)
-                with open(f"{output_dir_per_task}/gen_python_code_list.txt", "r") as f:
-                    gen_python_code_list=eval(f.read())
+                gen_python_code_list=artifacts.load("gen_python_code_list.json")
                 diff_gen_python_code_list=[]
                 for idx in index_list:
                     diff_gen_python_code_list.append(gen_python_code_list[idx])
@@ -271,7 +358,7 @@ def main():
                 different_log=[]
                 for idx in range(len(diff_gen_python_code_list)):
                     different_log.append(f"the {idx} python code is \n"+str(diff_gen_python_code_list[idx]))
-                print(f"different_log: {different_log}")
+                log_artifact(logger, "different_log", different_log)
 
                 max_score_idx,_=consistency_checker.run(different_log)
                 consistency_checker_with_signal = ConsistencyChecker_with_signal(args.model, args.max_token, args.provider, args.key_cfg_path, args.top_p, args.temperature, output_dir_per_task, task_number)
@@ -283,11 +370,11 @@ def main():
                 judge_report="The python code is not matched with the signal, please fix the python code"
                 judge_report+=f"reason: {reason}"
                 judge_report+=f"suggestion: {suggestion}"
-                print(f"judge_report: {judge_report}")
-                print(f"max_score_idx: {max_score_idx}")
+                log_artifact(logger, "judge_report", judge_report)
+                logger.info(f"max_score_idx: {max_score_idx}")
                 if if_matches:
-                    os.system(f"cp {output_dir_per_task}/pychecker_{max_score_idx}.py {output_dir_per_task}/pychecker_{0}.py")
-                    os.system(f"cp {output_dir_per_task}/testbench_{max_score_idx}.json {output_dir_per_task}/testbench_{0}.json")
+                    artifacts.copy(f"pychecker_{max_score_idx}.py", f"pychecker_{0}.py")
+                    artifacts.copy(f"testbench_{max_score_idx}.json", f"testbench_{0}.json")
                     break
                 refine_python_agent = RefinePythonAgent(
                 model=args.model,
@@ -305,63 +392,64 @@ def main():
                 gen_python_code_list=[]
                 for idx in range(args.sampling_size):
                     refined_python_code,python_body=refine_python_agent.run(circuit_type,input_spec, select_python_code,judge_report)
-                    with open(f"{output_dir_per_task}/pychecker_{idx}.py", "w") as f:
-                        f.write(refined_python_code)
+                    artifacts.save(f"pychecker_{idx}.py", refined_python_code)
                     gen_python_code_list.append(python_body)
-                with open(f"{output_dir_per_task}/gen_python_code_list.txt", "w") as f:
-                    f.write(str(gen_python_code_list))
+                artifacts.save("gen_python_code_list.json", gen_python_code_list)
 
 
-        if args.stage <= 3:
-            
+    # testbench_0.json of a golden reference are the outputs of top.v itself, simulating
+    # top.v against them would always pass and count the task as verified
+    check_lease(lease_lost, task_number, "simulate")
+    if args.stage <= 3 and not args.use_golden_ref:
+        
+        with span("stage.simulate", task=task_number):
             if circuit_type == "CMB":
-                simulate_dut_cmb(output_dir_per_task)
-                with open(f"{output_dir_per_task}/simulate_cmb.log", "r") as f:
-                    simulate_cmb_result=f.read()
-                if "Unpass: 0" in simulate_cmb_result:
-                    success_list.append(task_number)
-                    print(f"task_number: {task_number} is success!!")
-                    print(f"success_list: {success_list}")
-                else:
-                    print(f"task_number: {task_number} is failed!!")
+                sim_results = simulate_dut_cmb(output_dir_per_task)
             else:
-                simulate_dut_seq(output_dir_per_task)
-                with open(f"{output_dir_per_task}/simulate_seq.log", "r") as f:
-                    simulate_seq_result=f.read()
-                if "Unpass: 0" in simulate_seq_result:
-                    success_list.append(task_number)
-                    print(f"task_number: {task_number} is success!!")
-                    print(f"success_list: {success_list}")
-                else:
-                    print(f"task_number: {task_number} is failed!!")
-        
-        
-        
-        
-        if args.dut:
-          judge_for_rtl = JudgeForRTL(
-                model=args.model,
-                max_token=8192,
-                provider=args.provider,
-                cfg_path=args.key_cfg_path,
-                temperature=args.temperature,
-                top_p=args.top_p,
-            )
-          for trial in range(3):
+                sim_results = simulate_dut_seq(output_dir_per_task)
+        if sim_results and sim_results["passed"]:
+            passed = True
+            print(f"task_number: {task_number} is success!!")
+        else:
+            print(f"task_number: {task_number} is failed!!")
+    
+    
+    
+    
+    # The dut loop refines the checker against top.v, there is none with a golden reference
+    if args.dut and not args.use_golden_ref:
+      judge_for_rtl = JudgeForRTL(
+            model=args.model,
+            max_token=8192,
+            provider=args.provider,
+            cfg_path=args.key_cfg_path,
+            temperature=args.temperature,
+            top_p=args.top_p,
+        )
+      dut_sim_results = sim_results
+      for trial in range(3):
+        check_lease(lease_lost, task_number, f"dut_refine trial {trial}")
+        with span("stage.dut_refine", task=task_number, trial=trial):
+            trials += 1
             with open(f"{output_dir_per_task}/pychecker_{0}.py", "r") as f:
                 gen_python_code=f.read()
-            
+        
 
-            
-            
+        
+        
             with open(f"{output_dir_per_task}/spec.txt", "r") as f:
                 input_spec=f.read()
             with open(f"{output_dir_per_task}/top.v", "r") as f:
                 rtl_code = f.read()
-            refined_python_code, python_correctness = judge_for_rtl.run(input_spec, rtl_code, gen_python_code, circuit_type)
+            sim_feedback = format_sim_feedback(dut_sim_results) if dut_sim_results else ""
+            refined_python_code, python_correctness = judge_for_rtl.run(input_spec, rtl_code, gen_python_code, circuit_type, sim_feedback)
             python_correctness_list.append(python_correctness)
-            with open(f"{output_dir_per_task}/pychecker_{0}.py", "w") as f:
-                f.write(refined_python_code)
+            artifacts.save(f"pychecker_{0}.py", refined_python_code)
+            if args.dut_lockstep:
+                # Falls back to the harness flow below if the library or the checker cannot be loaded
+                dut_sim_results = lockstep_simulate(output_dir_per_task, circuit_type)
+                if dut_sim_results is not None:
+                    continue
             output_results=[]
             output_results.append(
                             py.python_call_and_save(
@@ -370,13 +458,11 @@ def main():
             )
             try:
                 output_str = "\n".join(str(result) for result in output_results)
-                output_file_path = os.path.join(output_dir_per_task, f"refined_our_output.txt")
-                with open(output_file_path, "w") as output_file:
-                        output_file.write(output_str)
+                artifacts.save("refined_our_output.txt", output_str)
             except Exception as e:
                     logger.error(f"Error writing output file: {e}")
                     logger.error(f"Output results: {output_results}")
-            
+        
             result_address = os.path.join(output_dir_per_task, f"refined_our_output.txt")
             if circuit_type == "CMB":
                 create_testbench_json_cmb(
@@ -391,18 +477,134 @@ def main():
                         [0],
                     )
             if circuit_type == "CMB":
-                simulate_dut_cmb(output_dir_per_task)
+                dut_sim_results = simulate_dut_cmb(output_dir_per_task)
             else:
-                simulate_dut_seq(output_dir_per_task)
+                dut_sim_results = simulate_dut_seq(output_dir_per_task)
+
+    for name in ARTIFACTS:
+        # testbench_0.json of the dut loop, stimulus.json of a later stage, ...
+        artifacts.record(name)
+    # the worker that leased the task again records and packs it
+    check_lease(lease_lost, task_number, "record")
+    ledger.record_task(run_id, ledger_record(
+        task_number, circuit_type, output_dir_per_task, input_spec, sim_results, time.time() - task_start, trials,
+        artifacts, reference=args.use_golden_ref, dut_sim_results=dut_sim_results,
+        dut_ran=args.dut and not args.use_golden_ref,
+    ))
+    if args.pack_artifacts:
+        artifacts.pack(f"{output_dir}/{task_id}.tar")
+    return passed, python_correctness_list
+
+
+def queue_worker(args, queue, worker, circuit_type, output_dir, log_dir, ledger, run_id, store):
+    """
+    Lease and run the tasks of the sweep until none is unfinished, returns the tasks
+    that passed and the checker correctness verdicts of the tasks run by this worker.
+    """
+    passed_tasks = []
+    python_correctness_list = []
+    while True:
+        lease = queue.lease(args.run_identifier, worker)
+        if lease is None:
+            if not queue.unfinished(args.run_identifier):
+                return passed_tasks, python_correctness_list
+            # The rest is leased by other workers, wait for them to finish or their leases to expire
+            time.sleep(POLL_SECONDS)
+            continue
+        logger.info(f"{worker} leased task {lease.task} (attempt {lease.attempt})")
+        try:
+            with queue.heartbeat(lease) as lost:
+                passed, task_python_correctness = contextvars.copy_context().run(
+                    run_task, args, lease.task, circuit_type, output_dir, log_dir, ledger, run_id, store, lost,
+                )
+        except LeaseLost as e:
+            # the task is neither recorded nor completed, it belongs to the worker that leased it again
+            logger.warning(f"Task {lease.task} stopped: {e}")
+            continue
+        except Exception as e:
+            logger.error(f"Task {lease.task} raised {e!r}, it is given back to the queue")
+            queue.release(lease, repr(e))
+            continue
+        if not queue.complete(lease, passed):
+            logger.warning(f"Task {lease.task} finished after its lease expired, another worker may have run it")
+        python_correctness_list += task_python_correctness
+        if passed:
+            passed_tasks.append(lease.task)
 
 
-                    
-            
-            
-            
+def main():
+    args = argparse.Namespace(**args_dict)
+    #day=args.day
+    if args.circuit_type == "CMB":
+        circuit_type = "CMB" 
+    else:
+        circuit_type = "SEQ"
+    Config(args.key_cfg_path)
+    switch_log_to_file()
+    timestamp = "20250510"
+    output_dir = f"output_tb_{args.run_identifier}_{timestamp}"
+    log_dir = f"log_tb_{args.run_identifier}_{timestamp}"
+    os.makedirs(output_dir, exist_ok=True)
+    os.makedirs(log_dir, exist_ok=True) 
+    # The nodes of a queue share the ledger on a network filesystem, where WAL is not supported
+    ledger = RunLedger(args.ledger_path, wal=not args.queue_path)
+    store = ArtifactStore(args.artifact_store)
+    run_id = ledger.start_run(args.run_identifier, vars(args))
+    passed_tasks = ledger.passed_tasks(args.run_identifier) if args.skip_passed else set()
+    python_correctness_list = []
+    success_list=[]
+    for task_number in args.task_numbers:
+        if str(task_number) in passed_tasks:
+            logger.info(f"Skipping task {task_number}, it passed in an earlier run")
+            success_list.append(task_number)
+    task_numbers = [t for t in args.task_numbers if str(t) not in passed_tasks]
+    if args.num_workers > 1:
+        # Share the cores between the concurrent simulations
+        os.environ.setdefault("PROV_SIM_THREADS", str(max(1, (os.cpu_count() or 1) // args.num_workers)))
+    if args.queue_path:
+        queue = WorkQueue(args.queue_path)
+        # Every node enqueues the sweep, the tasks already queued by another node are left as they are
+        queue.enqueue(
+            args.run_identifier, task_numbers,
+            expected_durations(task_numbers, args.folder_path, ledger, args.circuit_type),
+        )
+        worker = args.worker_id or default_worker_id()
+        with ThreadPoolExecutor(max_workers=args.num_workers) as executor:
+            futures = [
+                executor.submit(
+                    contextvars.copy_context().run,
+                    queue_worker, args, queue, f"{worker}/{i}", circuit_type, output_dir, log_dir, ledger, run_id, store,
+                )
+                for i in range(args.num_workers)
+            ]
+            for future in futures:
+                worker_passed_tasks, worker_python_correctness = future.result()
+                success_list += worker_passed_tasks
+                python_correctness_list += worker_python_correctness
+        logger.info(f"Queue of {args.run_identifier}: {queue.counts(args.run_identifier)}")
+        queue.close()
+    else:
+        if args.num_workers > 1:
+            # Longest expected first, so no worker is left idle behind a long task at the end
+            task_numbers = order_tasks(task_numbers, args.folder_path, ledger, args.circuit_type)
+        with ThreadPoolExecutor(max_workers=args.num_workers) as executor:
+            # Every task runs in its own context, for its log directory and trace spans
+            futures = {
+                task_number: executor.submit(
+                    contextvars.copy_context().run,
+                    run_task, args, task_number, circuit_type, output_dir, log_dir, ledger, run_id, store,
+                )
+                for task_number in task_numbers
+            }
+            for task_number in args.task_numbers:
+                if task_number not in futures:
+                    continue
+                passed, task_python_correctness = futures[task_number].result()
+                python_correctness_list += task_python_correctness
+                if passed:
+                    success_list.append(task_number)
+                    print(f"success_list: {success_list}")
 
-            
-        
 
     # summary.sort()
     # with open(summary_file_path, "a") as summary_file:
@@ -410,6 +612,12 @@ def main():
     print(f"success_list: {success_list}")
     with open(f"success_list.txt", "w") as f:
         f.write(str(success_list))
+    write_chrome_trace(f"{log_dir}/trace.json")
+    write_trace_summary(f"{log_dir}/trace_summary.json")
+    usage_registry.log_tables()
+    usage_registry.write(f"{log_dir}/usage.json")
+    ledger.finish_run(run_id)
+    ledger.close()
 
 if __name__ == "__main__":
     main()
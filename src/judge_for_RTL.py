@@ -3,7 +3,7 @@ from typing import Dict
 
 from llama_index.core.base.llms.types import ChatMessage, MessageRole
 from utils.gen_config import get_llm
-from utils.log_utils import get_logger
+from utils.log_utils import get_logger, log_artifact
 from utils.prompts import ORDER_PROMPT
 from utils.token_counter import TokenCounter, TokenCounterCached
 
@@ -56,6 +56,14 @@ Remember, the RTL code provided may be correct or incorrect. Your primary task i
 
 
 
+"""
+
+SIM_FEEDBACK_PROMPT = """
+Simulating the RTL code against the expected outputs of the python code gave the following mismatches:
+
+<simulation_feedback>
+{sim_feedback}
+</simulation_feedback>
 """
 
 EXAMPLE_OUTPUT_FORMAT = {
@@ -548,11 +556,10 @@ class JudgeForRTL:
         # self.history = []
         # self.max_trials = 15
 
-    def run(self, input_spec: str,rtl_code: str,python_code: str, circuit_type: str) -> Dict:
+    def run(self, input_spec: str,rtl_code: str,python_code: str, circuit_type: str, sim_feedback: str = "") -> Dict:
         # self.token_counter.reset()
         if isinstance(self.token_counter, TokenCounterCached):  
             self.token_counter.set_enable_cache(True)
-        print(f"Setting token counter tag to {self.__class__.__name__}")
         self.token_counter.set_cur_tag(self.__class__.__name__)
         msg = [
             ChatMessage(content=SYSTEM_PROMPT, role=MessageRole.SYSTEM),
@@ -562,6 +569,16 @@ class JudgeForRTL:
                 ),
                 role=MessageRole.USER,
             ),
+        ]
+        if sim_feedback:
+            # First mismatches of the last simulation, to point the judge at the diverging signals
+            msg.append(
+                ChatMessage(
+                    content=SIM_FEEDBACK_PROMPT.format(sim_feedback=sim_feedback),
+                    role=MessageRole.USER,
+                )
+            )
+        msg += [
             ChatMessage(
                 content=ORDER_PROMPT.format(
                     output_format="".join(json.dumps(EXAMPLE_OUTPUT_FORMAT, indent=4))
@@ -569,16 +586,11 @@ class JudgeForRTL:
                 role=MessageRole.USER,
             ),
         ]
-        print(f"Generating response ")
         response, token_cnt = self.token_counter.count_chat(msg)
-        print(f"Response: {response.message.content}")
 
         logger.info(f"Token count: {token_cnt}")
-        logger.info(f"{response.message.content}")
+        log_artifact(logger, "response", response.message.content)
         self.token_counter.log_token_stats()
-
-        # response = self.generate(msg)
-        logger.info(f"Get response from {self.model}: {response.message.content}")
         try:
             # output_json_obj: Dict = json.loads(response.message.content, strict=False)
 
@@ -596,9 +608,7 @@ class JudgeForRTL:
                 python_code = PythonHeader + revised_python_code + CHECKER_TAIL
             logger.info(f"Succeed to parse response, Revised Python Code: {revised_python_code}")
         except json.decoder.JSONDecodeError as e:
-            print(f"Json parse error: {e}")
             logger.info(f"Json parse error: {e}")
-            print(response)
             return None
 
         return python_code, output_json_obj["Misaligned_part"]
@@ -3,7 +3,7 @@ from typing import Dict
 
 from llama_index.core.base.llms.types import ChatMessage, ChatResponse, MessageRole
 from utils.gen_config import get_llm
-from utils.log_utils import get_logger
+from utils.log_utils import get_logger, log_artifact
 from utils.prompts import ORDER_PROMPT
 from utils.token_counter import TokenCounter, TokenCounterCached
 from pydantic import BaseModel
@@ -466,6 +466,7 @@ class PyChecker:
             if TokenCounterCached.is_cache_enabled(self.llm)
             else TokenCounter(self.llm)
         )
+        self.token_counter.set_cur_tag(self.__class__.__name__)
 
     def reset(self):
         self.history = []
@@ -525,7 +526,7 @@ class PyChecker:
         )
 
         logger.info(f"Token count: {token_cnt}")
-        logger.info(f"Response: {response.message.content}")
+        log_artifact(logger, "response", response.message.content)
 
         with open(python_path, "w") as f:
             f.write(py_output)
@@ -3,7 +3,7 @@ from typing import Dict
 
 from llama_index.core.base.llms.types import ChatMessage, ChatResponse, MessageRole
 from utils.gen_config import get_llm
-from utils.log_utils import get_logger
+from utils.log_utils import get_logger, log_artifact
 from utils.prompts import ORDER_PROMPT
 from utils.token_counter import TokenCounter, TokenCounterCached
 from pydantic import BaseModel
@@ -921,6 +921,7 @@ class PyChecker_SEQ:
             if TokenCounterCached.is_cache_enabled(self.llm)
             else TokenCounter(self.llm)
         )
+        self.token_counter.set_cur_tag(self.__class__.__name__)
 
     def reset(self):
         self.history = []
@@ -984,8 +985,8 @@ class PyChecker_SEQ:
         )
         gen_python_code = self.parse_output(response).python_code
         logger.info(f"Token count: {token_cnt}")
-        logger.info(f"Response: {response.message.content}")
-        print(f"===py_output===\n{py_output}")
+        log_artifact(logger, "response", response.message.content)
+        log_artifact(logger, "py_output", py_output)
 
         with open(python_path, "w") as f:
             f.write(py_output)
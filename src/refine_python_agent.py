@@ -11,7 +11,7 @@ import utils.python_call as py
 from llama_index.core.base.llms.types import ChatMessage, MessageRole
 from check_consistency import ConsistencyChecker
 from utils.gen_config import get_llm
-from utils.log_utils import get_logger
+from utils.log_utils import get_logger, log_artifact
 from utils.prompts import ORDER_PROMPT
 from utils.token_counter import TokenCounter, TokenCounterCached
 from utils.gen_config import Config
@@ -472,10 +472,10 @@ class RefinePythonAgent:
         )   
         # Generate response
         messages = [system_prompt,init_prompt] + self.get_order_prompt_messages()
-        logger.info(f"Consistency checker input message: {messages}")
+        log_artifact(logger, "refine_input", messages)
         resp, token_cnt = self.token_counter.count_chat(messages)
         logger.info(f"Token count: {token_cnt}")
-        logger.info(f"Response: {resp.message.content}")
+        log_artifact(logger, "response", resp.message.content)
         
 
         #response_content = resp.message.content
@@ -499,9 +499,7 @@ class RefinePythonAgent:
                     python_code+=SEQ_TAIL
                 
         except json.decoder.JSONDecodeError as e:
-                    print(f"Json parse error: {e}")
                     logger.info(f"Json parse error: {e}")
-                    print(resp)
                     return None
         
 
@@ -4,10 +4,23 @@
 
 from __future__ import absolute_import, print_function
 
+import argparse
 import json
 import os
 import sys
 
+from harness_common import (
+    WIDE_BITS,
+    ShardWriter,
+    candidate_checks,
+    fit_to_ports,
+    load_ports,
+    probe_name,
+    wide_declarations,
+    write_dispatch,
+)
+from verilog_ports import is_binary
+
 
 def process_sequence(sequence):
     """Process input/output sequence"""
@@ -18,6 +31,16 @@ def process_sequence(sequence):
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    # scoped: a fresh model per input step, destroyed at the end of the step
+    # reuse:  one model per job, the DUT is combinational so there is no state to reset
+    parser.add_argument("--model-mode", choices=["scoped", "reuse"], default="scoped")
+    # scenarios per job of the thread pool in sim-main.cpp, CMB scenarios are a single input step
+    parser.add_argument("--job-size", type=int, default=64)
+    # translation units the job functions are spread over
+    parser.add_argument("--shards", type=int, default=8)
+    args = parser.parse_args()
+
     test_file = "testbench.json"
     datas = []
 
@@ -25,11 +48,16 @@ def main():
             datas = json.load(f)
             # Process data format
 
+    ports = load_ports()
+    if ports is not None:
+        # Widths of the declared ports, not of the values of the first scenario
+        datas = fit_to_ports(datas, ports)
+
 
     ###############################################
     # Generate Harness with JSON testbench
     ###############################################
-    cpp_code = """
+    header = """
 #include "rfuzz-harness.h"
 #include <vector>
 #include <string>
@@ -37,70 +65,95 @@ def main():
 #include <iostream>
 #include <verilated.h>
 #include "Vtop_module.h"
+#include "harness-probe.h"
 #include <sstream>
-
-int fuzz_poke() {
-    int unpass_total = 0;
-    int unpass = 0;
-    VerilatedContext* contextp;
-    Vtop_module* top;
-
 """
+    # Wide signal buffers, declared in every job function so jobs can run on different threads
+    decls = ""
 
     # Handle large value signal declarations
     if datas and datas[0]["input variable"] and datas[0]["output variable"]:
         for name, value in datas[0]["input variable"][0].items():
-            if isinstance(value, str) and len(value) > 64:
+            if isinstance(value, str) and len(value) > WIDE_BITS:
                 
                 width = len(value)
                 n_words = (width + 31) // 32
-                cpp_code += (
+                decls += (
                     f"""    VlWide<{n_words}> {name}_wide;\n"""
                 )
-        print("datas", datas[0]["output variable"][0])
 
         for name, value in datas[0]["output variable"][0].items():
             
-            check_out="printf(\"output_vars:\\n\");\n"
-            if isinstance(value, str) and len(str(value)) > 64:
+            check_out="harness_printf(\"output_vars:\\n\");\n"
+            if isinstance(value, str) and len(str(value)) > WIDE_BITS:
                 
-                cpp_code += (
-                    f"""    VlWide<{int(((len(value)/4) + 7) // 8)}> {name}_wide;\n"""
+                decls += (
+                    f"""    VlWide<{(len(value) + 31) // 32}> {name}_wide;\n"""
                 )
                 
-                for i in range(int(((len(value)/4) + 7) // 8)):
-                    check_out+=f"printf(\"expected %x\\n\",{name}_wide[{i}]);\n"
-                    check_out+=f"printf(\"actual %x\\n\",top->{name}[{i}]);\n"
+                for i in range((len(value) + 31) // 32):
+                    check_out+=f"harness_printf(\"expected %x\\n\",{name}_wide[{i}]);\n"
+                    check_out+=f"harness_printf(\"actual %x\\n\",top->{name}[{i}]);\n"
             else:
-                check_out=f"printf(\"%x\\n\",top->{name});\n"
-    context_idx = 0
+                # QData ports do not fit %x
+                check_out=f"harness_printf(\"%llx\\n\",(unsigned long long)top->{name});\n"
+    if ports is not None:
+        # Every wide port gets its buffer, a port may be missing from the first step
+        decls = wide_declarations(ports)
+
+    def new_model(probe):
+        return f"""    {{
+    const std::unique_ptr<VerilatedContext> contextp_owner {{new VerilatedContext}};
+    contextp = contextp_owner.get();
+    const std::unique_ptr<Vtop_module> top_owner {{new Vtop_module(contextp)}};
+    top = top_owner.get();
+    HARNESS_PROBE({json.dumps(probe)});
+"""
+    free_model = """    top->final();
+    }
+"""
+    job_count = 0
+    shards = ShardWriter(header, args.shards)
     # Generate test logic
-    for data in datas:
+    for scenario_idx, data in enumerate(datas):
+        if scenario_idx % args.job_size == 0:
+            # The code of one job at a time, streamed to its shard
+            cpp_code = f"""
+int job_{job_count}() {{
+    int unpass_total = 0;
+    int unpass = 0;
+    VerilatedContext* contextp;
+    Vtop_module* top;
+{decls}"""
+            job_count += 1
+            if args.model_mode == "reuse":
+                # The context and model are owned by this block and destroyed when it closes
+                cpp_code += new_model(f"job{job_count - 1}")
         stimulus = data["input variable"]
-        expected = data["output variable"]
+        # Multi-candidate testbenches are only compared through candidate_checks
+        candidates = data.get("candidate output variables")
+        expected = [{} for _ in stimulus] if candidates else data["output variable"]
 
         cpp_code += f"""    // Scenario: {data.get('scenario', 'unnamed')}\n"""
         cpp_code += f"""        unpass = 0;\n"""
+        cpp_code += f"""    harness_scenario_begin({json.dumps(data.get('scenario', 'unnamed'))});\n"""
+        if candidates:
+            cpp_code += f"""    harness_scenario_candidates({len(candidates)});\n"""
 
         for i, input_step in enumerate(stimulus):
-            print("input", i,input_step)
-            cpp_code += """    const std::unique_ptr<VerilatedContext> contextp_%d {new VerilatedContext};\n""" % (context_idx)
-            test="""    contextp = contextp_%d.get();\n""" % (context_idx)
-            
-            cpp_code += test
-            cpp_code += f"""    top = new Vtop_module;\n"""
-            
-            context_idx = context_idx + 1
-            check=f"printf(\"===Scenario: {data.get('scenario', 'unnamed')}=====\\n\");\n"
+            if args.model_mode == "scoped":
+                cpp_code += new_model(f"{probe_name(scenario_idx, data)}_step{i}")
+            check=f"harness_printf(\"===Scenario: {data.get('scenario', 'unnamed')}=====\\n\");\n"
             for name, value in input_step.items():
                 
-                check+= """printf("input_vars:\\n");\n"""
+                check+= """harness_printf("input_vars:\\n");\n"""
         
-                check += f"""printf("top->%s = 0x%s\\n", "{name}", "{value}");\n"""
+                check += f"""harness_printf("top->%s = 0x%s\\n", "{name}", "{value}");\n"""
                 check += "\n"
-                if isinstance(value, str):
+                # values with x/z are not applied, as in the other backends
+                if is_binary(value):
                     hex_value = hex(int(str(value), 2))[2:]
-                    if len(str(value)) <= 64:
+                    if len(str(value)) <= WIDE_BITS:
                         cpp_code += f"""    top->{name} = 0x{hex_value};\n"""
                     else:
                         width = len(str(value))
@@ -122,16 +175,20 @@ int fuzz_poke() {
                      
 
             cpp_code += """    top->eval();\n"""
+            cpp_code += """    HARNESS_DUMP();\n"""
+            if candidates:
+                cpp_code += candidate_checks([outputs[i] for outputs in candidates])
             #check=""
-            print("expected", expected,i)
             for name, value in expected[i].items():
-                
-                if isinstance(value, str):
+                # unknown expected values are not checked
+                if is_binary(value):
                     hex_value = hex(int(str(value), 2))[2:]
-                    if len(value) <= 64:
+                    if len(value) <= WIDE_BITS:
                             cpp_code += f"""    if (top->{name} != 0x{hex_value}) {{
-        unpass++;\n""" + check + check_out + f"""
-        printf("Mismatch at %s: expected 0x%s\\n", "{name}", "{hex_value}");
+        unpass++;
+        if (harness_mismatch({i}, 0, "{name}", "0x{hex_value}", harness_hex(top->{name}))) {{\n""" + check + check_out + f"""
+        harness_printf("Mismatch at %s: expected 0x%s\\n", "{name}", "{hex_value}");
+        }}
     }}\n"""
                     else:
                             cpp_code += f"""    // Checking wide signal {name}\n"""
@@ -142,34 +199,49 @@ int fuzz_poke() {
 
                             # Split into 32-bit chunks, arranged from high to low bits
                             chunks = [
-            int(padded[-32 * (i + 1): -32 * i or None], 2)
-            for i in range(n_words)
+            int(padded[-32 * (j + 1): -32 * j or None], 2)
+            for j in range(n_words)
         ]
-                            for i, c in enumerate(chunks):
-                                cpp_code+= f"{name}_wide[{i}] = 0x{c:08X}u;\n"
+                            for j, c in enumerate(chunks):
+                                cpp_code+= f"{name}_wide[{j}] = 0x{c:08X}u;\n"
                             check_code = (
                                 f"""    if (top->{name} != {name}_wide)"""
                             )
                             cpp_code += f"""{check_code} {{
-        unpass++\n;""" + check + check_out + f"""
-        printf("Mismatch at %s: expected 0x%s\\n", "{name}", "{hex_value}");
+        unpass++;
+        if (harness_mismatch({i}, 0, "{name}", harness_hex_words(&{name}_wide[0], {n_words}), harness_hex_words(&top->{name}[0], {n_words}))) {{\n""" + check + check_out + f"""
+        harness_printf("Mismatch at %s: expected 0x%s\\n", "{name}", "{hex_value}");
+        }}
     }}\n"""
+            # Skip the remaining input steps once the mismatch budget is spent
+            finish = "top->final(); " if args.model_mode == "scoped" else ""
+            cpp_code += f"""    if (harness_scenario_aborted()) {{ {finish}goto scenario_{scenario_idx}_done; }}\n"""
+            if args.model_mode == "scoped":
+                cpp_code += free_model
 
+        scenario_name = json.dumps(data["scenario"])
         cpp_code += f"""
-
+    scenario_{scenario_idx}_done:
         if (unpass == 0) {{
-            std::cout << "Test passed for scenario {data['scenario']}" << std::endl;
+            harness_printf("Test passed for scenario %s\\n", {scenario_name});
         }} else {{
-            std::cout << "Test failed,unpass = " << unpass << " for scenario {data['scenario']}" << std::endl;
+            harness_printf("Test failed,unpass = %d for scenario %s\\n", unpass, {scenario_name});
             unpass_total += unpass;
         }}
+        harness_scenario_end(unpass);
 """
-    cpp_code += """
+        if scenario_idx % args.job_size == args.job_size - 1 or scenario_idx == len(datas) - 1:
+            if args.model_mode == "reuse":
+                cpp_code += free_model
+            cpp_code += """
     return unpass_total;
 }
 """
-    with open("rfuzz-harness.cpp", "w") as file:
-        file.write(cpp_code)
+            shards.write(cpp_code)
+    shards.close()
+
+    # Chunks of scenarios are the jobs of the thread pool in sim-main.cpp
+    write_dispatch([f"job_{job_idx}" for job_idx in range(job_count)])
 
 
 if __name__ == "__main__":
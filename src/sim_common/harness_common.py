@@ -0,0 +1,124 @@
+"""
+Helpers shared by the harness generators of sim_seq and sim_cmb.
+
+utils/sim_workdir.py copies this file and utils/verilog_ports.py next to
+harness-generator.py in every simulation workdir, the generators import them from there.
+"""
+
+import json
+import re
+
+from verilog_ports import is_binary
+
+
+def probe_name(scenario_idx, data):
+    """File name stem for the waveform and coverage of a scenario in instrumented builds"""
+    name = re.sub(r"[^A-Za-z0-9_.-]", "_", str(data.get("scenario", "unnamed")))
+    # scenario names are not unique, the index keeps the files of two scenarios apart
+    return f"{scenario_idx}_{name}"
+
+
+# Verilator keeps ports of up to 64 bits in an integer (CData .. QData), wider ones in a VlWide word array
+WIDE_BITS = 64
+# The ports of top_module, written by testbench_parse from the module header of the task
+PORTS_FILE = "ports.json"
+
+
+def load_ports():
+    """name -> port (direction, width, role, active_low, ...) of top_module, or None without ports.json"""
+    try:
+        with open(PORTS_FILE, "r") as f:
+            return {port["name"]: port for port in json.load(f)["ports"]}
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def find_reset(ports):
+    """(name, active_low) of the reset input of the port model, or None"""
+    for port in (ports or {}).values():
+        if port.get("role") == "reset":
+            return port["name"], port.get("active_low", False)
+    return None
+
+
+def wide_declarations(ports):
+    """VlWide buffers of the ports wider than WIDE_BITS, declared in every job function"""
+    return "".join(
+        f"""    VlWide<{(port["width"] + 31) // 32}> {name}_wide;\n"""
+        for name, port in ports.items()
+        if port["width"] > WIDE_BITS
+    )
+
+
+def fit_to_ports(datas, ports):
+    """Drop the signals that are not ports and fit binary values to the port width, as a Verilog assignment does"""
+    def fit(value, width):
+        if isinstance(value, list):
+            return [fit(item, width) for item in value]
+        return value[-width:].zfill(width) if is_binary(value) else value
+
+    def fit_step(step):
+        return {
+            name: value if name == "clock cycles" else fit(value, ports[name]["width"])
+            for name, value in step.items()
+            if name == "clock cycles" or name in ports
+        }
+
+    for data in datas:
+        for key in ("input variable", "output variable"):
+            data[key] = [fit_step(step) for step in data.get(key, [])]
+        if "candidate output variables" in data:
+            data["candidate output variables"] = [
+                [fit_step(step) for step in outputs] for outputs in data["candidate output variables"]
+            ]
+    return datas
+
+
+class ShardWriter:
+    """Streams the job functions into several translation units, balanced by size, so make -j compiles them in parallel"""
+
+    def __init__(self, header, shards):
+        # The number of files is fixed, so a cached Vtop_module.mk always lists the same sources
+        self.files = [open(f"rfuzz-harness-{i}.cpp", "w") for i in range(shards)]
+        self.sizes = [0] * shards
+        for f in self.files:
+            f.write(header)
+
+    def write(self, code):
+        shard = self.sizes.index(min(self.sizes))
+        self.files[shard].write(code)
+        self.sizes[shard] += len(code)
+
+    def close(self):
+        for f in self.files:
+            f.close()
+
+
+def write_dispatch(functions):
+    """rfuzz-harness.cpp: the job table of sim-main.cpp over the job functions of the shards"""
+    with open("rfuzz-harness.cpp", "w") as f:
+        f.write('#include "rfuzz-harness.h"\n\n')
+        for function in functions:
+            f.write(f"int {function}();\n")
+        f.write(f"\nint harness_job_count() {{\n    return {len(functions)};\n}}\n\n")
+        f.write("int harness_run_job(int index) {\n    switch (index) {\n")
+        for idx, function in enumerate(functions):
+            f.write(f"    case {idx}: return {function}();\n")
+        f.write("    default: return 0;\n    }\n}\n")
+
+
+def candidate_checks(expected):
+    """Compare the outputs against every candidate testbench, expected[c] maps the signals to binary values"""
+    code = ""
+    for candidate, values in enumerate(expected):
+        for name, value in values.items():
+            # unknown expected values are not checked
+            if not is_binary(value):
+                continue
+            if len(value) <= WIDE_BITS:
+                cond = f"top->{name} != 0x{int(value, 2):x}ULL"
+            else:
+                words = [(int(value, 2) >> (32 * j)) & 0xFFFFFFFF for j in range((len(value) + 31) // 32)]
+                cond = " || ".join(f"top->{name}[{j}] != 0x{word:08X}u" for j, word in enumerate(words))
+            code += f"""    if ({cond}) harness_candidate_mismatch({candidate});\n"""
+    return code
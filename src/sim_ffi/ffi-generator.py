@@ -0,0 +1,30 @@
+# Generate the port table of ffi-main.cpp from the verilated model header
+#   python ffi-generator.py obj_dir/Vtop_module.h ffi-ports.h
+
+import re
+import sys
+
+# VL_IN8(&clk,0,0);  VL_OUTW(&out,69,0,3);  (Verilator 4 omits the &)
+PORT_RE = re.compile(r"\bVL_(IN|OUT|INOUT)(8|16|64|W)?\(\s*&?(\w+)\s*,\s*(\d+)\s*,\s*(\d+)")
+
+
+def main():
+    header_path, output_path = sys.argv[1], sys.argv[2]
+    with open(header_path, "r") as f:
+        header = f.read()
+    ports = []
+    for direction, _, name, msb, lsb in PORT_RE.findall(header):
+        width = int(msb) - int(lsb) + 1
+        ports.append(f"    PROV_PORT({name}, {width}, {0 if direction == 'IN' else 1})")
+    if not ports:
+        print(f"No ports found in {header_path}")
+        sys.exit(1)
+    with open(output_path, "w") as f:
+        f.write("// Generated by ffi-generator.py from the verilated model header\n")
+        f.write("#define PROV_FFI_PORTS \\\n")
+        f.write(" \\\n".join(ports))
+        f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
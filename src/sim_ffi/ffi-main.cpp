@@ -0,0 +1,100 @@
+// C ABI of the verilated top_module, built as libVtop_module.so
+//
+// A model is an opaque handle owning its VerilatedContext. Ports are addressed
+// by their index in the generated port table (ffi-ports.h), values are passed
+// as arrays of 32-bit words, least significant word first.
+
+#include <cstdint>
+#include <memory>
+
+#include <verilated.h>
+#include "Vtop_module.h"
+#include "ffi-ports.h"
+
+namespace {
+
+struct Model {
+    std::unique_ptr<VerilatedContext> contextp;
+    // declared after the context, so it is destroyed first
+    std::unique_ptr<Vtop_module> top;
+};
+
+template <typename T>
+void write_port(T& port, const uint32_t* words) {
+    port = static_cast<T>(words[0]);
+}
+void write_port(QData& port, const uint32_t* words) {
+    port = static_cast<QData>(words[0]) | (static_cast<QData>(words[1]) << 32);
+}
+template <std::size_t N>
+void write_port(VlWide<N>& port, const uint32_t* words) {
+    for (std::size_t i = 0; i < N; i++) port[i] = words[i];
+}
+
+template <typename T>
+void read_port(const T& port, uint32_t* words) {
+    words[0] = static_cast<uint32_t>(port);
+}
+void read_port(const QData& port, uint32_t* words) {
+    words[0] = static_cast<uint32_t>(port);
+    words[1] = static_cast<uint32_t>(port >> 32);
+}
+template <std::size_t N>
+void read_port(const VlWide<N>& port, uint32_t* words) {
+    for (std::size_t i = 0; i < N; i++) words[i] = port[i];
+}
+
+struct Port {
+    const char* name;
+    int width;
+    int is_output;
+    void (*write)(Vtop_module*, const uint32_t*);
+    void (*read)(const Vtop_module*, uint32_t*);
+};
+
+#define PROV_PORT(name, width, is_output) \
+    {#name, width, is_output, \
+     [](Vtop_module* top, const uint32_t* words) { write_port(top->name, words); }, \
+     [](const Vtop_module* top, uint32_t* words) { read_port(top->name, words); }},
+
+const Port ports[] = {PROV_FFI_PORTS};
+const int n_ports = sizeof(ports) / sizeof(ports[0]);
+
+Model* model(void* handle) { return static_cast<Model*>(handle); }
+
+}  // namespace
+
+extern "C" {
+
+void* prov_model_new() {
+    Model* m = new Model;
+    m->contextp.reset(new VerilatedContext);
+    // deterministic zero initialization, as in the generated harnesses
+    m->contextp->randReset(0);
+    m->top.reset(new Vtop_module(m->contextp.get()));
+    return m;
+}
+
+void prov_model_free(void* handle) {
+    model(handle)->top->final();
+    delete model(handle);
+}
+
+int prov_port_count() { return n_ports; }
+const char* prov_port_name(int port) { return ports[port].name; }
+int prov_port_width(int port) { return ports[port].width; }
+int prov_port_is_output(int port) { return ports[port].is_output; }
+
+void prov_port_write(void* handle, int port, const uint32_t* words) {
+    ports[port].write(model(handle)->top.get(), words);
+}
+
+void prov_port_read(void* handle, int port, uint32_t* words) {
+    ports[port].read(model(handle)->top.get(), words);
+}
+
+void prov_eval(void* handle) { model(handle)->top->eval(); }
+
+void prov_time_inc(void* handle, uint64_t add) { model(handle)->contextp->timeInc(add); }
+
+}  // extern "C"
@@ -4,18 +4,58 @@
 
 from __future__ import absolute_import, print_function
 
+import argparse
 import json
 import os
 import sys
 
+from harness_common import (
+    WIDE_BITS,
+    ShardWriter,
+    candidate_checks,
+    find_reset,
+    fit_to_ports,
+    load_ports,
+    probe_name,
+    wide_declarations,
+    write_dispatch,
+)
+from verilog_ports import is_binary
+
 # the next line can be removed after installation
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # import pyverilog
 # from pyverilog.dataflow.dataflow_analyzer import VerilogDataflowAnalyzer
 
+def reset_code(reset):
+    """Pulse the reset input for one clock cycle so the model can be reused for the next input step"""
+    name, active_low = reset
+    return f"""    // reset the model between input steps instead of reallocating it
+    top->{name} = {0 if active_low else 1};
+    top->clk = 0;
+    top->eval();
+    contextp->timeInc(1);
+    top->clk = 1;
+    top->eval();
+    HARNESS_DUMP();
+    contextp->timeInc(1);
+    top->clk = 0;
+    top->eval();
+    top->{name} = {1 if active_low else 0};
+    top->eval();
+    HARNESS_DUMP();
+"""
+
 
 def main():
+    parser = argparse.ArgumentParser()
+    # scoped: a fresh model per input step, destroyed at the end of the step
+    # reuse:  one model per scenario, reset between input steps
+    parser.add_argument("--model-mode", choices=["scoped", "reuse"], default="scoped")
+    # translation units the job functions are spread over
+    parser.add_argument("--shards", type=int, default=8)
+    args = parser.parse_args()
 
     test_file = "testbench.json"
     datas = []
@@ -36,10 +76,15 @@ def main():
             print(f"Error reading JSON file: {e}")
             return
 
+    ports = load_ports()
+    if ports is not None:
+        # Widths of the declared ports, not of the values of the first scenario
+        datas = fit_to_ports(datas, ports)
+
     ###############################################
     # Generate Harness with JSON testbench
     ###############################################
-    cpp_code = """
+    header = """
 #include "rfuzz-harness.h"
 #include <vector>
 #include <string>
@@ -47,11 +92,10 @@ def main():
 #include <iostream>
 #include <verilated.h>
 #include "Vtop_module.h"
-
-int fuzz_poke() {
-    VerilatedContext* contextp;
-    Vtop_module* top;
+#include "harness-probe.h"
 """
+    # Wide signal buffers, declared in every scenario function so scenarios can run on different threads
+    decls = ""
 
     # 获取datas[0]["input variable"][0]中的所有变量名和width
     signal_width = {}
@@ -62,65 +106,88 @@ int fuzz_poke() {
             continue
         else:
             signal_width[name] = len(value[0])
-            if len(value[0]) > 32:
+            if len(value[0]) > WIDE_BITS:
                 # print("input",name,value)
                 # 对于大数值，使用 VL_WORDS_I 处理
                 width = len(value[0])
                 n_words = (width + 31) // 32
-                cpp_code += (
+                decls += (
                     f"""    VlWide<{n_words}> {name}_wide;\n"""
                 )
                 
     for name, value in datas[0]["output variable"][0].items():
-        check_out="printf(\"output_vars:\\n\");\n"
+        check_out="harness_printf(\"output_vars:\\n\");\n"
 
         if name == "clock cycles":
             continue
         else:
             signal_width[name] = len(value[0])
 
-            if len(value[0]) > 32:
+            if len(value[0]) > WIDE_BITS:
                 #print("output", name, value)
                 # 对于大数值，使用 VL_WORDS_I 处理
-                cpp_code += (
+                decls += (
                     f"""   VlWide<{int((len(value[0])+31) // 32)}> {name}_wide;\n"""
                 )
                 for i in range(int(((len(value[0])+31) // 32))):
-                    check_out+=f"printf(\"for i=%d in %d\\n\",{i},{int(((len(value[0])+31) // 32))});\n"
-                    check_out+=f"printf(\"expected %x\\n\",{name}_wide[{i}]);\n"
-                    check_out+=f"printf(\"actual %x\\n\",top->{name}[{i}]);\n"
+                    check_out+=f"harness_printf(\"for i=%d in %d\\n\",{i},{int(((len(value[0])+31) // 32))});\n"
+                    check_out+=f"harness_printf(\"expected %x\\n\",{name}_wide[{i}]);\n"
+                    check_out+=f"harness_printf(\"actual %x\\n\",top->{name}[{i}]);\n"
                 check_out+="\n"
             else:
                 
-                check_out=f"printf(\"actual %x\\n\",top->{name});\n"
-
-    cpp_code += f"""        int unpass_total = 0;\n"""
-    cpp_code += f"""        int unpass = 0;\n"""
-    context_idx = 0
-    for data in datas:
-        cpp_code += f"""       ////////////////////////////scenario {data['scenario']}////////////////////////////\n"""
+                # QData ports do not fit %x
+                check_out=f"harness_printf(\"actual %llx\\n\",(unsigned long long)top->{name});\n"
+
+    if ports is not None:
+        # Every wide port gets its buffer, a port may be missing from the first step
+        decls = wide_declarations(ports)
+        signal_width = {name: port["width"] for name, port in ports.items()}
+
+    reset = None
+    if args.model_mode == "reuse":
+        # The reset role comes from the port model, without one the model is not reused
+        reset = find_reset(ports)
+        if reset is None:
+            print("No reset port in ports.json, falling back to one model per input step")
+    shards = ShardWriter(header, args.shards)
+    for scenario_idx, data in enumerate(datas):
+        # The code of one scenario at a time, streamed to its shard
+        cpp_code = f"""
+////////////////////////////scenario {data['scenario']}////////////////////////////
+int scenario_{scenario_idx}() {{
+    VerilatedContext* contextp;
+    Vtop_module* top;
+{decls}"""
 
         stimulus = data["input variable"]
-        expected = data["output variable"]
+        # Multi-candidate testbenches are only compared through candidate_checks
+        candidates = data.get("candidate output variables")
+        expected = [{} for _ in stimulus] if candidates else data["output variable"]
 
 
-        cpp_code += f"""        unpass = 0;\n"""
+        cpp_code += f"""        int unpass = 0;\n"""
+        cpp_code += f"""    harness_scenario_begin({json.dumps(data["scenario"])});\n"""
+        if candidates:
+            cpp_code += f"""    harness_scenario_candidates({len(candidates)});\n"""
         
         for idd, input in enumerate(stimulus):
             clock_cycles = input["clock cycles"]
-            # Create a new VerilatedContext for each top
-            cpp_code += """    const std::unique_ptr<VerilatedContext> contextp_%d {new VerilatedContext};\n""" % (context_idx)
-            cpp_code += """    contextp = contextp_%d.get();\n""" % (context_idx)
-            # 设置随机种子为0，确保重置为确定性的0值
-            cpp_code += """    contextp->randReset(0);\n"""
-            context_idx += 1
-            # 单独使用DUT
-            # if(i == 0):
-            #     cpp_code += f"""    Vtop_module* top = new Vtop_module;\n"""
-            # else:
-            cpp_code += f"""    top = new Vtop_module(contextp);\n"""
-            # 初始化所有变量为0
-            cpp_code += """    top->eval();\n"""
+            if reset is None or idd == 0:
+                # The context and model are owned by this block and destroyed when it closes
+                cpp_code += """    {\n"""
+                cpp_code += """    const std::unique_ptr<VerilatedContext> contextp_owner {new VerilatedContext};\n"""
+                cpp_code += """    contextp = contextp_owner.get();\n"""
+                # 设置随机种子为0，确保重置为确定性的0值
+                cpp_code += """    contextp->randReset(0);\n"""
+                cpp_code += """    const std::unique_ptr<Vtop_module> top_owner {new Vtop_module(contextp)};\n"""
+                cpp_code += """    top = top_owner.get();\n"""
+                cpp_code += f"""    HARNESS_PROBE({json.dumps(f"{probe_name(scenario_idx, data)}_step{idd}")});\n"""
+                # 初始化所有变量为0
+                cpp_code += """    top->eval();\n"""
+                cpp_code += """    HARNESS_DUMP();\n"""
+            else:
+                cpp_code += reset_code(reset)
             cpp_code += f"""    top->clk = 0;\n"""
             
             # 将top中的output变量全部清空  ----------------------------
@@ -145,9 +212,9 @@ int fuzz_poke() {
 
             # input 中除了clock cycles 之外的变量
             input_vars = {k: v for k, v in input.items() if k != "clock cycles"}
-            check = """printf("input_vars:\\n");\n"""
+            check = """harness_printf("input_vars:\\n");\n"""
             for name, value in input_vars.items():
-                check += f"""printf("top->%s = 0x%s\\n", "{name}", "{value}");\n"""
+                check += f"""harness_printf("top->%s = 0x%s\\n", "{name}", "{value}");\n"""
             check += "\n"
 
             check=""
@@ -156,11 +223,11 @@ int fuzz_poke() {
 
                 
 
-                check=f"printf(\"===Scenario: {data.get('scenario', 'unnamed')}, clock cycle: {circle}=====\\n\");\n"
+                check=f"harness_printf(\"===Scenario: {data.get('scenario', 'unnamed')}, clock cycle: {circle}=====\\n\");\n"
 
                 for name, value in input_vars.items():
                     #如果value中有除了0和1之外的值，则不进行赋值
-                    if any(char not in '01' for char in value[circle]):
+                    if not is_binary(value[circle]):
                         continue
                     else:
                         
@@ -168,7 +235,7 @@ int fuzz_poke() {
                         temp = str(value[circle])
                         hex_len = (len(temp) + 3) // 4  # 计算需要的十六进制位数
                         hex_value = hex(int(temp, 2))[2:].zfill(hex_len)
-                        if len(str(value[circle])) <= 32:
+                        if len(str(value[circle])) <= WIDE_BITS:
                             cpp_code += f"""        top->{name} = 0;\n"""
                         else:
                             width = len(temp)
@@ -189,23 +256,24 @@ int fuzz_poke() {
                 
                 
                 cpp_code += """        top->eval();\n"""
+                cpp_code += """        HARNESS_DUMP();\n"""
                 cpp_code += """        contextp->timeInc(1);  \n"""
 
                 
                 for name, value in input_vars.items():
                     #如果value中有除了0和1之外的值，则不进行赋值
-                    if any(char not in '01' for char in value[circle]):
+                    if not is_binary(value[circle]):
                         continue
                     else:
-                        check+= """printf("input_vars:\\n");\n"""
+                        check+= """harness_printf("input_vars:\\n");\n"""
             
-                        check += f"""printf("top->%s = 0x%s\\n", "{name}", "{value[circle][:signal_width[name]]}");\n"""
+                        check += f"""harness_printf("top->%s = 0x%s\\n", "{name}", "{value[circle][:signal_width[name]]}");\n"""
                         check += "\n"
 
                         temp = str(value[circle][:signal_width[name]])
                         hex_len = (len(temp) + 3) // 4  # 计算需要的十六进制位数
                         hex_value = hex(int(temp, 2))[2:].zfill(hex_len)
-                        if len(str(value[circle])) <= 32:
+                        if len(str(value[circle])) <= WIDE_BITS:
                             cpp_code += f"""        top->{name} = 0x{hex_value};\n"""
                         else:
                             width = len(temp)
@@ -227,10 +295,16 @@ int fuzz_poke() {
 
                 cpp_code += f"""        top->clk = !top->clk;\n"""
                 cpp_code += """         top->eval();\n"""
+                cpp_code += """        HARNESS_DUMP();\n"""
+                if candidates:
+                    cpp_code += candidate_checks([
+                        {k: v[circle] for k, v in outputs[idd].items() if k != "clock cycles" and circle < len(v)}
+                        for outputs in candidates
+                    ])
                 for name, value in expected[idd].items():
                     if name == "clock cycles":
                         continue
-                    if any(char not in '01' for char in value[circle]):
+                    if not is_binary(value[circle]):
                         continue
                     
                     else:
@@ -238,15 +312,17 @@ int fuzz_poke() {
                         temp = str(value[circle])
                         hex_len = (len(temp) + 3) // 4  # 计算需要的十六进制位数
                         hex_value = hex(int(temp, 2))[2:].zfill(hex_len)
-                        if len(str(value[circle])) <= 32:
+                        if len(str(value[circle])) <= WIDE_BITS:
                             #print("value",str(value[j]))
                             
                             cpp_code += f"""        if (top->{name} != 0x{hex_value}) {{
-            unpass++;\n"""
+            unpass++;
+            if (harness_mismatch({idd}, {circle}, "{name}", "0x{hex_value}", harness_hex(top->{name}))) {{\n"""
                             #cpp_code += f"""        if (1) {{
             #unpass++;\n"""
                             cpp_code += check+check_out
-                            cpp_code += f"""            printf("At %d clock cycle of %d, top->%s, expected = 0x%s\\n", {circle},{clock_cycles}, "{name}", "0x{hex_value}");\n"""
+                            cpp_code += f"""            harness_printf("At %d clock cycle of %d, top->%s, expected = 0x%s\\n", {circle},{clock_cycles}, "{name}", "0x{hex_value}");\n"""
+                            cpp_code += f"""            }}\n"""
                             cpp_code += f"""        }}\n"""
 
                         else:
@@ -262,65 +338,46 @@ int fuzz_poke() {
             int(padded[-32 * (j + 1): -32 * j or None], 2)
             for j in range(n_words)
         ]
-                            for m in range(0, len(hex_value), 8):
-                                segment = hex_value[
-                                    max(0, len(hex_value) - m - 8) : len(hex_value) - m
-                                ]
-                                if segment:
-                                    cpp_code += f"""        {name}_wide[{m//8}] = 0x{segment};\n"""
-                            
+                            for i, c in enumerate(chunks):
+                                cpp_code+= f"{name}_wide[{i}] = 0x{c:08X}u;\n"
+                            cpp_code += f"""    // Checking wide signal {name}\n"""
                             cpp_code += f"""        if (top->{name} != {name}_wide) {{
             unpass++;
+            if (harness_mismatch({idd}, {circle}, "{name}", harness_hex_words(&{name}_wide[0], {n_words}), harness_hex_words(&top->{name}[0], {n_words}))) {{
             {check}\n {check_out}
-            printf("At %d clock cycle of %d, wide value mismatch for %s\\n \\n", {j}, {clock_cycles}, "{name}");
+            harness_printf("At %d clock cycle of %d, wide value mismatch for %s\\n \\n", {circle}, {clock_cycles}, "{name}");
+            }}
         }}\n"""
-                            cpp_code += f"""    // Checking wide signal {name}\n"""
-                            width = len(value[circle])
-                            n_words = (width + 31) // 32
-                            # 补全 value，使其长度是32的倍数（前面补0）
-                            padded = value[circle].zfill(n_words * 32)
-
-                            # 切割成32位chunk，从高位到低位排列
-                            chunks = [
-            int(padded[-32 * (i + 1): -32 * i or None], 2)
-            for i in range(n_words)
-        ]
-                            for i, c in enumerate(chunks):
-                                cpp_code+= f"{name}_wide[{i}] = 0x{c:08X}u;\n"
-                            check_code = (
-                                f"""    if (top->{name} != {name}_wide)"""
-                            )
-                            cpp_code += f"""{check_code} {{
-        unpass++\n;""" + check + f"""   
-        printf("Mismatch at %s: expected \\n", "{name}");
-    }}\n"""
 
+                # Skip the remaining cycles and steps once the mismatch budget is spent
+                cpp_code += f"""        if (harness_scenario_aborted()) {{ top->final(); goto scenario_{scenario_idx}_done; }}\n"""
                 cpp_code += """         contextp->timeInc(1);\n"""
                 cpp_code += f"""        top->clk = !top->clk;\n"""
 
-            #cpp_code += f"""        top->final();"""
-            #cpp_code += f"""        top = new Vtop_module;"""
+            if reset is None or idd == len(stimulus) - 1:
+                cpp_code += """    top->final();\n"""
+                cpp_code += """    }\n"""
                 
                 
                 
 
+        scenario_name = json.dumps(data["scenario"])
         cpp_code += f"""
-
+    scenario_{scenario_idx}_done:
         if (unpass == 0) {{
-            std::cout << "Test passed for scenario {data['scenario']}" << std::endl;
+            harness_printf("Test passed for scenario %s\\n", {scenario_name});
         }} else {{
-            std::cout << "Test failed,unpass = " << unpass << " for scenario {data['scenario']}" << std::endl;
-            unpass_total += unpass;
+            harness_printf("Test failed,unpass = %d for scenario %s\\n", unpass, {scenario_name});
         }}
+    harness_scenario_end(unpass);
+    return unpass;
+}}
 """
+        shards.write(cpp_code)
+    shards.close()
 
-    cpp_code += """
-    return unpass_total;
-}
-"""
-
-    with open("rfuzz-harness.cpp", "w") as file:
-        file.write(cpp_code)
+    # Every scenario is an independent job for the thread pool in sim-main.cpp
+    write_dispatch([f"scenario_{scenario_idx}" for scenario_idx in range(len(datas))])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,68 @@
+#ifndef HARNESS_PROBE_H
+#define HARNESS_PROBE_H
+
+// Waveform and coverage instrumentation of the generated harness.
+// Only the PROFILE=debug build is verilated with --trace and --coverage-line,
+// in the default build HARNESS_PROBE and HARNESS_DUMP expand to nothing.
+
+#include <verilated.h>
+#include "Vtop_module.h"
+
+#if VM_TRACE || VM_COVERAGE
+#include <algorithm>
+#include <memory>
+#include <string>
+#if VM_TRACE
+#include <verilated_vcd_c.h>
+#endif
+#if VM_COVERAGE
+#include <verilated_cov.h>
+#endif
+
+// Attached to one model instance, writes logs/<name>.vcd and logs/coverage_<name>.dat
+class HarnessProbe {
+  public:
+    HarnessProbe(VerilatedContext* contextp, Vtop_module* top, const std::string& name)
+        : contextp_(contextp), name_(name) {
+#if VM_TRACE
+        contextp_->traceEverOn(true);
+        tfp_.reset(new VerilatedVcdC);
+        top->trace(tfp_.get(), 99);
+        tfp_->open(("logs/" + name_ + ".vcd").c_str());
+#endif
+    }
+    ~HarnessProbe() {
+#if VM_TRACE
+        tfp_->close();
+#endif
+#if VM_COVERAGE
+        contextp_->coveragep()->write(("logs/coverage_" + name_ + ".dat").c_str());
+#endif
+    }
+    // Combinational harnesses never advance the simulation time, keep the samples apart
+    void dump() {
+#if VM_TRACE
+        const uint64_t time = std::max<uint64_t>(contextp_->time(), next_time_);
+        tfp_->dump(time);
+        next_time_ = time + 1;
+#endif
+    }
+
+  private:
+    VerilatedContext* contextp_;
+    std::string name_;
+#if VM_TRACE
+    std::unique_ptr<VerilatedVcdC> tfp_;
+    uint64_t next_time_ = 0;
+#endif
+};
+
+// Declared after the model, so the probe is closed before the model is destroyed
+#define HARNESS_PROBE(name) HarnessProbe probe {contextp, top, name}
+#define HARNESS_DUMP() probe.dump()
+#else
+#define HARNESS_PROBE(name)
+#define HARNESS_DUMP()
+#endif
+
+#endif // HARNESS_PROBE_H
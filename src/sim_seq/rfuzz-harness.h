@@ -1,11 +1,39 @@
 #ifndef RFUZZ_HARNESS_H
 #define RFUZZ_HARNESS_H
 
-#include "Vtop_module.h"
+#include <cstdint>
+#include <string>
 
 // Fuzz Harness
-// Generated by Pyverilog script
-// Give signals values in one cycle from the bitstream
-int fuzz_poke();
+// Generated by harness-generator.py from testbench.json
+// The testbench is split into independent jobs (scenarios), every job builds
+// its own VerilatedContext and model so jobs can run on different threads
+
+// Number of jobs in the generated harness
+int harness_job_count();
+
+// Run one job and return its number of mismatches
+int harness_run_job(int index);
+
+// Provided by sim-main.cpp: printf into the report of the job running on this thread
+void harness_printf(const char* fmt, ...);
+
+// Provided by sim-main.cpp: structured results, written to PROV_SIM_RESULTS (results.json)
+void harness_scenario_begin(const char* scenario);
+// Records a mismatch, returns whether it is still within the budget for a detailed report
+bool harness_mismatch(int step, int cycle, const char* signal, const std::string& expected,
+                      const std::string& actual);
+// Whether the rest of the current scenario should be skipped (PROV_SIM_ABORT_ON_BUDGET)
+bool harness_scenario_aborted();
+void harness_scenario_end(int unpass);
+
+// Multi-candidate testbenches: the outputs are compared against the expected values of
+// every candidate, mismatches are counted per candidate instead of failing the scenario
+void harness_scenario_candidates(int n_candidates);
+void harness_candidate_mismatch(int candidate);
+
+// Hex formatting of signal values for harness_mismatch, words are least significant first
+std::string harness_hex(uint64_t value);
+std::string harness_hex_words(const uint32_t* words, int n_words);
 
 #endif // RFUZZ_HARNESS_H
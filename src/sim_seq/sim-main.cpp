@@ -5,56 +5,252 @@
 // SPDX-License-Identifier: CC0-1.0
 //======================================================================
 
-// For std::unique_ptr
-#include <memory>
+#include <algorithm>
+#include <atomic>
+#include <cstdarg>
+#include <cstdio>
+#include <cstdlib>
+#include <fstream>
+#include <iostream>
+#include <string>
+#include <thread>
+#include <vector>
 
 // Include common routines
 #include <verilated.h>
 
-// Include model header, generated from Verilating "top.v"
-#include "Vtop_module.h"
+// The generated harness, this file does not depend on the DUT
 #include "rfuzz-harness.h"
 
-// Legacy function required only so linking works on Cygwin and MSVC++
+struct Mismatch {
+    int step;
+    int cycle;
+    std::string signal;
+    std::string expected;
+    std::string actual;
+};
 
+struct ScenarioResult {
+    std::string name;
+    int unpass = 0;
+    int mismatches = 0;
+    bool quiet = false;        // detail budget spent, mismatches are only counted
+    bool over_budget = false;  // the scenario's own budget is spent, PROV_SIM_ABORT_ON_BUDGET aborts it
+    bool aborted = false;  // the rest of the scenario was skipped
+    std::vector<Mismatch> first_mismatches;
+    std::vector<int> candidate_mismatches;  // multi-candidate testbenches only
+};
 
-int main(int argc, char** argv) {
-    // This is a more complicated example, please also see the simpler examples/make_hello_c.
+struct JobResult {
+    std::string log;
+    std::vector<ScenarioResult> scenarios;
+};
 
-    // Create logs/ directory in case we have traces to put under it
-    Verilated::mkdir("logs");
+// Result of the job running on this thread, printed in job order once all jobs are done
+static thread_local JobResult* current_job = nullptr;
+
+static int env_int(const char* name, int fallback) {
+    const char* env = std::getenv(name);
+    return env && *env ? std::atoi(env) : fallback;
+}
 
-    // Construct a VerilatedContext to hold simulation time, etc.
-    // Multiple modules (made later below with Vtop) may share the same
-    // context to share time, or modules may have different contexts if
-    // they should be independent from each other.
+// PROV_SIM_REPORTED_MISMATCHES bounds the mismatches kept per scenario in the results file
+static const size_t reported_mismatches =
+    static_cast<size_t>(std::max(0, env_int("PROV_SIM_REPORTED_MISMATCHES", 10)));
 
-    // Using unique_ptr is similar to
-    // "VerilatedContext* contextp = new VerilatedContext" then deleting at end.
+// Mismatches printed in detail per scenario and over the whole run, negative for no bound.
+// Past the budget mismatches are only counted.
+static const int mismatch_budget = env_int("PROV_SIM_MISMATCH_BUDGET", 10);
+static const int total_mismatch_budget = env_int("PROV_SIM_TOTAL_MISMATCH_BUDGET", 100);
+// PROV_SIM_ABORT_ON_BUDGET=1 skips the rest of a scenario once its own budget is spent. The total
+// budget is shared by the scenario threads, it only silences the detail so aborts do not depend on timing.
+static const bool abort_on_budget = env_int("PROV_SIM_ABORT_ON_BUDGET", 0) != 0;
 
-    const std::unique_ptr<VerilatedContext> contextp{new VerilatedContext};
-    // Do not instead make Vtop as a file-scope static variable, as the
-    // "C++ static initialization order fiasco" may cause a crash
+static std::atomic<int> total_detailed{0};
 
+// Mutant selected by the mutation analysis build of the DUT (PROV_SIM_MUTANT), 0 is the
+// original design. Imported through DPI by utils/rtl_mutation.py, unused otherwise.
+extern "C" int prov_mutant_select() {
+    static const int mutant = env_int("PROV_SIM_MUTANT", 0);
+    return mutant;
+}
 
-    // Construct the Verilated model, from Vtop.h generated from Verilating "top.v".
-    // Using unique_ptr is similar to "Vtop* top = new Vtop" then deleting at end.
-    // "TOP" will be the hierarchical name of the module.
-    // Vtop_module* top = new Vtop_module;
-    // top->clk = 0;
+void harness_printf(const char* fmt, ...) {
+    va_list args;
+    va_start(args, fmt);
+    va_list args_len;
+    va_copy(args_len, args);
+    const int len = std::vsnprintf(nullptr, 0, fmt, args_len);
+    va_end(args_len);
+    if (len > 0) {
+        std::string text(len + 1, '\0');
+        std::vsnprintf(&text[0], text.size(), fmt, args);
+        text.resize(len);
+        if (current_job) {
+            current_job->log.append(text);
+        } else {
+            std::fputs(text.c_str(), stdout);
+        }
+    }
+    va_end(args);
+}
 
-    int unpass = fuzz_poke();
-    std::cout<<"sim finished"<<std::endl;
-    std::cout << "Unpass: " << unpass << std::endl;
-    // contextp->coveragep()->write("logs/coverage.dat");
+void harness_scenario_begin(const char* scenario) {
+    current_job->scenarios.emplace_back();
+    current_job->scenarios.back().name = scenario;
+}
 
+bool harness_mismatch(int step, int cycle, const char* signal, const std::string& expected,
+                      const std::string& actual) {
+    ScenarioResult& result = current_job->scenarios.back();
+    result.mismatches++;
+    if (result.first_mismatches.size() < reported_mismatches) {
+        result.first_mismatches.push_back({step, cycle, signal, expected, actual});
+    }
+    if (mismatch_budget >= 0 && result.mismatches > mismatch_budget) result.over_budget = true;
+    if (result.quiet) return false;
+    if ((mismatch_budget < 0 || result.mismatches <= mismatch_budget)
+        && (total_mismatch_budget < 0 || total_detailed++ < total_mismatch_budget)) {
+        return true;
+    }
+    result.quiet = true;
+    harness_printf("Mismatch budget spent in scenario %s, further mismatches are only counted\n",
+                   result.name.c_str());
+    return false;
+}
+
+bool harness_scenario_aborted() {
+    ScenarioResult& result = current_job->scenarios.back();
+    if (abort_on_budget && result.over_budget && !result.aborted) {
+        result.aborted = true;
+        harness_printf("Scenario %s aborted after %d mismatches\n", result.name.c_str(),
+                       result.mismatches);
+    }
+    return result.aborted;
+}
+
+void harness_scenario_candidates(int n_candidates) {
+    current_job->scenarios.back().candidate_mismatches.assign(n_candidates, 0);
+}
+
+void harness_candidate_mismatch(int candidate) {
+    current_job->scenarios.back().candidate_mismatches[candidate]++;
+}
 
+void harness_scenario_end(int unpass) { current_job->scenarios.back().unpass = unpass; }
+
+std::string harness_hex(uint64_t value) {
+    char text[19];
+    std::snprintf(text, sizeof(text), "0x%llx", static_cast<unsigned long long>(value));
+    return text;
+}
+
+std::string harness_hex_words(const uint32_t* words, int n_words) {
+    std::string text = "0x";
+    char word[9];
+    for (int i = n_words - 1; i >= 0; i--) {
+        std::snprintf(word, sizeof(word), "%08x", words[i]);
+        text += word;
+    }
+    return text;
+}
+
+static std::string json_string(const std::string& value) {
+    std::string text = "\"";
+    for (const char c : value) {
+        if (c == '"' || c == '\\') {
+            text += '\\';
+            text += c;
+        } else if (static_cast<unsigned char>(c) < 0x20) {
+            char escaped[7];
+            std::snprintf(escaped, sizeof(escaped), "\\u%04x", c);
+            text += escaped;
+        } else {
+            text += c;
+        }
+    }
+    return text + "\"";
+}
+
+static void write_results(const std::vector<JobResult>& jobs, int unpass_total) {
+    const char* env = std::getenv("PROV_SIM_RESULTS");
+    std::ofstream out(env ? env : "results.json");
+    out << "{\n  \"passed\": " << (unpass_total == 0 ? "true" : "false")
+        << ",\n  \"unpass\": " << unpass_total << ",\n  \"scenarios\": [";
+    const char* sep = "\n";
+    for (const JobResult& job : jobs) {
+        for (const ScenarioResult& scenario : job.scenarios) {
+            out << sep << "    {\"scenario\": " << json_string(scenario.name)
+                << ", \"passed\": " << (scenario.unpass == 0 ? "true" : "false")
+                << ", \"mismatches\": " << scenario.unpass
+                << ", \"aborted\": " << (scenario.aborted ? "true" : "false")
+                << ", \"first_mismatches\": [";
+            const char* mismatch_sep = "";
+            for (const Mismatch& m : scenario.first_mismatches) {
+                out << mismatch_sep << "{\"step\": " << m.step << ", \"cycle\": " << m.cycle
+                    << ", \"signal\": " << json_string(m.signal)
+                    << ", \"expected\": " << json_string(m.expected)
+                    << ", \"actual\": " << json_string(m.actual) << "}";
+                mismatch_sep = ", ";
+            }
+            out << "]";
+            if (!scenario.candidate_mismatches.empty()) {
+                out << ", \"candidate_mismatches\": [";
+                const char* candidate_sep = "";
+                for (const int mismatches : scenario.candidate_mismatches) {
+                    out << candidate_sep << mismatches;
+                    candidate_sep = ", ";
+                }
+                out << "]";
+            }
+            out << "}";
+            sep = ",\n";
+        }
+    }
+    out << "\n  ]\n}\n";
+}
+
+// PROV_SIM_THREADS sets the size of the thread pool, all cores by default
+static int sim_threads(int n_jobs) {
+    int threads = 0;
+    if (const char* env = std::getenv("PROV_SIM_THREADS")) threads = std::atoi(env);
+    if (threads <= 0) threads = static_cast<int>(std::thread::hardware_concurrency());
+    return std::max(1, std::min(threads, n_jobs));
+}
+
+int main(int argc, char** argv) {
+    // Create logs/ directory in case we have traces to put under it
+    Verilated::mkdir("logs");
 
+    // Every job creates its own VerilatedContext and model, so the jobs are
+    // independent and can be spread over a pool of threads
+    const int n_jobs = harness_job_count();
+    std::vector<JobResult> jobs(n_jobs);
+    std::vector<int> unpass(n_jobs, 0);
+    std::atomic<int> next_job{0};
+    auto worker = [&]() {
+        for (int i = next_job++; i < n_jobs; i = next_job++) {
+            current_job = &jobs[i];
+            unpass[i] = harness_run_job(i);
+            current_job = nullptr;
+        }
+    };
+    std::vector<std::thread> pool;
+    for (int t = 1; t < sim_threads(n_jobs); t++) pool.emplace_back(worker);
+    worker();
+    for (std::thread& t : pool) t.join();
 
-    // Final simulation summary
-    // contextp->statsPrintSummary();
+    // Merge the per-job reports and mismatch counts
+    int unpass_total = 0;
+    for (int i = 0; i < n_jobs; i++) {
+        std::fputs(jobs[i].log.c_str(), stdout);
+        unpass_total += unpass[i];
+    }
+    write_results(jobs, unpass_total);
+    std::cout << "sim finished" << std::endl;
+    std::cout << "Unpass: " << unpass_total << std::endl;
 
     // Return good completion status
     // Don't use exit() or destructor won't get called
-    return unpass;
+    return unpass_total == 0 ? 0 : 1;
 }
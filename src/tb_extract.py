@@ -3,7 +3,7 @@ from typing import Dict
 
 from llama_index.core.base.llms.types import ChatMessage, MessageRole
 from utils.gen_config import get_llm
-from utils.log_utils import get_logger
+from utils.log_utils import get_logger, log_artifact
 from utils.prompts import ORDER_PROMPT
 from utils.token_counter import TokenCounter, TokenCounterCached
 
@@ -184,7 +184,6 @@ class TBExtractor:
         # self.token_counter.reset()
         if isinstance(self.token_counter, TokenCounterCached):
             self.token_counter.set_enable_cache(True)
-        print(f"Setting token counter tag to {self.__class__.__name__}")
         self.token_counter.set_cur_tag(self.__class__.__name__)
         msg = [
             ChatMessage(content=SYSTEM_PROMPT, role=MessageRole.SYSTEM),
@@ -201,16 +200,11 @@ class TBExtractor:
                 role=MessageRole.USER,
             ),
         ]
-        print(f"Generating response ")
         response, token_cnt = self.token_counter.count_chat(msg)
-        print(f"Response: {response.message.content}")
 
         logger.info(f"Token count: {token_cnt}")
-        logger.info(f"{response.message.content}")
+        log_artifact(logger, "response", response.message.content)
         self.token_counter.log_token_stats()
-
-        # response = self.generate(msg)
-        logger.info(f"Get response from {self.model}: {response.message.content}")
         try:
             # output_json_obj: Dict = json.loads(response.message.content, strict=False)
 
@@ -227,9 +221,7 @@ class TBExtractor:
                 logger.info(f"Failed to parse response, Original Spec: {input_spec}")
                 return None
         except json.decoder.JSONDecodeError as e:
-            print(f"Json parse error: {e}")
             logger.info(f"Json parse error: {e}")
-            print(response)
             return None
 
         return output_json_obj
@@ -1,12 +1,41 @@
 import json
 import logging
 import ast
+import glob
+import importlib.util
+import multiprocessing
 import os   
+import shutil
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+from utils.sim_cache import (
+    cached_library,
+    ccache_make_vars,
+    restore_obj_dir,
+    runtime_cache_key,
+    runtime_dir,
+    sim_cache_key,
+    store_library,
+    store_obj_dir,
+    store_runtime,
+)
+from utils.rtl_mutation import mutate_verilog
+from utils.sim_backend import SIM_BACKEND, IcarusBackend, SimBackend, needs_fallback, select_backend
+from utils.sim_coverage import read_coverage, summarize_coverage
+from utils.sim_workdir import create_sim_workdir, release_sim_workdir
+from utils.tracing import set_span_attributes, span, traced
+from utils.verilated_ffi import VerilatedLibrary
+from utils.verilog_ports import is_binary, load_port_model, write_ports_json
+
 logger = logging.getLogger(__name__)
 
+# Rerun failing scenarios with waveform tracing and coverage, unless this is set to "0"
+SIM_DEBUG_RERUN = os.environ.get("PROV_SIM_DEBUG_RERUN", "1")
+# seconds of a lockstep simulation, the timeout of the checkers run by python_call
+LOCKSTEP_TIMEOUT = 120
+
 
 def get_prob_spec(file_dir_path,task_number):
     # give the file path and task_number, return the problem specification and the header in verilog-eval/HDLBits/HDLBits_data_backup0304.jsonl
@@ -226,59 +255,54 @@ def create_testbench_json_cmb(stimulus_file, output_file,index_list):
             print(f"Successfully merged stimulus and output data to {os.path.join(output_dir, f'testbench_{idx}.json')}")
 
 
-def simulate_dut_seq(output_dir):
-    # Get the absolute path of the current script
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    sim_dir = os.path.join(current_dir, "sim_seq")
-    
-    # Source file paths
-    dut_path = os.path.join(output_dir, "top.v")
-    test_path = os.path.join(output_dir, "testbench_0.json")
-    
-    # Ensure target directory exists
-    os.makedirs(sim_dir, exist_ok=True)
-    
-    # Clean and copy files
-    subprocess.run(f"cd {sim_dir} && make clean > /dev/null 2>&1", shell=True)
-    subprocess.run(f"rm -f {sim_dir}/top_module.v", shell=True)
-    subprocess.run(f"rm -f {sim_dir}/testbench.json", shell=True)
-    
-    # Copy files to simulation working directory
-    subprocess.run(f"cp {dut_path} {sim_dir}/top_module.v", shell=True)
-    subprocess.run(f"cp {test_path} {sim_dir}/testbench.json", shell=True)
-    
-    # Execute simulation command and capture output
-    cmd = f"cd {sim_dir} && python harness-generator.py && make"
-    result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-    
-    # Save output to log file
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    log_file = os.path.join(output_dir, f"simulate_seq.log")
-    with open(log_file, "w") as f:
-        f.write(f"Command: {cmd}\n")
-        f.write(f"Return code: {result.returncode}\n")
-        f.write("\n=== STDOUT ===\n")
-        f.write(result.stdout)
-        f.write("\n=== STDERR ===\n")
-        f.write(result.stderr)
-
-def simulate_dut_cmb(output_dir):
+class VerilatorBackend(SimBackend):
+    """The generated C++ harness of sim_seq / sim_cmb, see _build_and_run"""
+
+    name = "verilator"
+
+    def available(self):
+        return shutil.which("verilator") is not None
+
+    def run(self, dut_path, testbench, sim_type, env, model_mode="scoped", keep_workdir=None):
+        template_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), f"sim_{sim_type}")
+        return _build_and_run(template_dir, dut_path, testbench, model_mode, env, "fast", keep_workdir)
+
+
+SIM_BACKENDS = {"verilator": VerilatorBackend(), "icarus": IcarusBackend()}
+
+
+@traced("simulate")
+def _run_simulation(output_dir, sim_type, keep_workdir=None, model_mode="scoped", threads=None,
+                    mismatch_budget=None, total_mismatch_budget=None, abort_on_budget=None,
+                    debug_rerun=None, backend=None):
+    """
+    Build and run testbench_0.json of output_dir against top.v
+
+    Returns a dict with "passed", "unpass" (None if nothing was simulated), "scenarios"
+    (per-scenario results of the harness), "returncode" and "log", or None if the
+    inputs are missing. The scenarios are also saved to simulate_{sim_type}_results.json.
+
+    The simulation is built with the fast, uninstrumented profile. If scenarios fail,
+    only those are rerun with a debug build, and their waveforms and line coverage are
+    saved to sim_debug_{sim_type}/ ("debug_dir" of the returned dict).
+
+    keep_workdir -- retention policy of the scratch directory, see utils.sim_workdir
+    model_mode -- "scoped" for a fresh model per input step, "reuse" to reuse one
+    threads -- size of the scenario thread pool of the simulation binary, all cores by default
+    mismatch_budget -- mismatches reported in detail per scenario, past it they are only counted
+    total_mismatch_budget -- the same over all scenarios, negative budgets are unbounded
+    abort_on_budget -- skip the rest of a scenario once its budget is spent
+    debug_rerun -- rerun failing scenarios with tracing and coverage, PROV_SIM_DEBUG_RERUN by default
+    backend -- "verilator", "icarus" or "auto" (see utils.sim_backend), PROV_SIM_BACKEND by default
+    """
     # Get the absolute path of the current script
     current_dir = os.path.dirname(os.path.abspath(__file__))
-    sim_dir = os.path.join(current_dir, "sim_cmb")
-    
+    template_dir = os.path.join(current_dir, f"sim_{sim_type}")
+
     # Source file paths
     dut_path = os.path.join(output_dir, "top.v")
     test_path = os.path.join(output_dir, "testbench_0.json")
-    
-    # Ensure target directory exists
-    os.makedirs(sim_dir, exist_ok=True)
-    
-    # Clean and copy files
-    subprocess.run(f"cd {sim_dir} && make clean > /dev/null 2>&1", shell=True)
-    subprocess.run(f"rm -f {sim_dir}/top_module.v", shell=True)
-    subprocess.run(f"rm -f {sim_dir}/testbench.json", shell=True)
-    
+
     # Check if files exist
     if not os.path.exists(dut_path):
         print(f"Error: DUT path {dut_path} does not exist")
@@ -286,25 +310,766 @@ def simulate_dut_cmb(output_dir):
     if not os.path.exists(test_path):
         print(f"Error: Test path {test_path} does not exist")
         return
-        
-    # Copy files to simulation working directory
-    subprocess.run(f"cp {dut_path} {sim_dir}/top_module.v", shell=True)
-    subprocess.run(f"cp {test_path} {sim_dir}/testbench.json", shell=True)
-    
-    # Execute simulation command and capture output
-    cmd = f"cd {sim_dir} && python harness-generator.py && make"
-    result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-    
+
+    env = dict(os.environ)
+    if threads:
+        env["PROV_SIM_THREADS"] = str(threads)
+    if mismatch_budget is not None:
+        env["PROV_SIM_MISMATCH_BUDGET"] = str(mismatch_budget)
+    if total_mismatch_budget is not None:
+        env["PROV_SIM_TOTAL_MISMATCH_BUDGET"] = str(total_mismatch_budget)
+    if abort_on_budget is not None:
+        env["PROV_SIM_ABORT_ON_BUDGET"] = "1" if abort_on_budget else "0"
+
+    with open(test_path, "r") as f:
+        testbench = f.read()
+    sim_backend = select_backend(dut_path, testbench, sim_type, SIM_BACKENDS, backend, model_mode)
+    run = sim_backend.run(dut_path, testbench, sim_type, env, model_mode, keep_workdir)
+    fallback_run = None
+    if (
+        (backend or SIM_BACKEND) == "auto"
+        and sim_backend.name == "icarus"
+        and needs_fallback(run)
+        and SIM_BACKENDS["verilator"].available()
+    ):
+        # iverilog rejected the design or an output was x/z, Verilator gives the verdict
+        fallback_run = run
+        sim_backend = SIM_BACKENDS["verilator"]
+        run = sim_backend.run(dut_path, testbench, sim_type, env, model_mode, keep_workdir)
+    set_span_attributes(sim_type=sim_type, backend=sim_backend.name)
+    sim_results = run["sim_results"]
+    result = run["result"]
+
     # Save output to log file
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    log_file = os.path.join(output_dir, f"simulate_cmb.log")
+    log_file = os.path.join(output_dir, f"simulate_{sim_type}.log")
     with open(log_file, "w") as f:
-        f.write(f"Command: {cmd}\n")
-        f.write(f"Return code: {result.returncode}\n")
-        f.write("\n=== STDOUT ===\n")
-        f.write(result.stdout)
-        f.write("\n=== STDERR ===\n")
-        f.write(result.stderr)
+        if fallback_run is not None:
+            f.write("Backend: icarus, rerun on verilator\n")
+            _write_run_log(f, fallback_run)
+            f.write("\n")
+        f.write(f"Backend: {sim_backend.name}\n")
+        _write_run_log(f, run)
+
+    if sim_results is None:
+        # The harness did not run to completion, e.g. a compile error in top.v
+        sim_results = {"passed": False, "unpass": None, "scenarios": []}
+    with open(os.path.join(output_dir, f"simulate_{sim_type}_results.json"), "w") as f:
+        json.dump(sim_results, f, indent=4)
+    sim_results["returncode"] = result.returncode
+    sim_results["log"] = log_file
+    sim_results["backend"] = sim_backend.name
+    set_span_attributes(passed=sim_results["passed"], cache_hit=run["cache_hit"])
+
+    if debug_rerun is None:
+        debug_rerun = SIM_DEBUG_RERUN != "0"
+    # The instrumented rerun is a Verilator build
+    if debug_rerun and sim_results["unpass"] and sim_backend.name == "verilator":
+        sim_results["debug_dir"] = _debug_rerun(
+            output_dir, sim_type, template_dir, dut_path, testbench, sim_results, model_mode, env, log_file
+        )
+    return sim_results
+
+
+def _build_and_run(template_dir, dut_path, testbench, model_mode, env, profile, keep_workdir=None, collect=None,
+                   make_vars=None):
+    """
+    Build and run testbench (JSON text) in a fresh workdir with the given make PROFILE
+    and make_vars, collect(sim_dir) is called before the workdir is released
+    """
+    # Every simulation runs in its own scratch copy of the template directory
+    sim_dir = create_sim_workdir(template_dir)
+    shutil.copy(dut_path, os.path.join(sim_dir, "top_module.v"))
+    with open(os.path.join(sim_dir, "testbench.json"), "w") as f:
+        f.write(testbench)
+    # The harness generator takes the port names and widths from the header, not from the testbench values
+    header = load_port_model(dut_path)
+    if header is not None:
+        write_ports_json(header, sim_dir)
+
+    # Reuse the verilated model of an unchanged DUT, only the harness is rebuilt
+    make_vars = dict(ccache_make_vars(), PROFILE=profile, **(make_vars or {}))
+    cache_key = sim_cache_key(sim_dir, dut_path, make_vars)
+    make_args = " ".join(f"{k}={v}" for k, v in make_vars.items())
+    # The Verilator runtime and sim-main.o are shared by all DUTs built with the same flags
+    runtime_key = runtime_cache_key(sim_dir, make_vars)
+    runtime = runtime_dir(runtime_key)
+    runtime_args = f" RUNTIME_DIR={runtime}" if runtime else ""
+    cache_hit = restore_obj_dir(cache_key, sim_dir)
+    target = "rebuild" if cache_hit else "run"
+
+    # Execute simulation command and capture output
+    cmd = (
+        f"cd {sim_dir} && python harness-generator.py --model-mode {model_mode}"
+        f" && make {target} {make_args}{runtime_args}"
+    )
+    results_path = os.path.join(sim_dir, "results.json")
+    env = dict(env, PROV_SIM_RESULTS=results_path)
+    with span("sim.build_and_run", profile=profile, cache_hit=cache_hit):
+        result = subprocess.run(cmd, shell=True, capture_output=True, text=True, env=env)
+    binary_path = os.path.join(sim_dir, "obj_dir", "Vtop_module")
+    if cache_hit and not os.path.exists(binary_path):
+        # A stale or broken cache entry, fall back to a full build without any cached objects
+        logger.warning(f"Cached build {cache_key} failed, rebuilding from scratch")
+        cache_hit = False
+        subprocess.run(f"cd {sim_dir} && make clean > /dev/null 2>&1", shell=True)
+        cmd = f"cd {sim_dir} && make run {make_args}"
+        with span("sim.build_and_run", profile=profile, cache_hit=False):
+            result = subprocess.run(cmd, shell=True, capture_output=True, text=True, env=env)
+    if not cache_hit and os.path.exists(binary_path):
+        store_obj_dir(cache_key, sim_dir)
+    if runtime is None and os.path.exists(binary_path):
+        store_runtime(runtime_key, sim_dir)
+    sim_results = _load_sim_results(results_path)
+    if collect is not None:
+        collect(sim_dir)
+    kept = release_sim_workdir(sim_dir, result.returncode == 0, keep_workdir)
+    return {
+        "cmd": cmd,
+        "result": result,
+        "cache_hit": cache_hit,
+        "cache_key": cache_key,
+        "sim_dir": sim_dir if kept else None,
+        "sim_results": sim_results,
+    }
+
+
+def _write_run_log(f, run):
+    f.write(f"Command: {run['cmd']}\n")
+    f.write(f"Build cache: {'hit' if run['cache_hit'] else 'miss'} ({run['cache_key']})\n")
+    if run["sim_dir"]:
+        f.write(f"Workdir: {run['sim_dir']}\n")
+    f.write(f"Return code: {run['result'].returncode}\n")
+    f.write("\n=== STDOUT ===\n")
+    f.write(run["result"].stdout)
+    f.write("\n=== STDERR ===\n")
+    f.write(run["result"].stderr)
+
+
+def _debug_rerun(output_dir, sim_type, template_dir, dut_path, testbench, sim_results, model_mode, env, log_file):
+    """
+    Rerun only the failing scenarios with the debug profile (--trace --coverage-line),
+    return the directory holding their waveforms and coverage
+    """
+    try:
+        scenarios = json.loads(testbench)
+    except json.JSONDecodeError:
+        logger.warning("Debug rerun skipped, the testbench is not a JSON list")
+        return None
+    failing = [i for i, s in enumerate(sim_results["scenarios"]) if not s["passed"]]
+    if not isinstance(scenarios, list) or len(scenarios) != len(sim_results["scenarios"]):
+        logger.warning("Debug rerun skipped, the results do not match the testbench scenarios")
+        return None
+
+    debug_dir = os.path.join(output_dir, f"sim_debug_{sim_type}")
+    shutil.rmtree(debug_dir, ignore_errors=True)
+    os.makedirs(debug_dir)
+
+    def collect(sim_dir):
+        logs_dir = os.path.join(sim_dir, "logs")
+        if not os.path.isdir(logs_dir):
+            return
+        for name in os.listdir(logs_dir):
+            if name.endswith(".vcd") or name.endswith(".dat"):
+                shutil.copy(os.path.join(logs_dir, name), debug_dir)
+
+    failing_testbench = json.dumps([scenarios[i] for i in failing], indent=2, ensure_ascii=False)
+    # Every failing scenario already has its verdict, print all mismatches of the rerun
+    env = dict(env, PROV_SIM_MISMATCH_BUDGET="-1", PROV_SIM_TOTAL_MISMATCH_BUDGET="-1")
+    run = _build_and_run(template_dir, dut_path, failing_testbench, model_mode, env, "debug", collect=collect)
+    _merge_coverage(debug_dir)
+    with open(log_file, "a") as f:
+        f.write(f"\n=== DEBUG RERUN of {len(failing)} failing scenario(s), artifacts in {debug_dir} ===\n")
+        _write_run_log(f, run)
+    return debug_dir
+
+
+def _merge_coverage(debug_dir):
+    # One coverage file is written per model instance, merge them if verilator_coverage is installed
+    parts = sorted(glob.glob(os.path.join(debug_dir, "coverage_*.dat")))
+    if not parts or shutil.which("verilator_coverage") is None:
+        return
+    merged = os.path.join(debug_dir, "coverage.dat")
+    result = subprocess.run(
+        ["verilator_coverage", "-write", merged, *parts], capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        logger.warning(f"verilator_coverage failed: {result.stderr}")
+
+
+def stimulus_to_testbench(stimulus, circuit_type):
+    """
+    Testbench scenarios without expected outputs, to exercise a DUT with stimulus.json
+    """
+    testbench = []
+    for scenario in stimulus:
+        if circuit_type == "CMB":
+            # One scenario per input step, as in create_testbench_json_cmb
+            for i, step in enumerate(scenario["input variable"]):
+                testbench.append({
+                    "scenario": scenario["scenario"] + str(i),
+                    "input variable": [step],
+                    "output variable": [{}],
+                })
+            continue
+        steps = []
+        for step in scenario["input variable"]:
+            padded = {"clock cycles": step["clock cycles"]}
+            for key, item in step.items():
+                if key != "clock cycles":
+                    # Hold the last value for the remaining clock cycles, as in create_testbench_json
+                    padded[key] = list(item) + [item[-1]] * (step["clock cycles"] - len(item))
+            steps.append(padded)
+        testbench.append({
+            "scenario": scenario["scenario"],
+            "input variable": steps,
+            "output variable": [{"clock cycles": step["clock cycles"]} for step in steps],
+        })
+    return testbench
+
+
+def measure_stimulus_coverage(output_dir, circuit_type, stimulus, model_mode="scoped"):
+    """
+    Simulate stimulus on top.v of output_dir with a line coverage build
+
+    Returns the summary of utils.sim_coverage.summarize_coverage, also saved to
+    stimulus_coverage/coverage.json, or None if the simulation did not run.
+    """
+    sim_type = "cmb" if circuit_type == "CMB" else "seq"
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    template_dir = os.path.join(current_dir, f"sim_{sim_type}")
+    dut_path = os.path.join(output_dir, "top.v")
+    if not os.path.exists(dut_path):
+        print(f"Error: DUT path {dut_path} does not exist")
+        return None
+
+    coverage_dir = os.path.join(output_dir, "stimulus_coverage")
+    shutil.rmtree(coverage_dir, ignore_errors=True)
+    os.makedirs(coverage_dir)
+
+    def collect(sim_dir):
+        for path in glob.glob(os.path.join(sim_dir, "logs", "coverage_*.dat")):
+            shutil.copy(path, coverage_dir)
+
+    testbench = json.dumps(stimulus_to_testbench(stimulus, circuit_type), indent=2, ensure_ascii=False)
+    run = _build_and_run(template_dir, dut_path, testbench, model_mode, dict(os.environ), "coverage", collect=collect)
+    with open(os.path.join(coverage_dir, f"simulate_{sim_type}.log"), "w") as f:
+        _write_run_log(f, run)
+    paths = sorted(glob.glob(os.path.join(coverage_dir, "coverage_*.dat")))
+    if run["sim_results"] is None or not paths:
+        logger.warning(f"No coverage collected for {output_dir}, see {coverage_dir}")
+        return None
+    summary = summarize_coverage(read_coverage(paths), dut_path)
+    with open(os.path.join(coverage_dir, "coverage.json"), "w") as f:
+        json.dump(summary, f, indent=4)
+    return summary
+
+
+def score_testbench_mutants(output_dir, sim_type, max_mutants=200, max_workers=None, timeout=60, seed=0):
+    """
+    Mutation score of testbench_0.json of output_dir against mutants of top.v
+
+    All mutants are built into one Verilator model (see utils.rtl_mutation) and run as
+    parallel processes of the same binary. A mutant is killed if its results report a
+    failing testbench. Mutants that crash (no results, e.g. a segfault, $stop or assertion)
+    or time out are counted apart and left out of the kill ratio.
+    Returns a dict with "original_passed", "mutants", "killed", "crashed", "timeouts",
+    "kill_ratio" and the "survived" mutants, also saved to mutation_{sim_type}.json, or
+    None if the inputs are missing or the mutant build failed. The kill ratio is None if
+    the testbench fails on the original design.
+    """
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    template_dir = os.path.join(current_dir, f"sim_{sim_type}")
+    dut_path = os.path.join(output_dir, "top.v")
+    test_path = os.path.join(output_dir, "testbench_0.json")
+    if not os.path.exists(dut_path) or not os.path.exists(test_path):
+        print(f"Error: top.v or testbench_0.json missing in {output_dir}")
+        return None
+
+    with open(dut_path, "r") as f:
+        source = f.read()
+    try:
+        mutated_source, mutants = mutate_verilog(source, max_mutants=max_mutants, seed=seed)
+    except ValueError as e:
+        logger.warning(f"No mutants for {dut_path}: {e}")
+        return None
+    mutation_dir = os.path.join(output_dir, "mutation")
+    os.makedirs(mutation_dir, exist_ok=True)
+    mutants_path = os.path.join(mutation_dir, "top_mutants.v")
+    with open(mutants_path, "w") as f:
+        f.write(mutated_source)
+    with open(test_path, "r") as f:
+        testbench = f.read()
+
+    # Mutants only need a verdict: stop every scenario at its first mismatch
+    env = dict(
+        os.environ,
+        PROV_SIM_THREADS="1",
+        PROV_SIM_MISMATCH_BUDGET="0",
+        PROV_SIM_TOTAL_MISMATCH_BUDGET="0",
+        PROV_SIM_ABORT_ON_BUDGET="1",
+    )
+    # mutant id -> "killed", "survived", "crashed" or "timeout"
+    verdicts = {}
+
+    def run_mutant(sim_dir, mutant):
+        results_path = os.path.join(sim_dir, f"results_{mutant['id']}.json")
+        mutant_env = dict(env, PROV_SIM_MUTANT=str(mutant["id"]), PROV_SIM_RESULTS=results_path)
+        try:
+            subprocess.run(
+                [os.path.join(sim_dir, "obj_dir", "Vtop_module")], cwd=sim_dir, env=mutant_env,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=timeout,
+            )
+        except subprocess.TimeoutExpired:
+            return "timeout"
+        # The exit code does not tell a failing testbench from a crash, the results file does
+        try:
+            with open(results_path, "r") as f:
+                passed = json.load(f)["passed"]
+        except (OSError, ValueError, KeyError):
+            return "crashed"
+        return "survived" if passed else "killed"
+
+    def collect(sim_dir):
+        if not os.path.exists(os.path.join(sim_dir, "obj_dir", "Vtop_module")):
+            return
+        with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+            for mutant, verdict in zip(mutants, executor.map(lambda m: run_mutant(sim_dir, m), mutants)):
+                verdicts[mutant["id"]] = verdict
+
+    # The build itself runs mutant 0, the original design
+    run = _build_and_run(
+        template_dir, mutants_path, testbench, "scoped", env, "fast", collect=collect,
+        make_vars={"EXTRA_VERILATOR_FLAGS": "-Wno-fatal"},
+    )
+    with open(os.path.join(mutation_dir, f"simulate_{sim_type}.log"), "w") as f:
+        _write_run_log(f, run)
+    if run["sim_results"] is None:
+        logger.warning(f"Mutant build of {dut_path} failed, see {mutation_dir}")
+        return None
+
+    counts = {verdict: sum(1 for v in verdicts.values() if v == verdict)
+              for verdict in ("killed", "survived", "crashed", "timeout")}
+    original_passed = run["sim_results"]["passed"]
+    scored = counts["killed"] + counts["survived"]
+    score = {
+        "original_passed": original_passed,
+        "mutants": len(mutants),
+        "killed": counts["killed"],
+        "crashed": counts["crashed"],
+        "timeouts": counts["timeout"],
+        "kill_ratio": counts["killed"] / scored if original_passed and scored else None,
+        "survived": [m for m in mutants if verdicts.get(m["id"]) == "survived"],
+    }
+    if not original_passed:
+        logger.warning(f"Testbench of {output_dir} fails on the original design, no kill ratio")
+    with open(os.path.join(output_dir, f"mutation_{sim_type}.json"), "w") as f:
+        json.dump(score, f, indent=4)
+    return score
+
+
+def build_verilated_library(dut_path):
+    """
+    Verilate dut_path once into a shared library with the C ABI of sim_ffi/ffi-main.cpp
+
+    Returns the path of the cached library, or None if the build failed.
+    """
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    template_dir = os.path.join(current_dir, "sim_ffi")
+    sim_dir = create_sim_workdir(template_dir)
+    try:
+        make_vars = ccache_make_vars()
+        cache_key = sim_cache_key(sim_dir, dut_path, make_vars)
+        library_path = cached_library(cache_key, "libVtop_module.so")
+        if library_path:
+            return library_path
+        shutil.copy(dut_path, os.path.join(sim_dir, "top_module.v"))
+        make_args = " ".join(f"{k}={v}" for k, v in make_vars.items())
+        result = subprocess.run(
+            f"cd {sim_dir} && make lib {make_args}", shell=True, capture_output=True, text=True
+        )
+        built = os.path.join(sim_dir, "obj_dir", "libVtop_module.so")
+        if result.returncode != 0 or not os.path.exists(built):
+            logger.warning(f"Shared library build of {dut_path} failed:\n{result.stdout}\n{result.stderr}")
+            return None
+        return store_library(cache_key, built)
+    finally:
+        release_sim_workdir(sim_dir, True)
+
+
+def _load_golden_dut(checker_path):
+    # The checker only reads stimulus.json under __main__, importing it just defines GoldenDUT
+    spec = importlib.util.spec_from_file_location(f"pychecker_{abs(hash(checker_path))}", checker_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.GoldenDUT
+
+
+class _ScenarioResult:
+    """Mismatches of one scenario, in the format of the harness results.json"""
+
+    def __init__(self, name, mismatch_budget):
+        self.result = {"scenario": name, "passed": True, "mismatches": 0, "aborted": False, "first_mismatches": []}
+        self.mismatch_budget = mismatch_budget
+
+    def compare(self, top, expected, step, cycle):
+        for name, value in expected.items():
+            # Unknown expected values are not checked, as in the harness
+            if name not in top.library.ports or not is_binary(value):
+                continue
+            actual = top.get(name)
+            if actual == int(value, 2):
+                continue
+            self.result["passed"] = False
+            self.result["mismatches"] += 1
+            if self.mismatch_budget < 0 or len(self.result["first_mismatches"]) < self.mismatch_budget:
+                self.result["first_mismatches"].append({
+                    "step": step,
+                    "cycle": cycle,
+                    "signal": name,
+                    "expected": hex(int(value, 2)),
+                    "actual": hex(actual),
+                })
+        return self.result["passed"]
+
+
+def _drive_seq(library, scenario, check):
+    """
+    Drive the input steps of a SEQ scenario, each on a fresh model, with the cycle
+    sequence of the sim_seq harness: inputs applied with clk low, outputs sampled
+    after the rising edge by check(top, step, cycle, input_vars). A false return of
+    check stops the scenario, returns whether all steps ran.
+    """
+    for step_idx, step in enumerate(scenario["input variable"]):
+        clock_cycles = step["clock cycles"]
+        inputs = {k: list(v) for k, v in step.items() if k != "clock cycles"}
+        for values in inputs.values():
+            values.extend([values[-1]] * (clock_cycles - len(values)))
+        with library.model() as top:
+            top.eval()
+            top.set("clk", 0)
+            for cycle in range(clock_cycles):
+                input_vars = {k: v[cycle] for k, v in inputs.items()}
+                applied = {k: v for k, v in input_vars.items() if k in library.ports and is_binary(v)}
+                for name in applied:
+                    top.set(name, 0)
+                top.eval()
+                top.time_inc(1)
+                for name, value in applied.items():
+                    top.set(name, int(value, 2))
+                top.toggle("clk")
+                top.eval()
+                if not check(top, step_idx, cycle, input_vars):
+                    return False
+                top.time_inc(1)
+                top.toggle("clk")
+    return True
+
+
+def _drive_cmb(library, scenario, check):
+    """The CMB counterpart of _drive_seq, one model per input step as with --model-mode scoped"""
+    for step_idx, step in enumerate(scenario["input variable"]):
+        with library.model() as top:
+            for name, value in step.items():
+                if name in library.ports and is_binary(value):
+                    top.set(name, int(value, 2))
+            top.eval()
+            if not check(top, step_idx, 0, step):
+                return False
+    return True
+
+
+def _lockstep_scenario(library, golden_dut, scenario, result, circuit_type, stop_on_mismatch):
+    if circuit_type == "CMB":
+        # One GoldenDUT for all steps of the scenario, as in CHECKER_TAIL of pychecker.py
+        dut = golden_dut()
+
+        def check(top, step_idx, cycle, input_vars):
+            passed = result.compare(top, dut.load(input_vars), step_idx, cycle)
+            return passed or not stop_on_mismatch
+        completed = _drive_cmb(library, scenario, check)
+    else:
+        # A fresh GoldenDUT per input step and a falling edge load after every cycle, as in CHECKER_TAIL
+        duts = {}
+
+        def check(top, step_idx, cycle, input_vars):
+            dut = duts.setdefault(step_idx, golden_dut())
+            passed = result.compare(top, dut.load(1, input_vars), step_idx, cycle)
+            dut.load(0, {k: "0" * len(v) for k, v in input_vars.items()})
+            return passed or not stop_on_mismatch
+        completed = _drive_seq(library, scenario, check)
+    result.result["aborted"] = not completed
+
+
+def _lockstep_scenarios(library_path, checker_path, stimulus, circuit_type, stop_on_mismatch, mismatch_budget):
+    """the scenario results of a lockstep simulation, or an error message if it cannot run"""
+    library = VerilatedLibrary.load(library_path)
+    if circuit_type != "CMB" and "clk" not in library.ports:
+        return "top.v has no clk input, lockstep simulation skipped"
+    try:
+        golden_dut = _load_golden_dut(checker_path)
+    except Exception as e:
+        return f"Cannot load GoldenDUT from {checker_path}: {e}"
+    scenarios = []
+    for scenario in stimulus:
+        result = _ScenarioResult(scenario["scenario"], mismatch_budget)
+        try:
+            _lockstep_scenario(library, golden_dut, scenario, result, circuit_type, stop_on_mismatch)
+        except Exception as e:
+            # A crashing GoldenDUT is a failure of the checker, not of the RTL
+            return f"GoldenDUT failed on scenario {scenario['scenario']}: {e}"
+        scenarios.append(result.result)
+        if stop_on_mismatch and not result.result["passed"]:
+            break
+    return scenarios
+
+
+def _lockstep_process(conn, *args):
+    try:
+        conn.send(_lockstep_scenarios(*args))
+    except BaseException as e:
+        # sys.exit or anything else raised by the generated checker
+        conn.send(f"Lockstep simulation raised {e!r}")
+    finally:
+        conn.close()
+
+
+@traced("simulate.lockstep")
+def lockstep_simulate(output_dir, circuit_type, checker_path=None, stop_on_mismatch=True, mismatch_budget=10,
+                      timeout=LOCKSTEP_TIMEOUT):
+    """
+    Run stimulus.json of output_dir on top.v and the GoldenDUT of pychecker_0.py side by side
+
+    top.v is verilated once into a shared library (build_verilated_library) and driven
+    from Python, so neither a harness nor testbench JSON is generated. With
+    stop_on_mismatch the run stops at the first mismatching cycle. The generated
+    checker runs in a child process killed after timeout seconds, like a checker run
+    by python_call, so it cannot hang or exit the run.
+    Returns a dict in the format of _run_simulation, also saved to
+    lockstep_{sim_type}_results.json, or None if the library or the checker could not
+    be loaded or timed out, in which case the harness flow should be used.
+    """
+    sim_type = "cmb" if circuit_type == "CMB" else "seq"
+    dut_path = os.path.join(output_dir, "top.v")
+    checker_path = checker_path or os.path.join(output_dir, "pychecker_0.py")
+    stimulus_path = os.path.join(output_dir, "stimulus.json")
+    for path in (dut_path, checker_path, stimulus_path):
+        if not os.path.exists(path):
+            print(f"Error: {path} does not exist")
+            return None
+
+    library_path = build_verilated_library(dut_path)
+    if library_path is None:
+        return None
+    with open(stimulus_path, "r") as f:
+        stimulus = json.load(f)
+
+    # spawn, a forked child would inherit the locks held by the other threads of the run
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(
+        target=_lockstep_process,
+        args=(sender, library_path, checker_path, stimulus, circuit_type, stop_on_mismatch, mismatch_budget),
+        daemon=True,
+    )
+    process.start()
+    sender.close()
+    try:
+        if not receiver.poll(timeout):
+            logger.warning(f"Lockstep simulation of {output_dir} timed out after {timeout}s")
+            return None
+        scenarios = receiver.recv()
+    except EOFError:
+        logger.warning(f"Lockstep simulation of {output_dir} died, exit code {process.exitcode}")
+        return None
+    finally:
+        receiver.close()
+        process.kill()
+        process.join()
+    if isinstance(scenarios, str):
+        logger.warning(f"{dut_path}: {scenarios}")
+        return None
+    # unpass is the total mismatch count, as in the results.json of the harness
+    unpass = sum(s["mismatches"] for s in scenarios)
+    sim_results = {"passed": unpass == 0, "unpass": unpass, "scenarios": scenarios}
+    with open(os.path.join(output_dir, f"lockstep_{sim_type}_results.json"), "w") as f:
+        json.dump(sim_results, f, indent=4)
+    sim_results["library"] = library_path
+    return sim_results
+
+
+def reference_testbench(output_dir, circuit_type, index=0):
+    """
+    Expected outputs of stimulus.json from the reference RTL top.v, saved as testbench_{index}.json
+
+    top.v is driven through its shared library (build_verilated_library) with the cycle
+    sequence of the harness, so the reference is compiled once, cached, and no checker
+    or harness is generated. Returns the testbench, or None if the library build failed.
+    """
+    dut_path = os.path.join(output_dir, "top.v")
+    stimulus_path = os.path.join(output_dir, "stimulus.json")
+    for path in (dut_path, stimulus_path):
+        if not os.path.exists(path):
+            print(f"Error: {path} does not exist")
+            return None
+    library_path = build_verilated_library(dut_path)
+    if library_path is None:
+        return None
+    library = VerilatedLibrary.load(library_path)
+    if circuit_type != "CMB" and "clk" not in library.ports:
+        logger.warning(f"{dut_path} has no clk input, cannot record its outputs")
+        return None
+    outputs = library.outputs()
+    with open(stimulus_path, "r") as f:
+        stimulus = json.load(f)
+
+    testbench = stimulus_to_testbench(stimulus, circuit_type)
+    for scenario in testbench:
+        expected = scenario["output variable"]
+
+        def record(top, step_idx, cycle, input_vars):
+            for name, width in outputs.items():
+                value = format(top.get(name), f"0{width}b")
+                if circuit_type == "CMB":
+                    expected[step_idx][name] = value
+                else:
+                    expected[step_idx].setdefault(name, []).append(value)
+            return True
+        if circuit_type == "CMB":
+            _drive_cmb(library, scenario, record)
+        else:
+            _drive_seq(library, scenario, record)
+
+    with open(os.path.join(output_dir, f"testbench_{index}.json"), "w") as f:
+        json.dump(testbench, f, indent=4)
+    return testbench
+
+
+def merge_candidate_testbenches(testbenches):
+    """
+    One testbench with the expected outputs of every candidate, testbenches are the
+    parsed testbench_{i}.json of one stimulus.json
+    """
+    first = testbenches[0]
+    for testbench in testbenches[1:]:
+        if [s["scenario"] for s in testbench] != [s["scenario"] for s in first]:
+            raise ValueError("Candidate testbenches do not share the same scenarios")
+    merged = []
+    for i, scenario in enumerate(first):
+        merged.append({
+            "scenario": scenario["scenario"],
+            "input variable": scenario["input variable"],
+            # the harness declares the output buffers from the first candidate
+            "output variable": scenario["output variable"],
+            "candidate output variables": [testbench[i]["output variable"] for testbench in testbenches],
+        })
+    return merged
+
+
+def score_candidate_testbenches(output_dir, sim_type, indices, model_mode="scoped", keep_workdir=None):
+    """
+    Mismatches of top.v against the expected outputs of several testbench_{i}.json
+
+    All candidates share the stimulus, so the DUT is built and run once and compared
+    against every candidate in the same pass. Returns a dict with the "candidates"
+    (indices), "scenarios", the "mismatches" matrix (candidate x scenario) and the
+    "passed" candidates, also saved to candidates_{sim_type}.json, or None if the
+    inputs are missing or the simulation did not run.
+    """
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    template_dir = os.path.join(current_dir, f"sim_{sim_type}")
+    dut_path = os.path.join(output_dir, "top.v")
+    indices = list(indices)
+    test_paths = [os.path.join(output_dir, f"testbench_{i}.json") for i in indices]
+    for path in [dut_path] + test_paths:
+        if not os.path.exists(path):
+            print(f"Error: {path} does not exist")
+            return None
+
+    testbenches = []
+    for path in test_paths:
+        with open(path, "r") as f:
+            testbenches.append(json.load(f))
+    try:
+        testbench = json.dumps(merge_candidate_testbenches(testbenches), indent=2, ensure_ascii=False)
+    except ValueError as e:
+        logger.warning(f"Cannot score the candidates of {output_dir}: {e}")
+        return None
+    run = _build_and_run(template_dir, dut_path, testbench, model_mode, dict(os.environ), "fast", keep_workdir)
+    with open(os.path.join(output_dir, f"candidates_{sim_type}.log"), "w") as f:
+        _write_run_log(f, run)
+    if run["sim_results"] is None:
+        logger.warning(f"Candidate simulation of {output_dir} failed, see candidates_{sim_type}.log")
+        return None
+
+    scenarios = run["sim_results"]["scenarios"]
+    mismatches = [[s["candidate_mismatches"][c] for s in scenarios] for c in range(len(indices))]
+    matrix = {
+        "candidates": indices,
+        "scenarios": [s["scenario"] for s in scenarios],
+        "mismatches": mismatches,
+        "passed": [idx for idx, row in zip(indices, mismatches) if not any(row)],
+    }
+    with open(os.path.join(output_dir, f"candidates_{sim_type}.json"), "w") as f:
+        json.dump(matrix, f, indent=4)
+    return matrix
+
+
+def _load_sim_results(results_path):
+    if not os.path.exists(results_path):
+        return None
+    try:
+        with open(results_path, "r") as f:
+            return json.load(f)
+    except json.JSONDecodeError as e:
+        logger.warning(f"Unreadable simulation results {results_path}: {e}")
+        return None
+
+
+def format_sim_feedback(sim_results, max_scenarios=5):
+    """
+    Summarize the failing scenarios of a simulation for an LLM prompt
+    """
+    if not sim_results:
+        return "The simulation did not run."
+    if sim_results["unpass"] is None:
+        return f"The RTL failed to build or the simulation crashed, see {sim_results.get('log')}."
+    if sim_results["passed"]:
+        return "All scenarios passed."
+    failed = [s for s in sim_results["scenarios"] if not s["passed"]]
+    lines = [f"{len(failed)} scenario(s) failed with {sim_results['unpass']} mismatch(es) in total."]
+    for scenario in failed[:max_scenarios]:
+        aborted = " (aborted early)" if scenario.get("aborted") else ""
+        lines.append(f"Scenario {scenario['scenario']}: {scenario['mismatches']} mismatch(es){aborted}")
+        for m in scenario["first_mismatches"]:
+            lines.append(
+                f"  step {m['step']}, cycle {m['cycle']}: {m['signal']} expected {m['expected']}, got {m['actual']}"
+            )
+    if len(failed) > max_scenarios:
+        lines.append(f"... and {len(failed) - max_scenarios} more failing scenario(s)")
+    return "\n".join(lines)
+
+
+def simulate_dut_seq(output_dir, **sim_options):
+    # model_mode "reuse" keeps one model per scenario and pulses reset between input steps
+    return _run_simulation(output_dir, "seq", **sim_options)
+
+
+def simulate_dut_cmb(output_dir, **sim_options):
+    # model_mode "reuse" evaluates every input step on a single model per job
+    return _run_simulation(output_dir, "cmb", **sim_options)
+
+
+def simulate_duts(output_dirs, circuit_type, max_workers=None):
+    """
+    Simulate several task directories concurrently, each in its own workdir,
+    return their results in the order of output_dirs
+    """
+    simulate = simulate_dut_cmb if circuit_type == "CMB" else simulate_dut_seq
+    max_workers = max_workers or os.cpu_count()
+    # Share the cores between the simulations instead of oversubscribing them
+    threads = max(1, (os.cpu_count() or 1) // max_workers)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda d: simulate(d, threads=threads), output_dirs))
 
 def split_test_cases(line):
     """Split a line containing multiple test cases into individual test cases."""
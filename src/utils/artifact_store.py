@@ -0,0 +1,202 @@
+"""
+Content-addressed store of the artifacts of the tasks.
+
+Blobs are kept once per SHA-256 under blobs/, whatever candidate, trial or run
+produced them. Every task has a typed manifest under manifests/: the current
+digest, kind and size of each of its artifacts and the history of the versions
+written by its stages and trials. Blobs, manifests and the working copies of
+the task directory are written to a temporary file and renamed, so a reader
+never sees a partial file.
+
+    store = ArtifactStore("artifact_store")
+    artifacts = TaskArtifacts(store, "output_tb_gen_tb/150", "output_tb_gen_tb/150")
+    artifacts.save("gen_python_code_list.json", codes)
+    artifacts.record("pychecker_1.py")          # a file written by an agent
+    artifacts.copy("pychecker_1.py", "pychecker_0.py")
+    artifacts.pack("output_tb_gen_tb/150.tar")
+
+The agents, checkers and simulators still read their inputs from the task
+directory, the store keeps the working copies there up to date. A packed
+archive holds the manifest and the blobs of one task in a single file, for
+network filesystems where many small files are slow.
+"""
+
+import hashlib
+import io
+import json
+import os
+import tarfile
+import threading
+import time
+import uuid
+from typing import Any, Dict, List
+
+from utils.tracing import current_attributes
+
+KINDS = {".py": "python", ".json": "json", ".v": "verilog", ".sv": "verilog"}
+
+
+def atomic_write(path: str, data: bytes) -> None:
+    """write data to path through a temporary file in the same directory"""
+    tmp_path = os.path.join(os.path.dirname(path) or ".", f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def artifact_kind(name: str) -> str:
+    return KINDS.get(os.path.splitext(name)[1], "text")
+
+
+def encode(data: Any, kind: str) -> bytes:
+    if isinstance(data, bytes):
+        return data
+    if kind == "json" and not isinstance(data, str):
+        return json.dumps(data, indent=4, ensure_ascii=False).encode()
+    return str(data).encode()
+
+
+class ArtifactStore:
+    def __init__(self, root: str):
+        self.root = root
+        self.blob_dir = os.path.join(root, "blobs")
+        self.manifest_dir = os.path.join(root, "manifests")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.manifest_dir, exist_ok=True)
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.blob_dir, digest[:2], digest[2:])
+
+    def put(self, data: bytes) -> str:
+        """store data, return its digest, identical data is stored once"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            atomic_write(path, data)
+        return digest
+
+    def get(self, digest: str) -> bytes:
+        with open(self.blob_path(digest), "rb") as f:
+            return f.read()
+
+    def has(self, digest: str) -> bool:
+        return os.path.exists(self.blob_path(digest))
+
+    def manifest_path(self, key: str) -> str:
+        return os.path.join(self.manifest_dir, f"{key.strip('/').replace('/', '__')}.json")
+
+    def load_manifest(self, key: str) -> Dict:
+        try:
+            with open(self.manifest_path(key), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"task": key, "artifacts": {}, "history": []}
+
+    def write_manifest(self, key: str, manifest: Dict) -> None:
+        atomic_write(self.manifest_path(key), json.dumps(manifest, indent=4).encode())
+
+
+class TaskArtifacts:
+    """the artifacts of one task: its manifest in the store and its working copies in task_dir"""
+
+    def __init__(self, store: ArtifactStore, task_dir: str, key: str):
+        self.store = store
+        self.task_dir = task_dir
+        self.key = key
+        self.lock = threading.Lock()
+        self.manifest = store.load_manifest(key)
+
+    def _set(self, name: str, digest: str, size: int, kind: str) -> None:
+        now = time.time()
+        with self.lock:
+            self.manifest["artifacts"][name] = {"digest": digest, "kind": kind, "size": size, "updated": now}
+            self.manifest["history"].append(dict(current_attributes(), name=name, digest=digest, time=now))
+            self.store.write_manifest(self.key, self.manifest)
+
+    def save(self, name: str, data: Any, kind: str | None = None) -> str:
+        """store data as artifact name and write its working copy, lists and dicts of json artifacts are dumped"""
+        kind = kind or artifact_kind(name)
+        blob = encode(data, kind)
+        digest = self.store.put(blob)
+        atomic_write(os.path.join(self.task_dir, name), blob)
+        self._set(name, digest, len(blob), kind)
+        return digest
+
+    def record(self, name: str, kind: str | None = None) -> str | None:
+        """store the working copy written by an agent or simulator, None if there is none"""
+        try:
+            with open(os.path.join(self.task_dir, name), "rb") as f:
+                blob = f.read()
+        except OSError:
+            return None
+        digest = self.store.put(blob)
+        if self.digest(name) != digest:
+            self._set(name, digest, len(blob), kind or artifact_kind(name))
+        return digest
+
+    def copy(self, source: str, target: str) -> str | None:
+        """artifact target becomes the current version of source, without copying its blob"""
+        digest = self.record(source)
+        if digest is None:
+            return None
+        entry = self.manifest["artifacts"][source]
+        # the working copy is written, not linked: agents rewrite files in place
+        atomic_write(os.path.join(self.task_dir, target), self.store.get(digest))
+        self._set(target, digest, entry["size"], entry["kind"])
+        return digest
+
+    def digest(self, name: str) -> str | None:
+        entry = self.manifest["artifacts"].get(name)
+        return entry["digest"] if entry else None
+
+    def digests(self, names: List[str] | None = None) -> Dict[str, str]:
+        """name -> digest of the current artifacts (of names if given)"""
+        return {
+            name: entry["digest"]
+            for name, entry in self.manifest["artifacts"].items()
+            if names is None or name in names
+        }
+
+    def load(self, name: str) -> Any:
+        """the current version of an artifact, decoded by kind: parsed JSON or text"""
+        entry = self.manifest["artifacts"][name]
+        blob = self.store.get(entry["digest"])
+        return json.loads(blob) if entry["kind"] == "json" else blob.decode()
+
+    def pack(self, archive_path: str) -> None:
+        """write the manifest and the current blobs of the task into one tar file"""
+        with self.lock:
+            manifest = json.loads(json.dumps(self.manifest))
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w") as tar:
+            members = [("manifest.json", json.dumps(manifest, indent=4).encode())]
+            for digest in sorted({entry["digest"] for entry in manifest["artifacts"].values()}):
+                members.append((f"blobs/{digest}", self.store.get(digest)))
+            for name, data in members:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = int(time.time())
+                tar.addfile(info, io.BytesIO(data))
+        atomic_write(archive_path, buffer.getvalue())
+
+
+def unpack(archive_path: str, store: ArtifactStore, task_dir: str, key: str) -> TaskArtifacts:
+    """restore a packed task into store and its working copies into task_dir"""
+    os.makedirs(task_dir, exist_ok=True)
+    with tarfile.open(archive_path, "r") as tar:
+        manifest = json.load(tar.extractfile("manifest.json"))
+        for member in tar.getmembers():
+            if member.name.startswith("blobs/"):
+                store.put(tar.extractfile(member).read())
+    manifest["task"] = key
+    store.write_manifest(key, manifest)
+    artifacts = TaskArtifacts(store, task_dir, key)
+    for name, entry in manifest["artifacts"].items():
+        atomic_write(os.path.join(task_dir, name), store.get(entry["digest"]))
+    return artifacts
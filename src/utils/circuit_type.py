@@ -0,0 +1,138 @@
+"""
+Local CMB / SEQ classification of a task from its module header and spec.
+
+Most tasks settle the question without an LLM: a clock port makes the circuit
+sequential, a header without clock or reset ports and a spec without edge,
+register, latch or state machine language makes it combinational. classify_locally
+weighs this evidence into a confidence, CircuitTypeClassifier only asks the LLM
+when the confidence is below CONFIDENCE_THRESHOLD (e.g. state machine logic
+without a clock port, which may be next-state logic or a latch).
+
+LLM decisions are cached in CIRCUIT_TYPE_CACHE_DIR, one JSON file per hash of the
+spec, header, provider and model, so a sweep with another model asks its own LLM.
+Local decisions are cheaper to redo than to look up and are not cached.
+"""
+
+import hashlib
+import json
+import os
+import re
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List
+
+from utils.verilog_ports import parse_module_header
+
+CIRCUIT_TYPE_CACHE_DIR = os.environ.get(
+    "PROV_CIRCUIT_TYPE_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "pro-v", "circuit_type")
+)
+# local decisions below this confidence are left to the LLM
+CONFIDENCE_THRESHOLD = float(os.environ.get("PROV_CIRCUIT_TYPE_CONFIDENCE", "0.85"))
+# Bump when the rules change, cached decisions of older rules are not reused
+RULES_VERSION = "2"
+
+_CLOCK_PORT_RE = re.compile(r"\b(clk|clock|\w+_clk|clk_\w+)\b", re.IGNORECASE)
+_RESET_PORT_RE = re.compile(r"\b(a?rst\w*|a?reset\w*|\w+_rst|\w+_reset)\b", re.IGNORECASE)
+_SEQ_SPEC_RE = re.compile(
+    r"posedge|negedge|(rising|falling|positive|negative)[ -](clock )?edge|flip[ -]?flops?|\bdffs?\b|"
+    r"\bregisters?\b|latch|always_ff|clock cycle|synchronous|state machine|\bfsm\b|counter|shift register",
+    re.IGNORECASE,
+)
+_CMB_SPEC_RE = re.compile(
+    r"combinational|always_comb|always\s*@\s*\(?\s*\*|truth table|karnaugh|k-map", re.IGNORECASE
+)
+
+
+@dataclass
+class CircuitTypeDecision:
+    classification: str
+    confidence: float
+    evidence: List[str] = field(default_factory=list)
+
+    @property
+    def confident(self) -> bool:
+        return self.confidence >= CONFIDENCE_THRESHOLD
+
+
+def _ports(header: str) -> str:
+    """the port list of a module header, the module name may look like a port"""
+    start = header.find("(")
+    return header[start:] if start >= 0 else header
+
+
+def classify_locally(spec: str, header: str) -> CircuitTypeDecision:
+    """CMB or SEQ with the confidence of the rules and the evidence they found"""
+    model = parse_module_header(header)
+    if model is not None and model.ports:
+        clock = model.clock.name if model.clock else None
+        reset = model.reset.name if model.reset else None
+    else:
+        # not a parsable header, look for the port names
+        ports = _ports(header)
+        clock = _CLOCK_PORT_RE.search(ports)
+        reset = _RESET_PORT_RE.search(ports)
+        clock, reset = clock and clock.group(0), reset and reset.group(0)
+    seq_words = sorted({m.group(0).lower() for m in _SEQ_SPEC_RE.finditer(spec)})
+    cmb_words = sorted({m.group(0).lower() for m in _CMB_SPEC_RE.finditer(spec)})
+    evidence = []
+    if clock:
+        evidence.append(f"clock port {clock}")
+    if reset:
+        evidence.append(f"reset port {reset}")
+    evidence += [f"spec: {word}" for word in seq_words + cmb_words]
+
+    if clock:
+        if cmb_words and not seq_words:
+            # a clock port in a spec that calls itself combinational, e.g. a clock gating circuit
+            return CircuitTypeDecision("SEQ", 0.6, evidence)
+        return CircuitTypeDecision("SEQ", 0.97 if seq_words or reset else 0.9, evidence)
+    if not seq_words and not reset:
+        return CircuitTypeDecision("CMB", 0.97 if cmb_words else 0.9, evidence)
+    # sequential language without a clock port: next-state logic of a state machine
+    # described with its registers, a latch, an asynchronous circuit, ...
+    if cmb_words:
+        return CircuitTypeDecision("CMB", 0.7, evidence)
+    return CircuitTypeDecision("SEQ" if "latch" in seq_words else "CMB", 0.5, evidence)
+
+
+def spec_hash(spec: str, header: str, llm: str) -> str:
+    """cache key of the decision of llm ("<provider>/<model>") on a spec and header"""
+    h = hashlib.sha256()
+    h.update(RULES_VERSION.encode())
+    for text in (spec, header, llm):
+        h.update(text.encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def load_cached_decision(key: str, cache_dir: str = CIRCUIT_TYPE_CACHE_DIR) -> Dict | None:
+    try:
+        with open(os.path.join(cache_dir, f"{key}.json"), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def store_decision(key: str, decision: Dict, cache_dir: str = CIRCUIT_TYPE_CACHE_DIR) -> None:
+    """write an entry atomically, concurrent tasks and runs may share the cache"""
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = os.path.join(cache_dir, f".{key}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(decision, f, indent=4)
+        os.replace(tmp_path, os.path.join(cache_dir, f"{key}.json"))
+    except OSError:
+        # the cache is an optimization, a read-only home only costs the decision again
+        pass
+
+
+def decision_output(decision: CircuitTypeDecision, source: str, classification: str | None = None) -> Dict:
+    """the output of CircuitTypeClassifier.run: the classification with the local decision behind it"""
+    output = asdict(decision)
+    return {
+        "classification": classification or decision.classification,
+        "source": source,
+        "local_classification": output["classification"],
+        "local_confidence": output["confidence"],
+        "evidence": output["evidence"],
+    }
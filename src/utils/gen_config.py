@@ -1,16 +1,13 @@
 import os
+from typing import TYPE_CHECKING
 
 import config
-from google.oauth2 import service_account
-from llama_index.core.llms.llm import LLM
-from llama_index.llms.anthropic import Anthropic
-from llama_index.llms.openai import OpenAI
-from llama_index.llms.openai_like import OpenAILike
-from llama_index.llms.vertex import Vertex
 from pydantic import BaseModel
 
 from .log_utils import get_logger
-from .utils import VertexAnthropicWithCredentials
+
+if TYPE_CHECKING:
+    from llama_index.core.llms.llm import LLM
 
 logger = get_logger(__name__)
 
@@ -44,13 +41,19 @@ class Config:
             return default
 
 
-def get_llm(**kwargs) -> LLM:
+def get_llm(**kwargs) -> "LLM":
+    """
+    The SDK of a provider is imported here, when the provider is selected, so that
+    importing this module (e.g. for Config) does not load every provider SDK.
+    """
     cfg = Config(kwargs["cfg_path"])
     provider: str = kwargs["provider"]
     provider = provider.lower()
     if provider == "anthropic":
+        from llama_index.llms.anthropic import Anthropic
+
         try:
-            llm: LLM = Anthropic(
+            llm: "LLM" = Anthropic(
                 model=kwargs["model"],
                 api_key=cfg["ANTHROPIC_API_KEY"],
                 max_tokens=kwargs["max_token"],
@@ -60,8 +63,10 @@ def get_llm(**kwargs) -> LLM:
         except Exception as e:
             raise Exception(f"gen_config: Failed to get {provider} LLM") from e
     elif kwargs["provider"] == "openai":
+        from llama_index.llms.openai import OpenAI
+
         try:
-            llm: LLM = OpenAI(
+            llm: "LLM" = OpenAI(
                 model=kwargs["model"],
                 api_key=cfg["OPENAI_API_KEY"],
                 max_tokens=kwargs["max_token"],
@@ -70,12 +75,14 @@ def get_llm(**kwargs) -> LLM:
         except Exception as e:
             raise Exception(f"gen_config: Failed to get {provider} LLM") from e
     elif kwargs["provider"] == "sglang":
+        from llama_index.llms.openai_like import OpenAILike
+
         try:
             # SGLang uses OpenAI-compatible API
             api_base = cfg.get("SGLANG_API_BASE", "http://localhost:30000/v1")
             api_key = cfg.get("SGLANG_API_KEY", "EMPTY")  # SGLang often doesn't require a real API key
             
-            llm: LLM = OpenAILike(
+            llm: "LLM" = OpenAILike(
                 model=kwargs["model"],
                 api_base=api_base,
                 api_key=api_key,
@@ -90,6 +97,9 @@ def get_llm(**kwargs) -> LLM:
         except Exception as e:
             raise Exception(f"gen_config: Failed to get {provider} LLM") from e
     elif kwargs["provider"] == "vertex":
+        from google.oauth2 import service_account
+        from llama_index.llms.vertex import Vertex
+
         logger.warning(
             "Support of Vertex Gemini LLMs is still in experimental stage, use with caution"
         )
@@ -102,7 +112,7 @@ def get_llm(**kwargs) -> LLM:
             credentials = service_account.Credentials.from_service_account_file(
                 service_account_path
             )
-            llm: LLM = Vertex(
+            llm: "LLM" = Vertex(
                 model=kwargs["model"],
                 project=credentials.project_id,
                 credentials=credentials,
@@ -112,6 +122,10 @@ def get_llm(**kwargs) -> LLM:
         except Exception as e:
             raise Exception(f"gen_config: Failed to get {provider} LLM") from e
     elif kwargs["provider"] == "vertexanthropic":
+        from google.oauth2 import service_account
+
+        from .vertex_anthropic import VertexAnthropicWithCredentials
+
         service_account_path = os.path.expanduser(cfg["VERTEX_SERVICE_ACCOUNT_PATH"])
         if not os.path.exists(service_account_path):
             raise FileNotFoundError(
@@ -122,7 +136,7 @@ def get_llm(**kwargs) -> LLM:
                 service_account_path,
                 scopes=["https://www.googleapis.com/auth/cloud-platform"],
             )
-            llm: LLM = VertexAnthropicWithCredentials(
+            llm: "LLM" = VertexAnthropicWithCredentials(
                 model=kwargs["model"],
                 project_id=credentials.project_id,
                 credentials=credentials,
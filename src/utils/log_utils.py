@@ -1,11 +1,131 @@
+"""
+Queue based logging.
+
+Loggers only put records on a queue (QueueHandler), a single listener thread
+formats them and writes the files. The log directory is a context variable set
+by set_log_dir, every record carries the directory of the task that emitted it,
+so tasks running in their own context (threads started with
+contextvars.copy_context().run, asyncio tasks) log into their own directory
+without swapping handlers. Threads without a context log into the directory of
+the last set_log_dir.
+
+Large payloads (message lists, prompts, responses, generated code) go through
+log_artifact: the log gets a one line reference, the payload is formatted on the
+listener thread and written to artifacts/ of the log directory.
+"""
+
+import atexit
+import contextvars
+import copy
+import itertools
+import json
 import logging
+import logging.handlers
 import os
-from typing import Dict
+import queue
+import re
+from collections import OrderedDict
+from typing import Any, Dict
 
 from rich.logging import RichHandler
 
 logging.basicConfig(level=logging.INFO)
 
+UNIFIED_LOG = "mage_rtl_total.log"
+ARTIFACT_DIR = "artifacts"
+# file handlers kept open by the listener, the least recently used is closed first
+MAX_OPEN_LOG_FILES = int(os.environ.get("PROV_LOG_MAX_OPEN_FILES", "64"))
+
+_task_log_dir: contextvars.ContextVar[str | None] = contextvars.ContextVar("task_log_dir", default=None)
+_artifact_ids = itertools.count()
+_UNSAFE_RE = re.compile(r"[^\w.-]+")
+
+
+class _TaskQueueHandler(logging.handlers.QueueHandler):
+    """enqueues records tagged with the log directory and mode of the emitting task"""
+
+    def __init__(self, log_queue: queue.Queue, manager: "LoggingManager"):
+        super().__init__(log_queue)
+        self.manager = manager
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = super().prepare(record)
+        record.log_dir = self.manager.task_log_dir()
+        record.to_file = not self.manager.use_stdout
+        return record
+
+
+def _format_payload(payload: Any) -> str:
+    if isinstance(payload, str):
+        return payload
+    if isinstance(payload, (list, tuple)):
+        return "\n\n".join(_format_payload(item) for item in payload)
+    if hasattr(payload, "role") and hasattr(payload, "content"):
+        # llama_index ChatMessage
+        role = getattr(payload.role, "value", payload.role)
+        return f"[{role}]\n{payload.content}"
+    if isinstance(payload, dict):
+        return json.dumps(payload, indent=4, default=str)
+    return str(payload)
+
+
+class _TaskRoutingHandler(logging.Handler):
+    """runs on the listener thread, writes a record to the files of its task or to the console"""
+
+    def __init__(self, manager: "LoggingManager"):
+        super().__init__(logging.DEBUG)
+        self.manager = manager
+        self.file_formatter = logging.Formatter("[%(asctime)s - %(name)s - %(levelname)s] %(message)s")
+        self.files: OrderedDict[str, logging.FileHandler] = OrderedDict()
+        # files of this run are truncated when first opened and appended to when reopened
+        self.opened: set[str] = set()
+
+    def _file(self, path: str) -> logging.FileHandler:
+        handler = self.files.pop(path, None)
+        if handler is None:
+            while len(self.files) >= MAX_OPEN_LOG_FILES:
+                _, evicted = self.files.popitem(last=False)
+                evicted.close()
+            handler = logging.FileHandler(path, mode="a" if path in self.opened else "w")
+            handler.setLevel(logging.DEBUG)
+            handler.setFormatter(self.file_formatter)
+            self.opened.add(path)
+        self.files[path] = handler
+        return handler
+
+    def _write_artifact(self, record: logging.LogRecord, to_file: bool) -> None:
+        name, payload = record.artifact
+        text = _format_payload(payload)
+        if not to_file:
+            record.msg = record.message = f"{name}:\n{text}"
+            return
+        artifact_dir = os.path.join(record.log_dir, ARTIFACT_DIR)
+        os.makedirs(artifact_dir, exist_ok=True)
+        file_name = f"{next(_artifact_ids):05d}_{_UNSAFE_RE.sub('_', name)}.txt"
+        with open(os.path.join(artifact_dir, file_name), "w") as f:
+            f.write(text)
+        record.msg = record.message = f"{name}: {ARTIFACT_DIR}/{file_name} ({len(text)} chars)"
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            # records of loggers in file mode before the first set_log_dir stay on the console
+            to_file = getattr(record, "to_file", False) and bool(getattr(record, "log_dir", None))
+            if getattr(record, "artifact", None) is not None:
+                self._write_artifact(record, to_file)
+            if not to_file:
+                self.manager.rich_handler.handle(record)
+                return
+            for file_name in (f"{record.name}.log", UNIFIED_LOG):
+                self._file(os.path.join(record.log_dir, file_name)).handle(record)
+        except Exception:
+            self.handleError(record)
+
+    def close(self) -> None:
+        for handler in self.files.values():
+            handler.close()
+        self.files.clear()
+        super().close()
+
 
 class LoggingManager:
     def __init__(self):
@@ -17,6 +137,23 @@ class LoggingManager:
             show_path=bool(os.environ.get("LLM4RTL_LOG_PATH", False)),
         )
         self.rich_handler.setLevel(logging.DEBUG)
+        self.queue: queue.Queue = queue.Queue()
+        self.queue_handler = _TaskQueueHandler(self.queue, self)
+        self.router = _TaskRoutingHandler(self)
+        self.listener: logging.handlers.QueueListener | None = None
+
+    def _start_listener(self) -> None:
+        if self.listener is None:
+            self.listener = logging.handlers.QueueListener(self.queue, self.router)
+            self.listener.start()
+            atexit.register(self.stop)
+
+    def stop(self) -> None:
+        """flush the queue and close the log files"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        self.router.close()
 
     def get_logger(self, name: str) -> logging.Logger:
         if name in self.loggers:
@@ -26,75 +163,30 @@ class LoggingManager:
         logger.setLevel(logging.DEBUG)
 
         # Add the handler to the logger
-        logger.addHandler(self.rich_handler)
+        logger.addHandler(self.queue_handler)
         logger.propagate = False
+        self._start_listener()
 
         # Store the logger in our dictionary
         self.loggers[name] = logger
 
         return logger
 
-    def set_log_dir(self, new_dir: str) -> None:
-        if self.current_log_dir == new_dir:
-            return
-        self.current_log_dir = new_dir
+    def task_log_dir(self) -> str:
+        log_dir = _task_log_dir.get()
+        return self.current_log_dir if log_dir is None else log_dir
 
+    def set_log_dir(self, new_dir: str) -> None:
         # Ensure the new directory exists
-        os.makedirs(self.current_log_dir, exist_ok=True)
-
-        if not self.use_stdout:
-            self._update_handlers()
+        os.makedirs(new_dir, exist_ok=True)
+        _task_log_dir.set(new_dir)
+        self.current_log_dir = new_dir
 
     def switch_to_file(self) -> None:
-        if not self.use_stdout:
-            return
         self.use_stdout = False
-        if self.current_log_dir:
-            self._update_handlers()
 
     def switch_to_stdout(self) -> None:
-        if self.use_stdout:
-            return
         self.use_stdout = True
-        self._update_handlers()
-
-    def _update_handlers(self) -> None:
-        assert self.current_log_dir and os.path.isdir(self.current_log_dir)
-
-        formatter = logging.Formatter(
-            "[%(asctime)s - %(name)s - %(levelname)s] %(message)s"
-        )
-
-        if self.use_stdout:
-            for _, logger in self.loggers.items():
-                # Remove existing handlers
-                for handler in logger.handlers[:]:
-                    logger.removeHandler(handler)
-                logger.addHandler(self.rich_handler)
-            return
-
-        unified_log_file = os.path.join(self.current_log_dir, f"mage_rtl_total.log")
-        if os.path.exists(unified_log_file):
-            os.remove(unified_log_file)
-        unified_file_handler = logging.FileHandler(unified_log_file)
-        unified_file_handler.setLevel(logging.DEBUG)
-        unified_file_handler.setFormatter(formatter)
-
-        for name, logger in self.loggers.items():
-            # Remove existing handlers
-            for handler in logger.handlers[:]:
-                logger.removeHandler(handler)
-
-            # Add new handler
-            new_log_file = os.path.join(self.current_log_dir, f"{name}.log")
-            if os.path.exists(new_log_file):
-                os.remove(new_log_file)
-            new_handler = logging.FileHandler(new_log_file)
-            new_handler.setLevel(logging.DEBUG)
-            new_handler.setFormatter(formatter)
-
-            logger.addHandler(new_handler)
-            logger.addHandler(unified_file_handler)
 
 
 # Global LoggingManager instance
@@ -116,3 +208,15 @@ def switch_log_to_file() -> None:
 
 def switch_log_to_stdout() -> None:
     logging_manager.switch_to_stdout()
+
+
+def log_artifact(logger: logging.Logger, name: str, payload: Any, level: int = logging.INFO) -> None:
+    """
+    Log a large payload as an artifact file of the task, the log only references it.
+    Lists and dicts are copied, not formatted, so later changes to them do not leak in.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    if isinstance(payload, (list, dict)):
+        payload = copy.copy(payload)
+    logger.log(level, "%s", name, extra={"artifact": (name, payload)})
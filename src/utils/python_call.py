@@ -8,11 +8,12 @@ LastEdited  :   2024/8/11 17:32:07
 import os
 
 from utils.subproc import subproc_call
-from utils.utils import run_in_dir
+from utils.tracing import set_span_attributes, traced
 
 PYPATH = "ipynb_demo/error_analysis/correct_test_80wrong_discrim_20240809_225259/1365/checker.py"
 
 
+@traced("python_call")
 def python_call(pypath, silent=False, timeout=120):
     """
     #### input:
@@ -36,10 +37,12 @@ def python_call(pypath, silent=False, timeout=120):
     dir = os.path.dirname(pypath)
     filename = os.path.basename(pypath)
     cmd = "python3 %s" % (filename)
-    with run_in_dir(dir):
-        run_info = subproc_call(
-            cmd, timeout
-        )  # {"out": out_reg, "err": err_reg, "haserror": error_exist}
+    # run in the directory of the file without changing the directory of the process,
+    # checkers of concurrent tasks run from different threads
+    run_info = subproc_call(
+        cmd, timeout, cwd=dir or None
+    )  # {"out": out_reg, "err": err_reg, "haserror": error_exist}
+    set_span_attributes(script=pypath, haserror=run_info["haserror"])
     if run_info["haserror"]:
         s_print("python compiling failed")
         return [False, run_info, run_info["err"]]
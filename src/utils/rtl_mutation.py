@@ -0,0 +1,201 @@
+"""
+Mutation analysis of testbenches: RTL mutants of a reference design.
+
+All mutants of a design are woven into a single module. Every mutated
+expression becomes a chain of
+
+    (prov_mutant_sel == K) ? (mutated) : (original)
+
+selects, and prov_mutant_sel is read once at time 0 through the DPI function
+prov_mutant_select() (defined by sim-main.cpp from PROV_SIM_MUTANT). One
+Verilator build therefore runs the original design (0) and every mutant.
+
+Mutated are right-hand sides of single-line assignments and if conditions in
+the body of the top module: operator swaps, negated conditions and stuck-at-0/1
+values. The rewriting is textual, so lines it does not understand are left alone.
+"""
+
+import random
+import re
+from typing import Dict, List, Tuple
+
+MUTANT_SELECT = "prov_mutant_sel"
+
+OPERATOR_SWAPS = {
+    "&": ["|", "^"],
+    "|": ["&", "^"],
+    "^": ["&", "|"],
+    "&&": ["||"],
+    "||": ["&&"],
+    "+": ["-"],
+    "-": ["+"],
+    "==": ["!="],
+    "!=": ["=="],
+    "<": [">=", "<="],
+    "<=": [">", "<"],
+    ">": ["<=", ">="],
+    ">=": ["<", ">"],
+    "<<": [">>"],
+    ">>": ["<<"],
+}
+
+_TOKEN_RE = re.compile(
+    r"""
+    (?P<space>\s+)
+  | (?P<number>\d*'[sS]?[bBoOdDhH][0-9a-fA-FxXzZ_?]+|'[01xXzZ]|\d+(?:\.\d+)?)
+  | (?P<ident>[A-Za-z_$][\w$]*)
+  | (?P<op>===|!==|<<<|>>>|==|!=|<=|>=|&&|\|\||<<|>>|~&|~\||~\^|\^~|.)
+    """,
+    re.X,
+)
+
+# [assign] lhs (=|<=) rhs;  on a single line, lhs may be a concatenation or a select
+_ASSIGN_RE = re.compile(r"^(\s*(?:assign\s+|wire\s+(?:\[[^\]]*\]\s*)?)?[\w.\[\]:{},\s]+?\s*(?:<=|=))(?!=)(.+);\s*$")
+# declarations whose initializer must stay a constant, and loop headers
+_SKIP_RE = re.compile(r"^\s*(parameter|localparam|reg|logic|integer|int|genvar|for|input|output|inout|typedef)\b")
+
+
+def _tokens(expr: str) -> List[Tuple[str, str]]:
+    return [(m.lastgroup, m.group()) for m in _TOKEN_RE.finditer(expr)]
+
+
+def _operator_mutants(expr: str) -> List[Tuple[str, str]]:
+    """(description, mutated expression) for every operator swap outside of bit selects"""
+    tokens = _tokens(expr)
+    mutants = []
+    depth = 0
+    for i, (kind, text) in enumerate(tokens):
+        if kind != "op":
+            continue
+        if text == "[":
+            depth += 1
+        elif text == "]":
+            depth -= 1
+        elif depth == 0 and text in OPERATOR_SWAPS:
+            for swap in OPERATOR_SWAPS[text]:
+                mutated = "".join(t for _, t in tokens[:i]) + swap + "".join(t for _, t in tokens[i + 1:])
+                mutants.append((f"'{text}' -> '{swap}'", mutated))
+        elif depth == 0 and text in ("!", "~"):
+            mutated = "".join(t for _, t in tokens[:i]) + "".join(t for _, t in tokens[i + 1:])
+            mutants.append((f"drop '{text}'", mutated))
+    return mutants
+
+
+def _balanced(text: str, start: int) -> int:
+    """index of the parenthesis closing the one at start, or -1"""
+    depth = 0
+    for i in range(start, len(text)):
+        if text[i] == "(":
+            depth += 1
+        elif text[i] == ")":
+            depth -= 1
+            if depth == 0:
+                return i
+    return -1
+
+
+def _find_sites(code: str) -> List[Tuple[int, int, str, List[Tuple[str, str]]]]:
+    """(start, end, kind, mutants) of the mutable expressions of one line of code"""
+    sites = []
+    for match in re.finditer(r"\bif\s*\(", code):
+        open_paren = match.end() - 1
+        close_paren = _balanced(code, open_paren)
+        if close_paren < 0:
+            continue
+        cond = code[open_paren + 1:close_paren]
+        mutants = _operator_mutants(cond)
+        mutants += [("negate condition", f"!({cond})"), ("condition stuck at 1", "1'b1"), ("condition stuck at 0", "1'b0")]
+        sites.append((open_paren + 1, close_paren, "if", mutants))
+    if sites or _SKIP_RE.match(code):
+        return sites
+    match = _ASSIGN_RE.match(code)
+    if match:
+        rhs = match.group(2)
+        if rhs.strip():
+            mutants = _operator_mutants(rhs)
+            mutants += [("stuck at 0", "'0"), ("stuck at 1", "'1")]
+            sites.append((match.start(2), match.end(2), "assign", mutants))
+    return sites
+
+
+def _module_span(source: str, top: str) -> Tuple[int, int]:
+    """(end of the module header, start of endmodule) of module top"""
+    match = re.search(rf"\bmodule\s+{re.escape(top)}\b", source)
+    if not match:
+        raise ValueError(f"Module {top} not found")
+    depth = 0
+    header_end = -1
+    for i in range(match.end(), len(source)):
+        if source[i] == "(":
+            depth += 1
+        elif source[i] == ")":
+            depth -= 1
+        elif source[i] == ";" and depth == 0:
+            header_end = i + 1
+            break
+    end = re.compile(r"\bendmodule\b").search(source, header_end)
+    if header_end < 0 or not end:
+        raise ValueError(f"Cannot find the body of module {top}")
+    return header_end, end.start()
+
+
+def mutate_verilog(source: str, top: str = "top_module", max_mutants: int = 200,
+                   seed: int = 0) -> Tuple[str, List[Dict]]:
+    """
+    Weave up to max_mutants mutants of module top into source
+
+    Returns the mutated source and the list of mutants with their "id" (the
+    PROV_SIM_MUTANT value selecting them), "line", "kind", "mutation", "original"
+    and "mutated" expression.
+    """
+    header_end, body_end = _module_span(source, top)
+    body_lines = source[header_end:body_end].split("\n")
+    first_line = source[:header_end].count("\n") + 1
+
+    # collect every candidate first, so sampling does not depend on the line order
+    candidates = []
+    in_comment = False
+    for line_idx, line in enumerate(body_lines):
+        # lines in or next to block comments are left alone
+        if in_comment:
+            in_comment = "*/" not in line
+            continue
+        if "/*" in line:
+            in_comment = "*/" not in line.split("/*", 1)[1]
+            continue
+        code = line.split("//")[0]
+        for start, end, kind, mutants in _find_sites(code):
+            for description, mutated in mutants:
+                candidates.append((line_idx, start, end, kind, description, mutated))
+    if len(candidates) > max_mutants:
+        chosen = sorted(random.Random(seed).sample(range(len(candidates)), max_mutants))
+        candidates = [candidates[i] for i in chosen]
+
+    mutants = []
+    sites: Dict[Tuple[int, int, int], List[Tuple[int, str]]] = {}
+    for mutant_id, (line_idx, start, end, kind, description, mutated) in enumerate(candidates, start=1):
+        sites.setdefault((line_idx, start, end), []).append((mutant_id, mutated))
+        mutants.append({
+            "id": mutant_id,
+            "line": first_line + line_idx,
+            "kind": kind,
+            "mutation": description,
+            "original": body_lines[line_idx][start:end].strip(),
+            "mutated": mutated.strip(),
+        })
+
+    # rewrite from the right, so the spans of a line stay valid
+    for (line_idx, start, end), selected in sorted(sites.items(), reverse=True):
+        line = body_lines[line_idx]
+        original = line[start:end]
+        expr = "".join(f"({MUTANT_SELECT} == {mutant_id}) ? ({mutated}) : " for mutant_id, mutated in selected)
+        body_lines[line_idx] = f"{line[:start]}({expr}({original})){line[end:]}"
+
+    select = f"""
+    // mutation analysis: the mutant is selected at runtime, 0 is the original design
+    import "DPI-C" function int prov_mutant_select();
+    integer {MUTANT_SELECT};
+    initial {MUTANT_SELECT} = prov_mutant_select();
+"""
+    mutated_source = source[:header_end] + select + "\n".join(body_lines) + source[body_end:]
+    return mutated_source, mutants
@@ -0,0 +1,205 @@
+"""
+SQLite ledger of runs and their tasks.
+
+Every task of a run is recorded with its outcome, duration, stage durations,
+number of refine trials, token cost, the size of its spec and testbench and the
+SHA-256 of its artifacts. Later runs consult it: generate.py skips the tasks that
+already passed with "skip_passed", and the history of a task feeds scheduling.
+
+    ledger = RunLedger("run_ledger.db")
+    run_id = ledger.start_run("gen_tb", config)
+    ledger.record_task(run_id, TaskRecord(task=150, passed=True, ...))
+    ledger.passed_tasks("gen_tb")
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Dict, List, Set
+
+# artifacts of a task directory whose hashes are recorded
+ARTIFACTS = ["spec.txt", "top.v", "stimulus.json", "pychecker_0.py", "testbench_0.json"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_identifier TEXT NOT NULL,
+    started TEXT NOT NULL,
+    finished TEXT,
+    config TEXT
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    task TEXT NOT NULL,
+    circuit_type TEXT,
+    passed INTEGER NOT NULL,
+    outcome TEXT NOT NULL,
+    dut_outcome TEXT,
+    duration REAL,
+    trials INTEGER,
+    cost REAL,
+    in_tokens INTEGER,
+    out_tokens INTEGER,
+    spec_chars INTEGER,
+    testbench_steps INTEGER,
+    finished TEXT NOT NULL,
+    PRIMARY KEY (run_id, task)
+);
+CREATE TABLE IF NOT EXISTS stages (
+    run_id INTEGER NOT NULL,
+    task TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    duration REAL NOT NULL,
+    PRIMARY KEY (run_id, task, stage)
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    run_id INTEGER NOT NULL,
+    task TEXT NOT NULL,
+    name TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    PRIMARY KEY (run_id, task, name)
+);
+CREATE INDEX IF NOT EXISTS tasks_by_task ON tasks (task, finished);
+"""
+
+
+@dataclass
+class TaskRecord:
+    task: str
+    passed: bool
+    # "passed", "failed", "no_results" (the simulation did not run to completion), "not_simulated"
+    # or "reference" (testbench recorded from the reference RTL, nothing to verify)
+    outcome: str
+    # outcome of the last simulation of the dut loop, "" if it did not run
+    dut_outcome: str = ""
+    circuit_type: str = ""
+    duration: float = 0.0
+    trials: int = 0
+    cost: float = 0.0
+    in_tokens: int = 0
+    out_tokens: int = 0
+    spec_chars: int = 0
+    testbench_steps: int = 0
+    # stage -> seconds
+    stages: Dict[str, float] = field(default_factory=dict)
+    # artifact -> sha256
+    artifacts: Dict[str, str] = field(default_factory=dict)
+
+
+def file_sha256(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def artifact_hashes(output_dir: str, names: List[str] = ARTIFACTS) -> Dict[str, str]:
+    """sha256 of the artifacts present in output_dir"""
+    return {
+        name: file_sha256(os.path.join(output_dir, name))
+        for name in names
+        if os.path.isfile(os.path.join(output_dir, name))
+    }
+
+
+def testbench_steps(testbench_path: str) -> int:
+    """input steps of a testbench JSON, 0 if there is none"""
+    try:
+        with open(testbench_path, "r") as f:
+            return sum(len(scenario["input variable"]) for scenario in json.load(f))
+    except (OSError, ValueError, KeyError, TypeError):
+        return 0
+
+
+class RunLedger:
+    def __init__(self, path: str, wal: bool = True):
+        self.path = path
+        # one connection shared by the threads of the process, sqlite serializes the processes
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            # WAL needs shared memory, a ledger on a network filesystem shared by nodes needs wal=False
+            self.conn.execute(f"PRAGMA journal_mode={'WAL' if wal else 'DELETE'}")
+            self.conn.executescript(SCHEMA)
+            columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(tasks)")}
+            if "dut_outcome" not in columns:
+                # ledgers created before the column
+                self.conn.execute("ALTER TABLE tasks ADD COLUMN dut_outcome TEXT")
+
+    def start_run(self, run_identifier: str, config: Dict | None = None) -> int:
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO runs (run_identifier, started, config) VALUES (?, ?, ?)",
+                (run_identifier, datetime.now().isoformat(), json.dumps(config or {}, default=str)),
+            )
+            return cursor.lastrowid
+
+    def finish_run(self, run_id: int) -> None:
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE runs SET finished = ? WHERE run_id = ?", (datetime.now().isoformat(), run_id))
+
+    def record_task(self, run_id: int, record: TaskRecord) -> None:
+        row = asdict(record)
+        stages = row.pop("stages")
+        artifacts = row.pop("artifacts")
+        row.update(run_id=run_id, task=str(record.task), passed=int(record.passed), finished=datetime.now().isoformat())
+        columns = ", ".join(row)
+        with self.lock, self.conn:
+            self.conn.execute(
+                f"INSERT OR REPLACE INTO tasks ({columns}) VALUES ({', '.join('?' * len(row))})", tuple(row.values())
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO stages (run_id, task, stage, duration) VALUES (?, ?, ?, ?)",
+                [(run_id, str(record.task), stage, duration) for stage, duration in stages.items()],
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO artifacts (run_id, task, name, sha256) VALUES (?, ?, ?, ?)",
+                [(run_id, str(record.task), name, sha) for name, sha in artifacts.items()],
+            )
+
+    def passed_tasks(self, run_identifier: str | None = None) -> Set[str]:
+        """tasks whose latest record (of runs named run_identifier, of any run if None) passed"""
+        query = """
+            SELECT t.task, t.passed FROM tasks t JOIN runs r ON t.run_id = r.run_id
+            WHERE (? IS NULL OR r.run_identifier = ?)
+            ORDER BY t.finished
+        """
+        with self.lock:
+            rows = self.conn.execute(query, (run_identifier, run_identifier)).fetchall()
+        latest = {row["task"]: bool(row["passed"]) for row in rows}
+        return {task for task, passed in latest.items() if passed}
+
+    def history(self, task, limit: int = 10) -> List[Dict]:
+        """the latest records of a task with their stage durations, newest first"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT * FROM tasks WHERE task = ? ORDER BY finished DESC LIMIT ?", (str(task), limit)
+            ).fetchall()
+            records = []
+            for row in rows:
+                record = dict(row)
+                stages = self.conn.execute(
+                    "SELECT stage, duration FROM stages WHERE run_id = ? AND task = ?", (row["run_id"], row["task"])
+                ).fetchall()
+                record["stages"] = {stage["stage"]: stage["duration"] for stage in stages}
+                records.append(record)
+        return records
+
+    def seconds_per_spec_char(self) -> Dict[str, float]:
+        """mean task duration per spec character of every circuit type in the ledger"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT circuit_type, SUM(duration), SUM(spec_chars) FROM tasks"
+                " WHERE duration > 0 AND spec_chars > 0 GROUP BY circuit_type"
+            ).fetchall()
+        return {row[0]: row[1] / row[2] for row in rows}
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,278 @@
+"""
+Simulator backends behind simulate_dut_seq / simulate_dut_cmb.
+
+A backend runs a testbench (JSON text) on a DUT and returns the run dict of
+testbench_parse._build_and_run, with the results in the format of the harness
+results.json. Verilator (testbench_parse.VerilatorBackend) compiles a C++ harness:
+seconds of compile time, fast simulation. Icarus Verilog (IcarusBackend) runs the
+vector file of utils/sim_vectors.py through a generic Verilog testbench: almost no
+compile time, slower simulation. select_backend picks the cheaper one for a task.
+"""
+
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from typing import Dict, List
+
+from utils.sim_vectors import CYCLE_LSB, INDEX_BITS, SCENARIO_LSB, STEP_LSB, VectorLayout, write_vectors
+from utils.sim_workdir import SIM_WORK_ROOT, release_sim_workdir
+from utils.tracing import span
+from utils.verilog_ports import Port, load_port_model
+
+# "auto", "verilator" or "icarus"
+SIM_BACKEND = os.environ.get("PROV_SIM_BACKEND", "auto")
+# Icarus is picked while design lines x simulated records stays below this
+SIM_ICARUS_MAX_WORK = int(os.environ.get("PROV_SIM_ICARUS_MAX_WORK", "2000000"))
+
+
+class SimBackend:
+    name = ""
+
+    def available(self) -> bool:
+        raise NotImplementedError
+
+    def supports(self, dut_path: str, testbench: List[Dict], sim_type: str, model_mode: str = "scoped") -> bool:
+        return True
+
+    def run(self, dut_path: str, testbench: str, sim_type: str, env: Dict[str, str], model_mode: str = "scoped",
+            keep_workdir: str | None = None) -> Dict:
+        raise NotImplementedError
+
+
+def vector_testbench(layout: VectorLayout, reset: Port | None = None) -> str:
+    """
+    Verilog testbench applying vectors.hex to top_module, mismatches are written to results.txt.
+    reset, the reset port of the port model, is pulsed before every SEQ input step.
+    """
+    seq = layout.sim_type == "seq"
+    input_names = [name for name, _, _ in layout.inputs]
+    if not seq or (reset is not None and reset.name not in input_names):
+        reset = None
+    regs = "".join(f"    reg [{width - 1}:0] {name};\n" for name, width, _ in layout.inputs)
+    wires = "".join(f"    wire [{width - 1}:0] {name};\n" for name, width, _ in layout.outputs)
+    ports = [f".{name}({name})" for name, _, _ in layout.inputs + layout.outputs]
+    if seq:
+        regs += "    reg clk;\n"
+        ports.insert(0, ".clk(clk)")
+
+    zero = "".join(f"                {name} = 0;\n" for name in input_names)
+    pulse = ""
+    if reset:
+        name, active_low = reset.name, reset.active_low
+        # Reset between input steps, as the harness does with --model-mode reuse
+        pulse = f"""                {name} = {0 if active_low else 1};
+                clk = 0; #1;
+                clk = 1; #1;
+                clk = 0;
+                {name} = {1 if active_low else 0}; #1;
+"""
+    apply = "".join(
+        f"            if (rec[{lsb}]) {name} = rec[{lsb + 1} +: {width}];\n" for name, width, lsb in layout.inputs
+    )
+    check = ""
+    for name, width, lsb in layout.outputs:
+        # Verilator reads x and z as 0, such an output makes the verdict depend on the backend
+        check += f"""            if (rec[{lsb}] && ^{name} === 1'bx) unknowns = unknowns + 1;\n"""
+        check += f"""            if (rec[{lsb}] && {name} !== rec[{lsb + 1} +: {width}]) begin
+                mismatches = mismatches + 1;
+                if (mismatches <= reported)
+                    $fdisplay(fd, "M %0d %0d %0d {name} %h %h", scenario, rec[{STEP_LSB} +: {INDEX_BITS}],
+                              rec[{CYCLE_LSB} +: {INDEX_BITS}], rec[{lsb + 1} +: {width}], {name});
+            end
+"""
+    if seq:
+        # The cycle sequence of the sim_seq harness: inputs zeroed, then applied with the rising edge
+        body = "".join(
+            f"            if (rec[{lsb}]) {name} = 0;\n" for name, _, lsb in layout.inputs
+        ) + "            #1;\n" + apply + "            clk = 1;\n            #1;\n" + check + "            clk = 0;\n"
+    else:
+        body = apply + "            #1;\n" + check
+
+    return f"""// Generated from vectors.json by utils/sim_backend.py
+`timescale 1ns/1ps
+module tb;
+    parameter N_RECORDS = 1;
+    reg [{layout.width - 1}:0] vectors [0:N_RECORDS - 1];
+    reg [{layout.width - 1}:0] rec;
+{regs}{wires}
+    top_module dut ({", ".join(ports)});
+
+    integer i, fd, scenario, mismatches, reported, unknowns;
+    initial begin
+        $readmemh("vectors.hex", vectors);
+        fd = $fopen("results.txt", "w");
+        if (!$value$plusargs("reported=%d", reported)) reported = 10;
+        scenario = -1;
+        mismatches = 0;
+        unknowns = 0;
+{"        clk = 0;" if seq else ""}
+        for (i = 0; i < N_RECORDS; i = i + 1) begin
+            rec = vectors[i];
+            if (rec[{SCENARIO_LSB} +: {INDEX_BITS}] != scenario) begin
+                if (scenario >= 0) $fdisplay(fd, "S %0d %0d", scenario, mismatches);
+                scenario = rec[{SCENARIO_LSB} +: {INDEX_BITS}];
+                mismatches = 0;
+            end
+            if (rec[0]) begin
+{zero}{pulse}            end
+{body}        end
+        if (scenario >= 0) $fdisplay(fd, "S %0d %0d", scenario, mismatches);
+        $fdisplay(fd, "X %0d", unknowns);
+        $fclose(fd);
+        $finish;
+    end
+endmodule
+"""
+
+
+_MISMATCH_RE = re.compile(r"^M (\d+) (\d+) (\d+) (\S+) (\S+) (\S+)$")
+_SCENARIO_RE = re.compile(r"^S (\d+) (\d+)$")
+_UNKNOWN_RE = re.compile(r"^X (\d+)$")
+
+
+def parse_vector_results(path: str, layout: VectorLayout) -> Dict | None:
+    """
+    results.txt of the vector testbench in the format of the harness results.json, with
+    "unknown_outputs", the checked outputs that were x or z
+    """
+    if not os.path.exists(path):
+        return None
+    scenarios = [
+        {"scenario": name, "passed": True, "mismatches": 0, "aborted": False, "first_mismatches": []}
+        for name in layout.scenarios
+    ]
+    unknowns = 0
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            match = _MISMATCH_RE.match(line)
+            if match:
+                scenario, step, cycle, signal, expected, actual = match.groups()
+                scenarios[int(scenario)]["first_mismatches"].append({
+                    "step": int(step),
+                    "cycle": int(cycle),
+                    "signal": signal,
+                    "expected": "0x" + expected,
+                    "actual": "0x" + actual,
+                })
+                continue
+            match = _SCENARIO_RE.match(line)
+            if match:
+                scenario = scenarios[int(match.group(1))]
+                scenario["mismatches"] = int(match.group(2))
+                scenario["passed"] = scenario["mismatches"] == 0
+                continue
+            match = _UNKNOWN_RE.match(line)
+            if match:
+                unknowns = int(match.group(1))
+    unpass = sum(s["mismatches"] for s in scenarios)
+    return {"passed": unpass == 0, "unpass": unpass, "scenarios": scenarios, "unknown_outputs": unknowns}
+
+
+class IcarusBackend(SimBackend):
+    """
+    Icarus Verilog on the vector file. Its registers start as x instead of 0, so SEQ
+    designs need a reset input in their port model, which is pulsed before every input step.
+
+    One simulation cannot start a fresh model per input step, so a SEQ run follows
+    the harness --model-mode reuse: state that reset does not clear is carried over
+    to the next step. It is only chosen by "auto" for CMB and for SEQ in reuse mode.
+    The 4-state checks and the language subset of iverilog differ from Verilator, see needs_fallback.
+    """
+
+    name = "icarus"
+
+    def available(self) -> bool:
+        return shutil.which("iverilog") is not None and shutil.which("vvp") is not None
+
+    def supports(self, dut_path: str, testbench: List[Dict], sim_type: str, model_mode: str = "scoped") -> bool:
+        if sim_type == "cmb":
+            return True
+        if model_mode != "reuse":
+            return False
+        header = load_port_model(dut_path)
+        if header is None or header.reset is None:
+            return False
+        return any(header.reset.name in step for s in testbench for step in s["input variable"])
+
+    def run(self, dut_path, testbench, sim_type, env, model_mode="scoped", keep_workdir=None):
+        if SIM_WORK_ROOT:
+            os.makedirs(SIM_WORK_ROOT, exist_ok=True)
+        sim_dir = tempfile.mkdtemp(prefix="sim_icarus_", dir=SIM_WORK_ROOT)
+        shutil.copy(dut_path, os.path.join(sim_dir, "top_module.v"))
+        header = load_port_model(dut_path)
+        layout = write_vectors(json.loads(testbench), sim_type, sim_dir, header)
+        with open(os.path.join(sim_dir, "tb.v"), "w") as f:
+            f.write(vector_testbench(layout, header.reset if header else None))
+        reported = env.get("PROV_SIM_REPORTED_MISMATCHES", "10")
+        cmd = (
+            f"cd {sim_dir} && iverilog -g2012 -o sim.vvp -Ptb.N_RECORDS={max(1, layout.records)} tb.v top_module.v"
+            f" && vvp -n sim.vvp +reported={reported}"
+        )
+        with span("sim.build_and_run", profile="icarus", cache_hit=False):
+            result = subprocess.run(cmd, shell=True, capture_output=True, text=True, env=env)
+        sim_results = parse_vector_results(os.path.join(sim_dir, "results.txt"), layout) if layout.records else None
+        kept = release_sim_workdir(sim_dir, result.returncode == 0 and bool(sim_results), keep_workdir)
+        return {
+            "cmd": cmd,
+            "result": result,
+            "cache_hit": False,
+            "cache_key": "-",
+            "sim_dir": sim_dir if kept else None,
+            "sim_results": sim_results,
+        }
+
+
+def design_size(dut_path: str) -> int:
+    """lines of code of the DUT, without comments and blank lines"""
+    with open(dut_path, "r", errors="replace") as f:
+        source = re.sub(r"/\*.*?\*/", "", f.read(), flags=re.S)
+    return sum(1 for line in source.splitlines() if line.split("//")[0].strip())
+
+
+def vector_count(testbench: List[Dict], sim_type: str) -> int:
+    """simulated records: clock cycles of SEQ, input steps of CMB"""
+    if sim_type == "cmb":
+        return sum(len(s["input variable"]) for s in testbench)
+    return sum(step["clock cycles"] for s in testbench for step in s["input variable"])
+
+
+def needs_fallback(run: Dict) -> bool:
+    """
+    Whether an Icarus run must be repeated on Verilator for a verdict that does not depend
+    on the backend: iverilog did not build the design, or an output was x or z
+    """
+    sim_results = run["sim_results"]
+    return sim_results is None or sim_results.get("unknown_outputs", 0) > 0
+
+
+def select_backend(dut_path: str, testbench: str, sim_type: str, backends: Dict[str, SimBackend],
+                   preference: str | None = None, model_mode: str = "scoped") -> SimBackend:
+    """
+    The backend of preference (PROV_SIM_BACKEND by default). "auto" picks Icarus for
+    small designs and short testbenches, where the Verilator compile would dominate,
+    as long as it simulates with the semantics of model_mode. The caller reruns on
+    Verilator a run that needs_fallback.
+    """
+    preference = preference or SIM_BACKEND
+    if preference != "auto":
+        if preference not in backends:
+            raise ValueError(f"Invalid simulation backend: {preference}")
+        return backends[preference]
+    verilator = backends["verilator"]
+    icarus = backends["icarus"]
+    if not icarus.available():
+        return verilator
+    try:
+        scenarios = json.loads(testbench)
+    except json.JSONDecodeError:
+        return verilator
+    if not icarus.supports(dut_path, scenarios, sim_type, model_mode):
+        return verilator
+    if not verilator.available():
+        return icarus
+    work = design_size(dut_path) * vector_count(scenarios, sim_type)
+    return icarus if work <= SIM_ICARUS_MAX_WORK else verilator
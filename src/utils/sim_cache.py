@@ -0,0 +1,251 @@
+"""
+Content-addressed cache of verilated obj_dir builds.
+
+An entry is keyed by the DUT source, the Verilator version, the make variables
+passed to the simulation Makefile and the harness template files of the
+simulation directory. On a hit the cached obj_dir is restored and only the
+generated harness is recompiled and relinked, so Verilator itself is skipped.
+"""
+
+import fnmatch
+import hashlib
+import os
+import shutil
+import subprocess
+import uuid
+from typing import Dict, List
+
+SIM_CACHE_DIR = os.environ.get(
+    "PROV_SIM_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "pro-v", "obj_dir")
+)
+SIM_CACHE_MAX_MB = int(os.environ.get("PROV_SIM_CACHE_MAX_MB", "2048"))
+# ccache is used whenever it is installed, unless this is set to "0"
+SIM_CCACHE = os.environ.get("PROV_SIM_CCACHE", "1")
+
+# Bump when the interface between the generated harness and the template changes
+HARNESS_TEMPLATE_VERSION = "7"
+HARNESS_TEMPLATE_FILES = [
+    "Makefile",
+    "input.vc",
+    "sim-main.cpp",
+    "rfuzz-harness.h",
+    "harness-probe.h",
+    "ffi-main.cpp",
+    "ffi-generator.py",
+]
+
+# Verilator runtime and sim-main.cpp objects, they do not depend on the DUT and are
+# shared by every build with the same Verilator version, flags and runtime sources
+RUNTIME_OBJECTS = ["verilated*.o", "sim-main.o"]
+RUNTIME_SOURCES = ["Makefile", "input.vc", "sim-main.cpp", "rfuzz-harness.h"]
+
+# Harness objects and the linked binary are rebuilt for every testbench anyway,
+# the runtime objects have their own entries
+_UNCACHED = shutil.ignore_patterns("rfuzz-harness*", "Vtop_module", "*.dat", "*.vcd", *RUNTIME_OBJECTS)
+
+_verilator_version = None
+
+
+def verilator_version() -> str:
+    global _verilator_version
+    if _verilator_version is None:
+        try:
+            result = subprocess.run(
+                ["verilator", "--version"], capture_output=True, text=True
+            )
+            _verilator_version = result.stdout.strip()
+        except OSError:
+            _verilator_version = ""
+    return _verilator_version
+
+
+def sim_cache_key(sim_dir: str, dut_path: str, make_vars: Dict[str, str] | None = None) -> str:
+    """
+    hash of everything the verilated model depends on
+    """
+    h = hashlib.sha256()
+    with open(dut_path, "rb") as f:
+        h.update(f.read())
+    h.update(HARNESS_TEMPLATE_VERSION.encode())
+    h.update(verilator_version().encode())
+    for name, value in sorted((make_vars or {}).items()):
+        h.update(f"{name}={value}\n".encode())
+    for name in HARNESS_TEMPLATE_FILES:
+        path = os.path.join(sim_dir, name)
+        if os.path.exists(path):
+            h.update(name.encode())
+            with open(path, "rb") as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+
+def runtime_cache_key(sim_dir: str, make_vars: Dict[str, str] | None = None) -> str:
+    """
+    hash of everything the runtime objects depend on, the DUT excluded
+    """
+    h = hashlib.sha256(b"runtime\n")
+    h.update(HARNESS_TEMPLATE_VERSION.encode())
+    h.update(verilator_version().encode())
+    for name, value in sorted((make_vars or {}).items()):
+        h.update(f"{name}={value}\n".encode())
+    for name in RUNTIME_SOURCES:
+        path = os.path.join(sim_dir, name)
+        if os.path.exists(path):
+            h.update(name.encode())
+            with open(path, "rb") as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+
+def runtime_dir(key: str) -> str | None:
+    """
+    directory of the cached runtime objects of key, if any
+    """
+    entry = os.path.join(SIM_CACHE_DIR, f"runtime-{key}")
+    if not os.path.isdir(entry):
+        return None
+    os.utime(entry)
+    return entry
+
+
+def store_runtime(key: str, sim_dir: str) -> None:
+    """
+    publish the runtime objects of a finished build in sim_dir under key
+    """
+    obj_dir = os.path.join(sim_dir, "obj_dir")
+    entry = os.path.join(SIM_CACHE_DIR, f"runtime-{key}")
+    if os.path.isdir(entry) or not os.path.isdir(obj_dir):
+        return
+    objects = [
+        name for name in os.listdir(obj_dir)
+        if any(fnmatch.fnmatch(name, pattern) for pattern in RUNTIME_OBJECTS)
+    ]
+    if "sim-main.o" not in objects:
+        return
+    os.makedirs(SIM_CACHE_DIR, exist_ok=True)
+    tmp_entry = os.path.join(SIM_CACHE_DIR, f".tmp-{uuid.uuid4().hex}")
+    try:
+        os.makedirs(tmp_entry)
+        for name in objects:
+            shutil.copy2(os.path.join(obj_dir, name), tmp_entry)
+        os.rename(tmp_entry, entry)
+    except OSError:
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+
+
+def restore_obj_dir(key: str, sim_dir: str) -> bool:
+    """
+    copy the cached obj_dir of key into sim_dir, return whether it was a hit
+    """
+    entry = os.path.join(SIM_CACHE_DIR, key)
+    if not os.path.isdir(entry):
+        return False
+    obj_dir = os.path.join(sim_dir, "obj_dir")
+    shutil.rmtree(obj_dir, ignore_errors=True)
+    try:
+        # copytree keeps mtimes, so make only rebuilds the fresh harness
+        shutil.copytree(entry, obj_dir)
+    except (OSError, shutil.Error):
+        shutil.rmtree(obj_dir, ignore_errors=True)
+        return False
+    # mark as recently used for eviction
+    os.utime(entry)
+    return True
+
+
+def store_obj_dir(key: str, sim_dir: str) -> None:
+    """
+    publish the obj_dir of sim_dir under key, then evict old entries
+    """
+    obj_dir = os.path.join(sim_dir, "obj_dir")
+    entry = os.path.join(SIM_CACHE_DIR, key)
+    if not os.path.isdir(obj_dir) or os.path.isdir(entry):
+        return
+    os.makedirs(SIM_CACHE_DIR, exist_ok=True)
+    # build the entry aside and rename it, so concurrent readers never see half an entry
+    tmp_entry = os.path.join(SIM_CACHE_DIR, f".tmp-{uuid.uuid4().hex}")
+    try:
+        shutil.copytree(obj_dir, tmp_entry, ignore=_UNCACHED)
+        os.rename(tmp_entry, entry)
+    except OSError:
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+        return
+    evict_sim_cache()
+
+
+def cached_library(key: str, name: str) -> str | None:
+    """
+    path of the shared library name cached under key, if any
+    """
+    path = os.path.join(SIM_CACHE_DIR, key, name)
+    if not os.path.isfile(path):
+        return None
+    os.utime(os.path.dirname(path))
+    return path
+
+
+def store_library(key: str, library_path: str) -> str:
+    """
+    publish a linked shared library under key, return its cached path
+    """
+    name = os.path.basename(library_path)
+    entry = os.path.join(SIM_CACHE_DIR, key)
+    if not os.path.isdir(entry):
+        os.makedirs(SIM_CACHE_DIR, exist_ok=True)
+        tmp_entry = os.path.join(SIM_CACHE_DIR, f".tmp-{uuid.uuid4().hex}")
+        try:
+            os.makedirs(tmp_entry)
+            shutil.copy2(library_path, os.path.join(tmp_entry, name))
+            os.rename(tmp_entry, entry)
+        except OSError:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+        evict_sim_cache()
+    cached = os.path.join(entry, name)
+    return cached if os.path.isfile(cached) else library_path
+
+
+def _dir_size(path: str) -> int:
+    size = 0
+    for root, _dirs, files in os.walk(path):
+        for file in files:
+            try:
+                size += os.path.getsize(os.path.join(root, file))
+            except OSError:
+                pass
+    return size
+
+
+def evict_sim_cache(max_mb: int | None = None) -> List[str]:
+    """
+    remove least recently used entries until the cache fits in max_mb
+    """
+    max_bytes = (SIM_CACHE_MAX_MB if max_mb is None else max_mb) * 1024 * 1024
+    if not os.path.isdir(SIM_CACHE_DIR):
+        return []
+    entries = []
+    for name in os.listdir(SIM_CACHE_DIR):
+        path = os.path.join(SIM_CACHE_DIR, name)
+        if name.startswith(".") or not os.path.isdir(path):
+            continue
+        entries.append((os.path.getmtime(path), _dir_size(path), path))
+    total = sum(size for _, size, _ in entries)
+    evicted = []
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        evicted.append(path)
+    return evicted
+
+
+def ccache_make_vars() -> Dict[str, str]:
+    """
+    make variables that route the C++ compiles of a build through ccache
+    """
+    if SIM_CCACHE == "0":
+        return {}
+    ccache = shutil.which("ccache")
+    if ccache is None:
+        return {}
+    return {"OBJCACHE": ccache}
@@ -0,0 +1,71 @@
+"""
+Reading Verilator line coverage (coverage.dat) of simulations.
+
+Every model instance of a coverage build writes its own coverage file, the
+points of all files are summed up here without needing verilator_coverage.
+"""
+
+import re
+from typing import Dict, Iterable, List, Tuple
+
+# C '<\x01key\x02value...>' count
+_POINT_RE = re.compile(r"^C '(.*)' (\d+)\s*$")
+
+# (file, line, kind) of a coverage point, kind is e.g. "if", "else", "block", "case"
+CoverPoint = Tuple[str, int, str]
+
+
+def _point_fields(text: str) -> Dict[str, str]:
+    fields = {}
+    for item in text.split("\x01"):
+        if "\x02" in item:
+            key, value = item.split("\x02", 1)
+            fields[key] = value
+    return fields
+
+
+def read_coverage(paths: Iterable[str]) -> Dict[CoverPoint, int]:
+    """
+    hit count of every coverage point, summed over paths and module instances
+    """
+    points: Dict[CoverPoint, int] = {}
+    for path in paths:
+        with open(path, "r", errors="replace") as f:
+            for line in f:
+                match = _POINT_RE.match(line)
+                if not match:
+                    continue
+                fields = _point_fields(match.group(1))
+                if "l" not in fields:
+                    continue
+                page = fields.get("page", "")
+                kind = fields.get("o") or page.split("/")[0]
+                key = (fields.get("f", ""), int(fields["l"]), kind)
+                points[key] = points.get(key, 0) + int(match.group(2))
+    return points
+
+
+def summarize_coverage(points: Dict[CoverPoint, int], source_path: str | None = None) -> Dict:
+    """
+    covered/total counts and the uncovered points, with their source line if source_path is given
+    """
+    source_lines: List[str] = []
+    if source_path:
+        with open(source_path, "r", errors="replace") as f:
+            source_lines = f.read().splitlines()
+    uncovered = []
+    for (file, line, kind), count in sorted(points.items()):
+        if count:
+            continue
+        point = {"file": file, "line": line, "kind": kind}
+        if 0 < line <= len(source_lines):
+            point["source"] = source_lines[line - 1].strip()
+        uncovered.append(point)
+    total = len(points)
+    covered = total - len(uncovered)
+    return {
+        "covered": covered,
+        "total": total,
+        "ratio": covered / total if total else 1.0,
+        "uncovered": uncovered,
+    }
@@ -0,0 +1,126 @@
+"""
+Simulator independent vector file of a testbench, loaded with $readmemh.
+
+Every line of vectors.hex is one record: a clock cycle of a SEQ input step, or a
+CMB input step. The fields of a record, from the least significant bit:
+
+    step_start (1)  scenario (16)  step (16)  cycle (16)
+    per input:  apply (1)  value (width)
+    per output: check (1)  expected (width)
+
+apply/check are cleared for values that are not binary, those inputs keep their
+value and those outputs are not checked, as in the generated harnesses.
+vectors.json describes the layout (VectorLayout) next to it. The port widths come
+from the port model of the DUT (utils.verilog_ports) when it is given, from the
+longest value of each signal otherwise.
+"""
+
+import json
+import os
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Tuple
+
+from utils.verilog_ports import ModuleHeader, is_binary
+
+INDEX_BITS = 16
+SCENARIO_LSB = 1
+STEP_LSB = SCENARIO_LSB + INDEX_BITS
+CYCLE_LSB = STEP_LSB + INDEX_BITS
+HEADER_BITS = CYCLE_LSB + INDEX_BITS
+
+
+@dataclass
+class VectorLayout:
+    sim_type: str
+    # (name, width, lsb of the apply/check bit, the value follows it)
+    inputs: List[Tuple[str, int, int]] = field(default_factory=list)
+    outputs: List[Tuple[str, int, int]] = field(default_factory=list)
+    width: int = HEADER_BITS
+    records: int = 0
+    scenarios: List[str] = field(default_factory=list)
+
+    def add_port(self, ports: List[Tuple[str, int, int]], name: str, width: int) -> None:
+        ports.append((name, width, self.width))
+        self.width += 1 + width
+
+
+def _port_widths(values, declared: Dict[str, int] | None = None) -> Dict[str, int]:
+    """width of every signal, values of signals that are not declared ports are left out"""
+    widths: Dict[str, int] = {}
+    for name, value in values:
+        if declared is not None:
+            if name in declared:
+                widths[name] = declared[name]
+            continue
+        for item in value if isinstance(value, list) else [value]:
+            if isinstance(item, str):
+                widths[name] = max(widths.get(name, 1), len(item))
+    return widths
+
+
+def _steps(scenario, sim_type):
+    """(inputs, expected) per record of a scenario, with step_start and step/cycle indices"""
+    outputs = scenario.get("output variable", [])
+    for step_idx, step in enumerate(scenario["input variable"]):
+        expected = outputs[step_idx] if step_idx < len(outputs) else {}
+        if sim_type == "cmb":
+            # every CMB input step starts from fresh inputs
+            yield True, step_idx, 0, step, expected
+            continue
+        for cycle in range(step["clock cycles"]):
+            inputs = {}
+            for name, values in step.items():
+                if name != "clock cycles":
+                    # Hold the last value for the remaining clock cycles, as in create_testbench_json
+                    inputs[name] = values[min(cycle, len(values) - 1)]
+            checks = {}
+            for name, values in expected.items():
+                if name != "clock cycles" and cycle < len(values):
+                    checks[name] = values[cycle]
+            yield cycle == 0, step_idx, cycle, inputs, checks
+
+
+def build_vectors(testbench: List[Dict], sim_type: str,
+                  header: ModuleHeader | None = None) -> Tuple[VectorLayout, List[str]]:
+    """layout and hex lines of testbench, sim_type is "seq" or "cmb", header is the port model of the DUT"""
+    layout = VectorLayout(sim_type=sim_type, scenarios=[s["scenario"] for s in testbench])
+    input_values, output_values = [], []
+    for scenario in testbench:
+        for step in scenario["input variable"]:
+            input_values += [(k, v) for k, v in step.items() if k != "clock cycles"]
+        for step in scenario.get("output variable", []):
+            output_values += [(k, v) for k, v in step.items() if k != "clock cycles"]
+    declared = header.widths() if header is not None and header.ports else None
+    for name, width in _port_widths(input_values, declared).items():
+        layout.add_port(layout.inputs, name, width)
+    for name, width in _port_widths(output_values, declared).items():
+        layout.add_port(layout.outputs, name, width)
+
+    lines = []
+    mask = (1 << INDEX_BITS) - 1
+    for scenario_idx, scenario in enumerate(testbench):
+        for step_start, step_idx, cycle, inputs, expected in _steps(scenario, sim_type):
+            record = int(step_start)
+            record |= (scenario_idx & mask) << SCENARIO_LSB
+            record |= (step_idx & mask) << STEP_LSB
+            record |= (cycle & mask) << CYCLE_LSB
+            for ports, values in ((layout.inputs, inputs), (layout.outputs, expected)):
+                for name, width, lsb in ports:
+                    value = values.get(name)
+                    if is_binary(value):
+                        record |= 1 << lsb
+                        record |= (int(value, 2) & ((1 << width) - 1)) << (lsb + 1)
+            lines.append(format(record, f"0{(layout.width + 3) // 4}x"))
+    layout.records = len(lines)
+    return layout, lines
+
+
+def write_vectors(testbench: List[Dict], sim_type: str, work_dir: str,
+                  header: ModuleHeader | None = None) -> VectorLayout:
+    """write vectors.hex and vectors.json of testbench into work_dir"""
+    layout, lines = build_vectors(testbench, sim_type, header)
+    with open(os.path.join(work_dir, "vectors.hex"), "w") as f:
+        f.write("\n".join(lines) + "\n")
+    with open(os.path.join(work_dir, "vectors.json"), "w") as f:
+        json.dump(asdict(layout), f, indent=4)
+    return layout
@@ -0,0 +1,65 @@
+"""
+Per-invocation scratch directories for Verilator simulations.
+
+Every simulation gets its own copy of the sim_seq / sim_cmb template, so that
+several DUTs can be verilated, compiled and run at the same time.
+"""
+
+import os
+import shutil
+import tempfile
+
+# "never": always delete, "on_failure": keep the workdir of failed simulations, "always": keep all
+SIM_KEEP_WORKDIR = os.environ.get("PROV_SIM_KEEP_WORKDIR", "never")
+# parent of the scratch directories, the system temp dir by default
+SIM_WORK_ROOT = os.environ.get("PROV_SIM_WORK_ROOT") or None
+# template files shared by sim_seq and sim_cmb, used when the template directory has no copy
+COMMON_TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sim_common")
+# then utils itself: the harness generators import the port model of verilog_ports.py
+UTILS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+TEMPLATE_FILES = [
+    "Makefile",
+    "input.vc",
+    "sim-main.cpp",
+    "rfuzz-harness.h",
+    "harness-probe.h",
+    "harness-generator.py",
+    "harness_common.py",
+    "verilog_ports.py",
+    "ffi-main.cpp",
+    "ffi-generator.py",
+]
+
+
+def create_sim_workdir(template_dir: str) -> str:
+    """
+    create a fresh scratch directory populated from template_dir
+    """
+    if SIM_WORK_ROOT:
+        os.makedirs(SIM_WORK_ROOT, exist_ok=True)
+    prefix = os.path.basename(os.path.normpath(template_dir)) + "_"
+    work_dir = tempfile.mkdtemp(prefix=prefix, dir=SIM_WORK_ROOT)
+    for name in TEMPLATE_FILES:
+        src = os.path.join(template_dir, name)
+        for fallback_dir in (COMMON_TEMPLATE_DIR, UTILS_DIR):
+            if os.path.exists(src):
+                break
+            src = os.path.join(fallback_dir, name)
+        if os.path.exists(src):
+            # copy2 keeps mtimes, so cached objects stay newer than their sources
+            shutil.copy2(src, os.path.join(work_dir, name))
+    return work_dir
+
+
+def release_sim_workdir(work_dir: str, success: bool, policy: str | None = None) -> bool:
+    """
+    delete work_dir unless the retention policy keeps it, return whether it was kept
+    """
+    policy = policy or SIM_KEEP_WORKDIR
+    if policy not in ("never", "on_failure", "always"):
+        raise ValueError(f"Invalid workdir retention policy: {policy}")
+    keep = policy == "always" or (policy == "on_failure" and not success)
+    if not keep:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return keep
@@ -8,12 +8,13 @@ LastEdited  :   2024/4/28 13:26:18
 import subprocess as sp
 
 
-def subproc_call(cmd, timeout=120):
+def subproc_call(cmd, timeout=120, cwd=None):
     """
     run a cmd in shell and return the output and error
     #### input:
     - cmd: str
     - timeout: int, seconds
+    - cwd: str, the working directory of cmd, the current one if None
     #### output:
     - {"out": out_reg, "err": err_reg, "haserror": error_exist}
         - out_reg: str, output of cmd
@@ -31,7 +32,7 @@ def subproc_call(cmd, timeout=120):
         "program is timeout (time > %ds). please check your code. Hints: there might be some infinite loop, please check all the loops in your programm. If it is a verilog code, please check if there is a $finish in the code."
         % (timeout)
     )
-    p = sp.Popen(cmd, shell=True, stdout=sp.PIPE, stderr=sp.PIPE)
+    p = sp.Popen(cmd, shell=True, stdout=sp.PIPE, stderr=sp.PIPE, cwd=cwd)
     out_reg = ""
     err_reg = ""
     error_exist = 0
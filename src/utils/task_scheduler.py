@@ -0,0 +1,63 @@
+"""
+Submission order of the tasks of a run: longest expected first.
+
+With a pool of workers the run ends when its longest task does, so the expensive
+tasks are submitted first and the short ones fill the gaps at the end. A task seen
+before is expected to take the mean duration of its latest runs in the ledger,
+which already includes its refine trials and simulation of its testbench. An
+unseen task is estimated from the length of its spec, with the seconds per spec
+character of its circuit type measured over the ledger (DEFAULT_SECONDS_PER_CHAR
+until there is history).
+"""
+
+import json
+from typing import Dict, List
+
+from utils.circuit_type import classify_locally
+from utils.log_utils import get_logger
+from utils.run_ledger import RunLedger
+
+logger = get_logger(__name__)
+
+DEFAULT_SECONDS_PER_CHAR = {"SEQ": 0.5, "CMB": 0.25}
+# latest runs of a task averaged into its expected duration
+HISTORY_RUNS = 5
+
+
+def load_task_specs(folder_path: str, task_numbers: List[int]) -> Dict[int, Dict]:
+    """benchmark entries (description, header, ...) of task_numbers"""
+    wanted = set(task_numbers)
+    specs = {}
+    with open(folder_path, "r") as f:
+        for line in f:
+            data = json.loads(line)
+            if data["task_number"] in wanted:
+                specs[data["task_number"]] = data
+    return specs
+
+
+def expected_durations(task_numbers: List[int], folder_path: str, ledger: RunLedger,
+                       circuit_type: str | None = None) -> Dict[int, float]:
+    """expected seconds of every task, circuit_type is classified locally if not given"""
+    specs = load_task_specs(folder_path, task_numbers)
+    rates = dict(DEFAULT_SECONDS_PER_CHAR, **ledger.seconds_per_spec_char())
+    expected = {}
+    for task_number in task_numbers:
+        history = [r["duration"] for r in ledger.history(task_number, HISTORY_RUNS) if r["duration"]]
+        if history:
+            expected[task_number] = sum(history) / len(history)
+            continue
+        spec = specs.get(task_number, {})
+        task_type = circuit_type or classify_locally(spec.get("description", ""), spec.get("header", "")).classification
+        rate = rates.get(task_type, DEFAULT_SECONDS_PER_CHAR["SEQ"])
+        expected[task_number] = rate * len(spec.get("description", ""))
+    return expected
+
+
+def order_tasks(task_numbers: List[int], folder_path: str, ledger: RunLedger,
+                circuit_type: str | None = None) -> List[int]:
+    """task_numbers sorted by expected duration, longest first"""
+    expected = expected_durations(task_numbers, folder_path, ledger, circuit_type)
+    ordered = sorted(task_numbers, key=lambda task_number: -expected[task_number])
+    logger.info("Task order: " + ", ".join(f"{t} ({expected[t]:.0f}s)" for t in ordered))
+    return ordered
@@ -1,23 +1,31 @@
 import asyncio
+import sys
+import threading
 import time
 from typing import Dict, List, Tuple
 
-import tiktoken
-from anthropic.types import Usage
 from llama_index.core.base.llms.types import ChatMessage, ChatResponse
 from llama_index.core.llms.llm import LLM
-from llama_index.llms.anthropic import Anthropic
-from llama_index.llms.openai import OpenAI
-from llama_index.llms.vertex import Vertex
 from pydantic import BaseModel
-from vertexai.preview.generative_models import GenerativeModel
 
 from utils.gen_config import get_exp_setting
 from utils.log_utils import get_logger
+from utils.tracing import set_span_attributes, traced
+from utils.usage_registry import usage_registry
 from utils.utils import reformat_json_string
 
 logger = get_logger(__name__)
 
+
+def _is_provider_instance(obj, module: str, class_name: str) -> bool:
+    """
+    isinstance against a provider class without importing its SDK: if the module
+    was never imported (get_llm imports the selected provider only), obj cannot be
+    an instance of one of its classes.
+    """
+    loaded = sys.modules.get(module)
+    return loaded is not None and isinstance(obj, getattr(loaded, class_name))
+
 settings = get_exp_setting()
 setting_args = {
     "temperature": settings.temperature,
@@ -117,23 +125,29 @@ class TokenCounter:
     def __init__(self, llm: LLM) -> None:
         self.llm = llm
         self.token_cnts: Dict[str, List[TokenCount]] = {"": []}
-        self.token_cnts_lock = asyncio.Lock()
+        # shared by threads and asyncio tasks, it is never held across an await
+        self.token_cnts_lock = threading.Lock()
         self.cur_tag = ""
         self.max_parallel_requests: int = 10
-        self.enable_reformat_json = isinstance(llm, Vertex)
+        is_vertex = _is_provider_instance(llm, "llama_index.llms.vertex", "Vertex")
+        self.enable_reformat_json = is_vertex
         model = llm.metadata.model_name
-        if isinstance(model, OpenAI):
+        if _is_provider_instance(model, "llama_index.llms.openai", "OpenAI"):
+            import tiktoken
+
             self.encoding = tiktoken.encoding_for_model(model)
-        elif isinstance(llm, Anthropic):
+        elif _is_provider_instance(llm, "llama_index.llms.anthropic", "Anthropic"):
             self.encoding = llm.tokenizer
-        elif isinstance(llm, Vertex):
+        elif is_vertex:
+            from vertexai.preview.generative_models import GenerativeModel
+
             assert llm.model.startswith(
                 "gemini"
             ), f"Non-gemini Vertex model is not supported: {llm.model}"
             assert isinstance(llm._client, GenerativeModel)
 
             class VertexEncoding:
-                def __init__(self, client: GenerativeModel):
+                def __init__(self, client: "GenerativeModel"):
                     self.client = client
 
                 def encode(self, text: str) -> List[str]:
@@ -146,16 +160,38 @@ class TokenCounter:
             self.encoding = None
             
             logger.info(f"Found tokenizer for model '{model}'")
-            self.token_cost = token_costs[model] if model in token_costs else TokenCost()
-            if self.token_cost == TokenCost():
-                logger.warning(
-                    f"Cannot find token cost for model '{model}' in record. Won't display cost in USD"
-                )
+        self.token_cost = token_costs[model] if model in token_costs else TokenCost()
+        if self.token_cost == TokenCost():
+            logger.warning(
+                f"Cannot find token cost for model '{model}' in record. Won't display cost in USD"
+            )
 
     def set_cur_tag(self, tag: str) -> None:
-        self.cur_tag = tag
-        if tag not in self.token_cnts:
-            self.token_cnts[tag] = []
+        with self.token_cnts_lock:
+            self.cur_tag = tag
+            self.token_cnts.setdefault(tag, [])
+
+    def cost(self, token_cnt: TokenCount) -> float:
+        """cost of a call in USD"""
+        return (
+            token_cnt.in_token_cnt * self.token_cost.in_token_cost_per_token
+            + token_cnt.out_token_cnt * self.token_cost.out_token_cost_per_token
+        )
+
+    def record(self, tag: str, token_cnt: TokenCount, latency: float, llm: LLM) -> None:
+        """count a call under tag, here and in the run-wide usage_registry"""
+        with self.token_cnts_lock:
+            self.token_cnts.setdefault(tag, []).append(token_cnt)
+        usage_registry.record(
+            agent=tag,
+            model=llm.metadata.model_name,
+            in_tokens=token_cnt.in_token_cnt,
+            out_tokens=token_cnt.out_token_cnt,
+            cache_write_tokens=getattr(token_cnt, "cache_write_cnt", 0),
+            cache_read_tokens=getattr(token_cnt, "cache_read_cnt", 0),
+            cost=self.cost(token_cnt),
+            latency=latency,
+        )
 
     def count(self, string: str) -> int:
         if self.encoding is None:
@@ -163,8 +199,15 @@ class TokenCounter:
         return len(self.encoding.encode(string))
 
     def reset(self) -> None:
-        self.token_cnts = {"": []}
+        with self.token_cnts_lock:
+            self.token_cnts = {"": []}
 
+    def get_token_cnts(self) -> Dict[str, List[TokenCount]]:
+        """a copy of the token counts per tag, safe to iterate while calls are counted"""
+        with self.token_cnts_lock:
+            return {tag: list(cnts) for tag, cnts in self.token_cnts.items()}
+
+    @traced("llm.chat")
     def count_chat(
         self, messages: List[ChatMessage], llm: LLM | None = None
     ) -> Tuple[ChatResponse, TokenCount]:
@@ -174,16 +217,26 @@ class TokenCounter:
             "TokenCounter count_chat Triggered at temp: %s, top_p: %s"
             % (settings.temperature, settings.top_p)
         )
+        tag = self.cur_tag
+        start_time = time.perf_counter()
         response = llm.chat(
             messages, top_p=settings.top_p, temperature=settings.temperature
         )
+        latency = time.perf_counter() - start_time
         out_token_cnt = self.count(response.message.content)
         token_cnt = TokenCount(in_token_cnt=in_token_cnt, out_token_cnt=out_token_cnt)
-        self.token_cnts[self.cur_tag].append(token_cnt)
+        set_span_attributes(
+            model=llm.metadata.model_name,
+            tag=tag,
+            in_tokens=in_token_cnt,
+            out_tokens=out_token_cnt,
+        )
+        self.record(tag, token_cnt, latency, llm)
         if self.enable_reformat_json:
             response.message.content = reformat_json_string(response.message.content)
         return (response, token_cnt)
 
+    @traced("llm.chat")
     async def count_achat(
         self, messages: List[ChatMessage], llm: LLM | None = None
     ) -> Tuple[ChatResponse, TokenCount]:
@@ -193,13 +246,21 @@ class TokenCounter:
             "TokenCounter count_achat Triggered at temp: %s, top_p: %s"
             % (settings.temperature, settings.top_p)
         )
+        tag = self.cur_tag
+        start_time = time.perf_counter()
         response = await llm.achat(
             messages, top_p=settings.top_p, temperature=settings.temperature
         )
+        latency = time.perf_counter() - start_time
         out_token_cnt = self.count(response.message.content)
         token_cnt = TokenCount(in_token_cnt=in_token_cnt, out_token_cnt=out_token_cnt)
-        async with self.token_cnts_lock:
-            self.token_cnts[self.cur_tag].append(token_cnt)
+        set_span_attributes(
+            model=llm.metadata.model_name,
+            tag=tag,
+            in_tokens=in_token_cnt,
+            out_tokens=out_token_cnt,
+        )
+        self.record(tag, token_cnt, latency, llm)
         if self.enable_reformat_json:
             response.message.content = reformat_json_string(response.message.content)
         return (response, token_cnt)
@@ -238,8 +299,7 @@ class TokenCounter:
 
     def log_token_stats(self) -> None:
         total_sum_cnt = TokenCount(in_token_cnt=0, out_token_cnt=0)
-        for tag in self.token_cnts:
-            token_cnt = self.token_cnts[tag]
+        for tag, token_cnt in self.get_token_cnts().items():
             if not token_cnt:
                 continue
             sum_cnt = sum(token_cnt, start=TokenCount(in_token_cnt=0, out_token_cnt=0))
@@ -258,11 +318,11 @@ class TokenCounter:
         # If have tag: return sum of token counts with that tag
         # If no tag: return sum of all token counts
         if tag:
-            token_cnt = self.token_cnts[tag]
+            token_cnt = self.get_token_cnts().get(tag, [])
             sum_cnt = sum(token_cnt, start=TokenCount(in_token_cnt=0, out_token_cnt=0))
         else:
             sum_cnt = TokenCount(in_token_cnt=0, out_token_cnt=0)
-            for token_cnt in self.token_cnts.values():
+            for token_cnt in self.get_token_cnts().values():
                 sum_cnt += sum(
                     token_cnt, start=TokenCount(in_token_cnt=0, out_token_cnt=0)
                 )
@@ -272,7 +332,7 @@ class TokenCounter:
     def get_total_token(self) -> int:
         """Return token number regarding to token limit"""
         sum_cnt = TokenCount(in_token_cnt=0, out_token_cnt=0)
-        for token_cnt in self.token_cnts.values():
+        for token_cnt in self.get_token_cnts().values():
             tag_cnt = sum(token_cnt, start=TokenCount(in_token_cnt=0, out_token_cnt=0))
             assert isinstance(tag_cnt, TokenCount)
             sum_cnt += tag_cnt
@@ -285,7 +345,7 @@ class TokenCounterCached(TokenCounter):
 
     def __init__(self, llm: LLM) -> None:
         super().__init__(llm)
-        assert isinstance(llm, Anthropic)
+        assert self.is_cache_enabled(llm)
         self.write_cost_ratio: float = 1.25
         self.read_cost_ratio: float = 0.1
         self.enable_cache = True
@@ -304,13 +364,19 @@ class TokenCounterCached(TokenCounter):
             out_token_cnt=token_count_cached.out_token_cnt,
         )
 
+    def cost(self, token_cnt: TokenCount) -> float:
+        if isinstance(token_cnt, TokenCountCached):
+            token_cnt = self.equivalent_cost(token_cnt)
+        return super().cost(token_cnt)
+
     @classmethod
     def is_cache_enabled(cls, llm: LLM) -> bool:
-        return isinstance(llm, Anthropic)
+        return _is_provider_instance(llm, "llama_index.llms.anthropic", "Anthropic")
 
     def add_cache_tag(self, target: ChatMessage) -> None:
         target.additional_kwargs["cache_control"] = {"type": "ephemeral"}
 
+    @traced("llm.chat")
     def count_chat(
         self, messages: List[ChatMessage], llm: LLM | None = None
     ) -> Tuple[ChatResponse, TokenCountCached]:
@@ -319,13 +385,16 @@ class TokenCounterCached(TokenCounter):
             "TokenCounterCached count_chat Triggered at temp: %s, top_p: %s"
             % (settings.temperature, settings.top_p)
         )
+        tag = self.cur_tag
+        start_time = time.perf_counter()
         response = llm.chat(
             messages,
             top_p=settings.top_p,
             temperature=settings.temperature,
         )
+        latency = time.perf_counter() - start_time
         usage = response.raw["usage"]
-        assert isinstance(usage, Usage), f"Unknown usage type: {type(usage)}"
+        assert _is_provider_instance(usage, "anthropic.types", "Usage"), f"Unknown usage type: {type(usage)}"
         token_cnt = TokenCountCached(
             in_token_cnt=usage.input_tokens,
             out_token_cnt=usage.output_tokens,
@@ -340,11 +409,20 @@ class TokenCounterCached(TokenCounter):
                 else 0
             ),
         )
-        self.token_cnts[self.cur_tag].append(token_cnt)
+        set_span_attributes(
+            model=llm.metadata.model_name,
+            tag=tag,
+            in_tokens=token_cnt.in_token_cnt,
+            out_tokens=token_cnt.out_token_cnt,
+            cache_write_tokens=token_cnt.cache_write_cnt,
+            cache_read_tokens=token_cnt.cache_read_cnt,
+        )
+        self.record(tag, token_cnt, latency, llm)
         if self.enable_reformat_json:
             response.message.content = reformat_json_string(response.message.content)
         return (response, token_cnt)
 
+    @traced("llm.chat")
     async def count_achat(
         self, messages: List[ChatMessage], llm: LLM | None = None
     ) -> Tuple[ChatResponse, TokenCountCached]:
@@ -353,13 +431,16 @@ class TokenCounterCached(TokenCounter):
             "TokenCounterCached count_achat Triggered at temp: %s, top_p: %s"
             % (settings.temperature, settings.top_p)
         )
+        tag = self.cur_tag
+        start_time = time.perf_counter()
         response = await llm.achat(
             messages,
             top_p=settings.top_p,
             temperature=settings.temperature,
         )
+        latency = time.perf_counter() - start_time
         usage = response.raw["usage"]
-        assert isinstance(usage, Usage), f"Unknown usage type: {type(usage)}"
+        assert _is_provider_instance(usage, "anthropic.types", "Usage"), f"Unknown usage type: {type(usage)}"
         token_cnt = TokenCountCached(
             in_token_cnt=usage.input_tokens,
             out_token_cnt=usage.output_tokens,
@@ -374,16 +455,22 @@ class TokenCounterCached(TokenCounter):
                 else 0
             ),
         )
-        async with self.token_cnts_lock:
-            self.token_cnts[self.cur_tag].append(token_cnt)
+        set_span_attributes(
+            model=llm.metadata.model_name,
+            tag=tag,
+            in_tokens=token_cnt.in_token_cnt,
+            out_tokens=token_cnt.out_token_cnt,
+            cache_write_tokens=token_cnt.cache_write_cnt,
+            cache_read_tokens=token_cnt.cache_read_cnt,
+        )
+        self.record(tag, token_cnt, latency, llm)
         if self.enable_reformat_json:
             response.message.content = reformat_json_string(response.message.content)
         return (response, token_cnt)
 
     def log_token_stats(self) -> None:
         total_sum_cnt = TokenCountCached(in_token_cnt=0, out_token_cnt=0)
-        for tag in self.token_cnts:
-            token_cnt = self.token_cnts[tag]
+        for tag, token_cnt in self.get_token_cnts().items():
             if not token_cnt:
                 continue
             sum_cnt = sum(
@@ -418,13 +505,13 @@ class TokenCounterCached(TokenCounter):
         # If have tag: return sum of token counts with that tag
         # If no tag: return sum of all token counts
         if tag:
-            token_cnt = self.token_cnts[tag]
+            token_cnt = self.get_token_cnts().get(tag, [])
             sum_cnt = sum(
                 token_cnt, start=TokenCountCached(in_token_cnt=0, out_token_cnt=0)
             )
         else:
             sum_cnt = TokenCountCached(in_token_cnt=0, out_token_cnt=0)
-            for token_cnt in self.token_cnts.values():
+            for token_cnt in self.get_token_cnts().values():
                 sum_cnt += sum(
                     token_cnt, start=TokenCountCached(in_token_cnt=0, out_token_cnt=0)
                 )
@@ -0,0 +1,205 @@
+"""
+Lightweight span tracing of stages, LLM calls and subprocesses.
+
+    with span("stimuli", task=task_number):
+        ...
+        set_span_attributes(tokens=1234)
+
+    @traced("python_call")
+    def python_call(...): ...
+
+Spans nest through a context variable. The attributes in INHERITED_ATTRIBUTES
+(task, trial, candidate, stage) are passed from a span to its children, so an LLM
+call deep inside an agent is still attributed to its task and trial. Spans named
+"stage.<name>" set the stage attribute.
+write_chrome_trace exports the finished spans for chrome://tracing / Perfetto,
+latency_summary aggregates them per span name. Tracing is off with PROV_TRACE=0.
+"""
+
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+from utils.log_utils import get_logger
+
+logger = get_logger(__name__)
+
+TRACE_ENABLED = os.environ.get("PROV_TRACE", "1") != "0"
+INHERITED_ATTRIBUTES = ("task", "trial", "candidate", "stage")
+
+_current_span: contextvars.ContextVar["Span | None"] = contextvars.ContextVar("current_span", default=None)
+_origin = time.perf_counter()
+
+
+class Span:
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.name = name
+        self.parent = _current_span.get()
+        self.attributes = {}
+        if self.parent is not None:
+            self.attributes.update(
+                {k: v for k, v in self.parent.attributes.items() if k in INHERITED_ATTRIBUTES}
+            )
+        if name.startswith("stage."):
+            self.attributes["stage"] = name[len("stage."):]
+        self.attributes.update(attributes)
+        self.thread_id = threading.get_ident()
+        self.start = time.perf_counter()
+        self.end: float | None = None
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+
+class Tracer:
+    """collects the finished spans of the process"""
+
+    def __init__(self):
+        self.spans: List[Span] = []
+        self.lock = threading.Lock()
+
+    def finish(self, span: Span) -> None:
+        span.end = time.perf_counter()
+        with self.lock:
+            self.spans.append(span)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.spans = []
+
+    def finished_spans(self) -> List[Span]:
+        with self.lock:
+            return list(self.spans)
+
+
+tracer = Tracer()
+
+
+class span:
+    """context manager tracing the enclosed block as a span"""
+
+    def __init__(self, name: str, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.span: Span | None = None
+
+    def __enter__(self) -> Span:
+        # spans carry the context of usage accounting, they are only exported when tracing is on
+        self.span = Span(self.name, self.attributes)
+        self.token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None:
+            self.span.attributes["error"] = exc_type.__name__
+        _current_span.reset(self.token)
+        if TRACE_ENABLED:
+            tracer.finish(self.span)
+
+
+def traced(name: str | None = None, **attributes) -> Callable:
+    """decorator tracing every call of a function as a span"""
+
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name, **attributes):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name, **attributes):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def set_span_attributes(**attributes) -> None:
+    """add attributes to the innermost span of the current context"""
+    current = _current_span.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+
+def current_attributes() -> Dict[str, Any]:
+    """the inherited attributes (task, trial, ...) of the innermost span of the current context"""
+    current = _current_span.get()
+    if current is None:
+        return {}
+    return {k: v for k, v in current.attributes.items() if k in INHERITED_ATTRIBUTES}
+
+
+def stage_durations(task) -> Dict[str, float]:
+    """seconds per stage of a task, summed over its finished stage.* spans"""
+    durations: Dict[str, float] = {}
+    for s in tracer.finished_spans():
+        if s.name.startswith("stage.") and s.attributes.get("task") == task:
+            stage = s.attributes["stage"]
+            durations[stage] = durations.get(stage, 0.0) + s.duration
+    return durations
+
+
+def write_chrome_trace(path: str) -> None:
+    """write the finished spans in the Chrome trace event format"""
+    pid = os.getpid()
+    events = []
+    for s in tracer.finished_spans():
+        events.append({
+            "name": s.name,
+            "cat": s.name.split(".")[0],
+            "ph": "X",
+            "ts": round((s.start - _origin) * 1e6),
+            "dur": round(s.duration * 1e6),
+            "pid": pid,
+            "tid": s.thread_id,
+            "args": {k: v if isinstance(v, (int, float, bool, str)) or v is None else str(v)
+                     for k, v in s.attributes.items()},
+        })
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def latency_summary() -> Dict[str, Dict[str, float]]:
+    """count, total, mean, p50, p95 and max latency in seconds per span name"""
+    durations: Dict[str, List[float]] = {}
+    for s in tracer.finished_spans():
+        durations.setdefault(s.name, []).append(s.duration)
+    summary = {}
+    for name, values in durations.items():
+        values.sort()
+        summary[name] = {
+            "count": len(values),
+            "total": sum(values),
+            "mean": sum(values) / len(values),
+            "p50": values[len(values) // 2],
+            "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+            "max": values[-1],
+        }
+    return dict(sorted(summary.items(), key=lambda item: -item[1]["total"]))
+
+
+def write_trace_summary(path: str) -> Dict[str, Dict[str, float]]:
+    """write latency_summary as JSON and log it as a table"""
+    summary = latency_summary()
+    with open(path, "w") as f:
+        json.dump(summary, f, indent=4)
+    logger.info(f"{'span':<30} {'count':>6} {'total s':>10} {'mean s':>9} {'p95 s':>9} {'max s':>9}")
+    for name, stats in summary.items():
+        logger.info(
+            f"{name:<30} {stats['count']:>6} {stats['total']:>10.2f} {stats['mean']:>9.2f}"
+            f" {stats['p95']:>9.2f} {stats['max']:>9.2f}"
+        )
+    return summary
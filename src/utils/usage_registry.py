@@ -0,0 +1,124 @@
+"""
+Process-wide accounting of LLM calls.
+
+Every call counted by a TokenCounter is recorded in usage_registry, whatever agent
+or counter instance made it. A record is tagged with the task, trial and stage of
+the enclosing utils.tracing spans and with the tag (agent) of its counter, so the
+totals survive the per-trial counters of generate.py. The registry is guarded by a
+lock, calls from threads and asyncio tasks can be recorded concurrently.
+"""
+
+import json
+import threading
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Tuple
+
+from utils.log_utils import get_logger
+from utils.tracing import current_attributes
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class UsageRecord:
+    task: str
+    trial: str
+    stage: str
+    agent: str
+    model: str
+    in_tokens: int
+    out_tokens: int
+    cache_write_tokens: int
+    cache_read_tokens: int
+    # USD, 0 for models without a known token cost
+    cost: float
+    # seconds
+    latency: float
+
+
+@dataclass
+class UsageTotal:
+    calls: int = 0
+    in_tokens: int = 0
+    out_tokens: int = 0
+    cache_write_tokens: int = 0
+    cache_read_tokens: int = 0
+    cost: float = 0.0
+    latency: float = 0.0
+
+    def add(self, record: UsageRecord) -> None:
+        self.calls += 1
+        self.in_tokens += record.in_tokens
+        self.out_tokens += record.out_tokens
+        self.cache_write_tokens += record.cache_write_tokens
+        self.cache_read_tokens += record.cache_read_tokens
+        self.cost += record.cost
+        self.latency += record.latency
+
+
+class UsageRegistry:
+    def __init__(self):
+        self.records: List[UsageRecord] = []
+        self.lock = threading.Lock()
+
+    def record(self, agent: str, model: str, in_tokens: int, out_tokens: int, cost: float, latency: float,
+               cache_write_tokens: int = 0, cache_read_tokens: int = 0) -> UsageRecord:
+        """record a call with the task, trial and stage of the current context"""
+        context = current_attributes()
+        record = UsageRecord(
+            task=str(context.get("task", "")),
+            trial=str(context.get("trial", "")),
+            stage=str(context.get("stage", "")),
+            agent=agent,
+            model=model,
+            in_tokens=in_tokens,
+            out_tokens=out_tokens,
+            cache_write_tokens=cache_write_tokens,
+            cache_read_tokens=cache_read_tokens,
+            cost=cost,
+            latency=latency,
+        )
+        with self.lock:
+            self.records.append(record)
+        return record
+
+    def reset(self) -> None:
+        with self.lock:
+            self.records = []
+
+    def totals(self, *keys: str) -> Dict[Tuple[str, ...], UsageTotal]:
+        """totals grouped by the given record fields, e.g. totals("task", "stage")"""
+        with self.lock:
+            records = list(self.records)
+        totals: Dict[Tuple[str, ...], UsageTotal] = {}
+        for record in records:
+            group = tuple(getattr(record, key) for key in keys)
+            totals.setdefault(group, UsageTotal()).add(record)
+        return totals
+
+    def log_tables(self) -> None:
+        """log the cost and latency per task, per stage, per agent and of the whole run"""
+        header = f"{'calls':>6} {'in tokens':>11} {'out tokens':>11} {'cost $':>9} {'latency s':>10}"
+        for keys in (("task",), ("stage",), ("agent",), ()):
+            title = "/".join(keys) or "run"
+            logger.info(f"{title:<30} {header}")
+            for group, total in sorted(self.totals(*keys).items()):
+                name = "/".join(value or "-" for value in group) if keys else "total"
+                logger.info(
+                    f"{name:<30} {total.calls:>6} {total.in_tokens:>11} {total.out_tokens:>11}"
+                    f" {total.cost:>9.2f} {total.latency:>10.1f}"
+                )
+
+    def write(self, path: str) -> None:
+        """write the records and the per-task totals as JSON"""
+        with self.lock:
+            records = [asdict(record) for record in self.records]
+        with open(path, "w") as f:
+            json.dump({
+                "run": asdict(self.totals().get((), UsageTotal())),
+                "tasks": {group[0]: asdict(total) for group, total in self.totals("task").items()},
+                "records": records,
+            }, f, indent=4)
+
+
+usage_registry = UsageRegistry()
@@ -0,0 +1,113 @@
+"""
+ctypes binding of a verilated top_module built as a shared library (src/sim_ffi).
+
+    library = VerilatedLibrary(path)
+    with library.model() as top:
+        top.set("a", 3)
+        top.eval()
+        top.get("y")
+"""
+
+import ctypes
+from typing import Dict, Tuple
+
+# a library can only be loaded once per process, keep one binding per path
+_libraries: Dict[str, "VerilatedLibrary"] = {}
+
+
+class VerilatedLibrary:
+    def __init__(self, path: str):
+        self.path = path
+        self.lib = ctypes.CDLL(path)
+        lib = self.lib
+        lib.prov_model_new.restype = ctypes.c_void_p
+        lib.prov_model_new.argtypes = []
+        lib.prov_model_free.restype = None
+        lib.prov_model_free.argtypes = [ctypes.c_void_p]
+        lib.prov_port_count.restype = ctypes.c_int
+        lib.prov_port_name.restype = ctypes.c_char_p
+        lib.prov_port_name.argtypes = [ctypes.c_int]
+        lib.prov_port_width.restype = ctypes.c_int
+        lib.prov_port_width.argtypes = [ctypes.c_int]
+        lib.prov_port_is_output.restype = ctypes.c_int
+        lib.prov_port_is_output.argtypes = [ctypes.c_int]
+        words = ctypes.POINTER(ctypes.c_uint32)
+        lib.prov_port_write.restype = None
+        lib.prov_port_write.argtypes = [ctypes.c_void_p, ctypes.c_int, words]
+        lib.prov_port_read.restype = None
+        lib.prov_port_read.argtypes = [ctypes.c_void_p, ctypes.c_int, words]
+        lib.prov_eval.restype = None
+        lib.prov_eval.argtypes = [ctypes.c_void_p]
+        lib.prov_time_inc.restype = None
+        lib.prov_time_inc.argtypes = [ctypes.c_void_p, ctypes.c_uint64]
+
+        # name -> (index, width, is_output)
+        self.ports: Dict[str, Tuple[int, int, bool]] = {}
+        for i in range(lib.prov_port_count()):
+            name = lib.prov_port_name(i).decode()
+            self.ports[name] = (i, lib.prov_port_width(i), bool(lib.prov_port_is_output(i)))
+
+    @classmethod
+    def load(cls, path: str) -> "VerilatedLibrary":
+        if path not in _libraries:
+            _libraries[path] = cls(path)
+        return _libraries[path]
+
+    def inputs(self) -> Dict[str, int]:
+        return {name: width for name, (_, width, is_output) in self.ports.items() if not is_output}
+
+    def outputs(self) -> Dict[str, int]:
+        return {name: width for name, (_, width, is_output) in self.ports.items() if is_output}
+
+    def model(self) -> "VerilatedModel":
+        return VerilatedModel(self)
+
+
+class VerilatedModel:
+    """One instance of the model with its own VerilatedContext"""
+
+    def __init__(self, library: VerilatedLibrary):
+        self.library = library
+        self.lib = library.lib
+        self.handle = self.lib.prov_model_new()
+        # one word buffer per port, reused for every access
+        self.buffers = {
+            name: (ctypes.c_uint32 * ((width + 31) // 32))() for name, (_, width, _) in library.ports.items()
+        }
+
+    def set(self, name: str, value: int) -> None:
+        index, width, _ = self.library.ports[name]
+        buffer = self.buffers[name]
+        value &= (1 << width) - 1
+        for i in range(len(buffer)):
+            buffer[i] = (value >> (32 * i)) & 0xFFFFFFFF
+        self.lib.prov_port_write(self.handle, index, buffer)
+
+    def get(self, name: str) -> int:
+        index, width, _ = self.library.ports[name]
+        buffer = self.buffers[name]
+        self.lib.prov_port_read(self.handle, index, buffer)
+        value = 0
+        for i in reversed(range(len(buffer))):
+            value = (value << 32) | buffer[i]
+        return value & ((1 << width) - 1)
+
+    def toggle(self, name: str) -> None:
+        self.set(name, 0 if self.get(name) else 1)
+
+    def eval(self) -> None:
+        self.lib.prov_eval(self.handle)
+
+    def time_inc(self, add: int = 1) -> None:
+        self.lib.prov_time_inc(self.handle, add)
+
+    def close(self) -> None:
+        if self.handle:
+            self.lib.prov_model_free(self.handle)
+            self.handle = None
+
+    def __enter__(self) -> "VerilatedModel":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
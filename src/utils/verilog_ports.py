@@ -0,0 +1,367 @@
+"""
+Port model of a Verilog module header.
+
+    header = parse_module_header(open("module_header.txt").read())
+    header.port("q")            # Port(name="q", direction="output", width=8, ...)
+    header.clock, header.reset  # the clock and reset inputs, or None
+
+The header of a task is parsed once (parse_module_header is cached per header
+text) and is the reference for names and widths everywhere data used to be
+guessed from: conform_stimulus fits the stimulus of TB_Generator to it, the
+harness generators read it from ports.json of their workdir and the vector files
+of utils/sim_vectors.py are laid out from it. is_binary is the one rule of which
+values are applied and checked, for the harnesses, Icarus and lockstep alike.
+
+ANSI headers (module m(input [7:0] a, b, output reg q);) and non-ANSI headers
+(module m(a, q); input [7:0] a; ...) are supported, ranges may use parameters
+of the header.
+"""
+
+import ast
+import functools
+import json
+import operator
+import os
+import re
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Tuple
+
+RESET_NAMES = ["rst", "reset", "areset", "arst", "rst_n", "reset_n", "areset_n", "arst_n", "rstn", "resetn", "aresetn", "arstn"]
+# the module of a source with several modules whose ports are modelled
+TOP_MODULE = "top_module"
+PORTS_FILE = "ports.json"
+
+# clk, clock, clk_in, sys_clk, ...
+_CLOCK_NAME_RE = re.compile(r"(clk|clock)(_\w+)?|\w+_(clk|clock)", re.IGNORECASE)
+_COMMENT_RE = re.compile(r"//[^\n]*|/\*.*?\*/|\(\*.*?\*\)", re.S)
+_MODULE_RE = re.compile(r"\bmodule\s+(\w+)\s*")
+_RANGE_RE = re.compile(r"\[([^\[\]:]+):([^\[\]]+)\]")
+_DECL_RE = re.compile(r"\b(input|output|inout)\b([^;]*);")
+_PARAM_DECL_RE = re.compile(r"\b(?:parameter|localparam)\b([^;]*);")
+_PARAM_RE = re.compile(r"(\w+)\s*=\s*(.+)$", re.S)
+_TYPE_WORDS = {"wire", "reg", "logic", "var", "tri", "bit", "integer", "signed", "unsigned"}
+_BINARY_RE = re.compile(r"[01]+")
+
+
+@dataclass(frozen=True)
+class Port:
+    name: str
+    # "input", "output" or "inout"
+    direction: str
+    width: int
+    msb: int = 0
+    lsb: int = 0
+    signed: bool = False
+    # "clock", "reset" or "data"
+    role: str = "data"
+    active_low: bool = False
+
+    @property
+    def words(self) -> int:
+        return (self.width + 31) // 32
+
+    @property
+    def c_type(self) -> str:
+        """storage type of the port in the verilated model"""
+        if self.width <= 8:
+            return "CData"
+        if self.width <= 16:
+            return "SData"
+        if self.width <= 32:
+            return "IData"
+        if self.width <= 64:
+            return "QData"
+        return f"VlWide<{self.words}>"
+
+
+@dataclass(frozen=True)
+class ModuleHeader:
+    name: str
+    ports: Tuple[Port, ...] = ()
+    parameters: Dict[str, int] = field(default_factory=dict, hash=False)
+
+    def port(self, name: str) -> Port | None:
+        for port in self.ports:
+            if port.name == name:
+                return port
+        return None
+
+    def widths(self) -> Dict[str, int]:
+        return {port.name: port.width for port in self.ports}
+
+    @property
+    def inputs(self) -> List[Port]:
+        return [port for port in self.ports if port.direction != "output"]
+
+    @property
+    def outputs(self) -> List[Port]:
+        return [port for port in self.ports if port.direction != "input"]
+
+    @property
+    def clock(self) -> Port | None:
+        return next((port for port in self.ports if port.role == "clock"), None)
+
+    @property
+    def reset(self) -> Port | None:
+        return next((port for port in self.ports if port.role == "reset"), None)
+
+    def to_dict(self) -> Dict:
+        return {"name": self.name, "parameters": self.parameters, "ports": [asdict(port) for port in self.ports]}
+
+
+_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.floordiv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+    ast.LShift: operator.lshift,
+    ast.RShift: operator.rshift,
+}
+
+
+def _clog2(value: int) -> int:
+    return max(0, (value - 1).bit_length())
+
+
+def _eval_int(expr: str, parameters: Dict[str, int]) -> int:
+    """value of a constant range expression: integers, parameters, arithmetic and $clog2"""
+    expr = re.sub(r"\d*'[sS]?[dD](\d+)", r"\1", expr.strip())
+    expr = re.sub(r"\d*'[sS]?[hH]([0-9a-fA-F]+)", r"0x\1", expr)
+    expr = re.sub(r"\d*'[sS]?[bB]([01]+)", r"0b\1", expr)
+    expr = expr.replace("$clog2", "clog2")
+
+    def visit(node):
+        if isinstance(node, ast.Expression):
+            return visit(node.body)
+        if isinstance(node, ast.Constant) and isinstance(node.value, int):
+            return node.value
+        if isinstance(node, ast.Name) and node.id in parameters:
+            return parameters[node.id]
+        if isinstance(node, ast.BinOp) and type(node.op) in _OPERATORS:
+            return _OPERATORS[type(node.op)](visit(node.left), visit(node.right))
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            return -visit(node.operand)
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "clog2" and len(node.args) == 1:
+            return _clog2(visit(node.args[0]))
+        raise ValueError(f"Unsupported range expression: {expr}")
+
+    try:
+        return visit(ast.parse(expr, mode="eval"))
+    except SyntaxError as e:
+        raise ValueError(f"Unsupported range expression: {expr}") from e
+
+
+def _add_parameters(declarations: str, parameters: Dict[str, int]) -> None:
+    """evaluate "[parameter] [type] NAME = expr, ..." into parameters, the first value of a name wins"""
+    for item in _split_top_level(declarations):
+        match = _PARAM_RE.search(re.sub(r"\b(parameter|localparam)\b", "", item))
+        if match and match.group(1) not in parameters:
+            parameters[match.group(1)] = _eval_int(match.group(2), parameters)
+
+
+def _split_top_level(text: str) -> List[str]:
+    """split on the commas outside of brackets, braces and parentheses"""
+    items, depth, current = [], 0, []
+    for c in text:
+        if c in "([{":
+            depth += 1
+        elif c in ")]}":
+            depth -= 1
+        if c == "," and depth == 0:
+            items.append("".join(current))
+            current = []
+        else:
+            current.append(c)
+    items.append("".join(current))
+    return [item.strip() for item in items if item.strip()]
+
+
+def _matching_paren(text: str, start: int) -> int:
+    """index of the parenthesis closing the one at start"""
+    depth = 0
+    for i in range(start, len(text)):
+        if text[i] == "(":
+            depth += 1
+        elif text[i] == ")":
+            depth -= 1
+            if depth == 0:
+                return i
+    raise ValueError("Unbalanced parentheses in module header")
+
+
+def _role(name: str, direction: str, width: int) -> Tuple[str, bool]:
+    if direction != "input" or width != 1:
+        return "data", False
+    if _CLOCK_NAME_RE.fullmatch(name):
+        return "clock", False
+    if name in RESET_NAMES:
+        return "reset", name.endswith("n")
+    return "data", False
+
+
+def _declaration(direction: str, spec: str, parameters: Dict[str, int]) -> Tuple[Dict, List[str]]:
+    """(attributes, names) of a declaration "<type> [signed] [msb:lsb] name, name" after its direction"""
+    rest = spec.strip()
+    ranges, words = [], set()
+    while True:
+        # the data type, signedness and packed dimensions precede the names
+        match = re.match(r"(" + "|".join(_TYPE_WORDS) + r")\b\s*", rest)
+        if match:
+            words.add(match.group(1))
+        else:
+            match = _RANGE_RE.match(rest)
+            if not match:
+                break
+            ranges.append((_eval_int(match.group(1), parameters), _eval_int(match.group(2), parameters)))
+        rest = rest[match.end():].lstrip()
+    width, msb, lsb = 1, 0, 0
+    if ranges:
+        msb, lsb = ranges[0]
+        for dim_msb, dim_lsb in ranges:
+            width *= abs(dim_msb - dim_lsb) + 1
+    elif "integer" in words:
+        width, msb, lsb = 32, 31, 0
+    attributes = {"direction": direction, "width": width, "msb": msb, "lsb": lsb, "signed": "signed" in words or "integer" in words}
+    # unpacked dimensions and default values follow a name
+    names = [item.split("[")[0].split("=")[0].strip() for item in _split_top_level(rest)]
+    return attributes, [name for name in names if re.fullmatch(r"[A-Za-z_]\w*", name)]
+
+
+def _port(name: str, attributes: Dict) -> Port:
+    role, active_low = _role(name, attributes["direction"], attributes["width"])
+    return Port(name=name, role=role, active_low=active_low, **attributes)
+
+
+@functools.lru_cache(maxsize=256)
+def parse_module_header(source: str) -> ModuleHeader | None:
+    """
+    port model of the top_module of source (a header or a whole design), or of its first
+    module if there is no top_module, None if no module with ports is found
+    """
+    text = _COMMENT_RE.sub(" ", source)
+    modules = list(_MODULE_RE.finditer(text))
+    if not modules:
+        return None
+    module = next((m for m in modules if m.group(1) == TOP_MODULE), modules[0])
+    position = module.end()
+    try:
+        parameters: Dict[str, int] = {}
+        if text.startswith("#", position):
+            open_paren = text.index("(", position)
+            close_paren = _matching_paren(text, open_paren)
+            _add_parameters(text[open_paren + 1: close_paren], parameters)
+            position = close_paren + 1
+        open_paren = text.find("(", position)
+        if open_paren < 0 or text[position:open_paren].strip():
+            return ModuleHeader(name=module.group(1), parameters=parameters)
+        close_paren = _matching_paren(text, open_paren)
+        end = text.find("endmodule", close_paren)
+        body = text[close_paren + 1: end if end >= 0 else len(text)]
+        for declarations in _PARAM_DECL_RE.findall(body):
+            _add_parameters(declarations, parameters)
+
+        ports: List[Port] = []
+        items = _split_top_level(text[open_paren + 1: close_paren])
+        if items and re.match(r"(input|output|inout)\b", items[0]):
+            # ANSI: a name without a direction continues the previous declaration
+            attributes = None
+            for item in items:
+                match = re.match(r"(input|output|inout)\b(.*)$", item, re.S)
+                if match:
+                    attributes, names = _declaration(match.group(1), match.group(2), parameters)
+                elif attributes is not None:
+                    names = [item.split("[")[0].split("=")[0].strip()]
+                else:
+                    continue
+                ports += [_port(name, attributes) for name in names]
+        else:
+            # non-ANSI: the port list only names the ports, the body declares them
+            declared: Dict[str, Port] = {}
+            for direction, spec in _DECL_RE.findall(body):
+                attributes, names = _declaration(direction, spec, parameters)
+                declared.update({name: _port(name, attributes) for name in names})
+            ports = [declared[name] for name in items if name in declared]
+    except ValueError:
+        return None
+    return ModuleHeader(name=module.group(1), ports=tuple(ports), parameters=parameters)
+
+
+def load_port_model(dut_path: str) -> ModuleHeader | None:
+    """port model of a task: module_header.txt next to dut_path if present, else the DUT source"""
+    for path in (os.path.join(os.path.dirname(dut_path), "module_header.txt"), dut_path):
+        try:
+            with open(path, "r", errors="replace") as f:
+                header = parse_module_header(f.read())
+        except OSError:
+            continue
+        if header is not None and header.ports:
+            return header
+    return None
+
+
+def write_ports_json(header: ModuleHeader, directory: str) -> None:
+    """ports.json read by the harness generators of the simulation templates"""
+    with open(os.path.join(directory, PORTS_FILE), "w") as f:
+        json.dump(header.to_dict(), f, indent=4)
+
+
+def is_binary(value) -> bool:
+    """whether value is a binary string, values with x/z or other characters are not applied or checked"""
+    return isinstance(value, str) and _BINARY_RE.fullmatch(value) is not None
+
+
+def fit_value(value, width: int):
+    """
+    value as a binary string of width bits: integers are converted, binary strings
+    zero-extended or truncated to their low bits as on a Verilog assignment. Other
+    values (x, z, ...) are returned unchanged, they are not applied or checked.
+    """
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, int):
+        return format(value & ((1 << width) - 1), f"0{width}b")
+    if is_binary(value):
+        return value[-width:].zfill(width)
+    return value
+
+
+def conform_stimulus(stimulus: List[Dict], header: ModuleHeader | None) -> Tuple[List[Dict], List[str]]:
+    """
+    stimulus with the values of every input fitted to its width and the variables that
+    are not inputs of the header dropped, with the list of the changes made
+    """
+    if header is None or not header.ports:
+        return stimulus, []
+    inputs = {port.name: port for port in header.inputs}
+    issues = set()
+    conformed = []
+    for scenario in stimulus:
+        if not isinstance(scenario, dict):
+            conformed.append(scenario)
+            continue
+        steps = []
+        for step in scenario.get("input variable", []):
+            if not isinstance(step, dict):
+                steps.append(step)
+                continue
+            fitted = {}
+            for name, value in step.items():
+                if name == "clock cycles":
+                    fitted[name] = value
+                    continue
+                port = inputs.get(name)
+                if port is None:
+                    issues.add(f"{name} is not an input of {header.name}, dropped")
+                    continue
+                fitted[name] = [fit_value(v, port.width) for v in value] if isinstance(value, list) else fit_value(value, port.width)
+                if fitted[name] != value:
+                    issues.add(f"values of {name} fitted to {port.width} bits")
+            missing = [p.name for p in inputs.values() if p.role != "clock" and p.name not in step]
+            if missing:
+                issues.add(f"inputs missing in some steps: {', '.join(missing)}")
+            steps.append(fitted)
+        conformed.append(dict(scenario, **{"input variable": steps}))
+    return conformed, sorted(issues)
@@ -0,0 +1,45 @@
+"""
+Anthropic models on Vertex AI with explicit service account credentials.
+
+Kept apart from utils.utils so that the anthropic SDK is only imported when
+get_llm selects the "vertexanthropic" provider.
+"""
+
+import anthropic
+from llama_index.llms.anthropic import Anthropic
+
+
+class VertexAnthropicWithCredentials(Anthropic):
+    def __init__(self, credentials, **kwargs):
+        """
+        In addition to all parameters accepted by Anthropic, this class accepts a
+        new parameter `credentials` that will be passed to the underlying clients.
+        """
+        # Pop parameters that determine client type so we can reuse them in our branch.
+        region = kwargs.get("region")
+        project_id = kwargs.get("project_id")
+        aws_region = kwargs.get("aws_region")
+
+        # Call the parent initializer; this sets up a default _client and _aclient.
+        super().__init__(**kwargs)
+
+        # If using AnthropicVertex (i.e., region and project_id are provided and aws_region is None),
+        # override the _client and _aclient with the additional credentials parameter.
+        if region and project_id and not aws_region:
+            self._client = anthropic.AnthropicVertex(
+                region=region,
+                project_id=project_id,
+                credentials=credentials,  # extra argument
+                timeout=self.timeout,
+                max_retries=self.max_retries,
+                default_headers=kwargs.get("default_headers")
+            )
+            self._aclient = anthropic.AsyncAnthropicVertex(
+                region=region,
+                project_id=project_id,
+                credentials=credentials,  # extra argument
+                timeout=self.timeout,
+                max_retries=self.max_retries,
+                default_headers=kwargs.get("default_headers")
+            )
+        # Optionally, you could add similar overrides for the aws_region branch if needed.
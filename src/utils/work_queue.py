@@ -0,0 +1,223 @@
+"""
+SQLite work queue of the tasks of a sweep, on storage shared by the workers.
+
+With "queue_path" set, generate.py on every node enqueues the tasks of its sweep
+(run_identifier), already queued tasks are left as they are, and its workers lease
+them one at a time, longest expected first. A worker heartbeats its lease while
+it runs the task and marks it done with its outcome, the artifacts and the ledger
+record go to the shared artifact store and ledger. The lease of a worker that
+died or lost its storage expires after LEASE_SECONDS without a heartbeat and
+the task is leased again, at most MAX_ATTEMPTS times before it is marked failed.
+
+    queue = WorkQueue("/shared/queue.db")
+    queue.enqueue("gen_tb", [150, 155], priorities={150: 600.0, 155: 90.0})
+    lease = queue.lease("gen_tb", worker)
+    with queue.heartbeat(lease) as lost:
+        ...  # raise LeaseLost between stages once lost is set
+    queue.complete(lease, passed=True)
+
+Network filesystems do not support the shared memory of a WAL journal, the queue
+uses a rollback journal. Lease deadlines are wall-clock times, the clocks of the
+nodes must agree to well within LEASE_SECONDS.
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterator, List
+
+from utils.log_utils import get_logger
+
+logger = get_logger(__name__)
+
+# seconds without a heartbeat after which a lease expires
+LEASE_SECONDS = float(os.environ.get("PROV_QUEUE_LEASE_SECONDS", "600"))
+# leases of a task before it is marked failed
+MAX_ATTEMPTS = int(os.environ.get("PROV_QUEUE_MAX_ATTEMPTS", "3"))
+# seconds an idle worker waits for the leases of other workers to finish or expire
+POLL_SECONDS = float(os.environ.get("PROV_QUEUE_POLL_SECONDS", "30"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue (
+    sweep TEXT NOT NULL,
+    task TEXT NOT NULL,
+    priority REAL NOT NULL DEFAULT 0,
+    -- pending, leased, done or failed
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_expires REAL,
+    enqueued REAL NOT NULL,
+    finished REAL,
+    passed INTEGER,
+    error TEXT,
+    PRIMARY KEY (sweep, task)
+);
+CREATE INDEX IF NOT EXISTS queue_by_state ON queue (sweep, state, priority);
+"""
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class LeaseLost(Exception):
+    """raised by a task that stops because its lease expired and another worker may run it"""
+
+
+@dataclass
+class Lease:
+    sweep: str
+    task: object
+    worker: str
+    attempt: int
+
+
+class WorkQueue:
+    def __init__(self, path: str, lease_seconds: float = LEASE_SECONDS, max_attempts: int = MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # autocommit, the transactions are opened with BEGIN IMMEDIATE so two workers never lease the same task
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=DELETE")
+            self.conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _write(self) -> Iterator[sqlite3.Connection]:
+        with self.lock:
+            conn = self.conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def enqueue(self, sweep: str, tasks: List, priorities: Dict | None = None) -> int:
+        """add the tasks not queued yet, returns how many were added"""
+        now = time.time()
+        priorities = priorities or {}
+        with self._write() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO queue (sweep, task, priority, state, enqueued) VALUES (?, ?, ?, 'pending', ?)",
+                [(sweep, json.dumps(task), priorities.get(task, 0.0), now) for task in tasks],
+            )
+            return conn.total_changes - before
+
+    def _reclaim(self, conn: sqlite3.Connection, sweep: str, now: float) -> None:
+        expired = conn.execute(
+            "SELECT task, worker FROM queue WHERE sweep = ? AND state = 'leased' AND lease_expires < ?", (sweep, now)
+        ).fetchall()
+        for row in expired:
+            logger.warning(f"Lease of task {json.loads(row['task'])} by {row['worker']} expired")
+        conn.execute(
+            "UPDATE queue SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,"
+            " error = CASE WHEN attempts >= ? THEN 'lease expired' ELSE error END, worker = NULL"
+            " WHERE sweep = ? AND state = 'leased' AND lease_expires < ?",
+            (self.max_attempts, self.max_attempts, sweep, now),
+        )
+
+    def lease(self, sweep: str, worker: str) -> Lease | None:
+        """lease the pending task of the highest priority, reclaiming expired leases first"""
+        now = time.time()
+        with self._write() as conn:
+            self._reclaim(conn, sweep, now)
+            row = conn.execute(
+                "SELECT task, attempts FROM queue WHERE sweep = ? AND state = 'pending'"
+                " ORDER BY priority DESC, enqueued LIMIT 1",
+                (sweep,),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE queue SET state = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1"
+                " WHERE sweep = ? AND task = ?",
+                (worker, now + self.lease_seconds, sweep, row["task"]),
+            )
+        return Lease(sweep, json.loads(row["task"]), worker, row["attempts"] + 1)
+
+    def _update_lease(self, lease: Lease, assignments: str, values: tuple) -> bool:
+        """update the task if lease still holds it, False if the lease expired and was taken over"""
+        with self._write() as conn:
+            cursor = conn.execute(
+                f"UPDATE queue SET {assignments} WHERE sweep = ? AND task = ? AND state = 'leased' AND worker = ?",
+                values + (lease.sweep, json.dumps(lease.task), lease.worker),
+            )
+            return cursor.rowcount == 1
+
+    def renew(self, lease: Lease) -> bool:
+        return self._update_lease(lease, "lease_expires = ?", (time.time() + self.lease_seconds,))
+
+    def complete(self, lease: Lease, passed: bool) -> bool:
+        return self._update_lease(
+            lease, "state = 'done', passed = ?, finished = ?, lease_expires = NULL", (int(passed), time.time())
+        )
+
+    def release(self, lease: Lease, error: str) -> bool:
+        """give a task that raised back to the queue, it is failed after max_attempts"""
+        return self._update_lease(
+            lease,
+            "state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, error = ?, worker = NULL,"
+            " lease_expires = NULL, finished = ?",
+            (self.max_attempts, error, time.time()),
+        )
+
+    @contextmanager
+    def heartbeat(self, lease: Lease) -> Iterator[threading.Event]:
+        """renew lease in a thread while the block runs, the event is set if the lease was lost"""
+        stop = threading.Event()
+        lost = threading.Event()
+
+        def beat():
+            while not stop.wait(self.lease_seconds / 3):
+                try:
+                    if not self.renew(lease):
+                        logger.warning(f"Lost the lease of task {lease.task}, another worker may run it")
+                        lost.set()
+                        return
+                except sqlite3.Error as e:
+                    # the storage may come back before the lease expires
+                    logger.warning(f"Cannot renew the lease of task {lease.task}: {e}")
+
+        thread = threading.Thread(target=beat, name=f"heartbeat-{lease.task}", daemon=True)
+        thread.start()
+        try:
+            yield lost
+        finally:
+            stop.set()
+            thread.join()
+
+    def unfinished(self, sweep: str) -> int:
+        """pending and leased tasks of a sweep"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM queue WHERE sweep = ? AND state IN ('pending', 'leased')", (sweep,)
+            ).fetchone()[0]
+
+    def counts(self, sweep: str) -> Dict[str, int]:
+        """state -> number of tasks of a sweep"""
+        with self.lock:
+            rows = self.conn.execute("SELECT state, COUNT(*) FROM queue WHERE sweep = ? GROUP BY state", (sweep,)).fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    def passed_tasks(self, sweep: str) -> List:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT task FROM queue WHERE sweep = ? AND state = 'done' AND passed = 1", (sweep,)
+            ).fetchall()
+        return [json.loads(row["task"]) for row in rows]
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()